@@ -0,0 +1,389 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+import metrics
+import tracing
+from cursor_store import format_ts
+from rocketchat_bot import (
+    DELTA_UNSUPPORTED_STATUSES,
+    HISTORY_PAGE_SIZE,
+    OFFLINE_STATUS,
+    ONLINE_STATUS,
+    RocketChatBot,
+    get_backoff_delay,
+)
+
+# Сколько секунд ждать отправки сообщения из потока обработчика
+SEND_TIMEOUT = 30.0
+# Ошибки, при которых запрос точно не дошел до сервера
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class AsyncRocketChatBot(RocketChatBot):
+    """Бот, работающий в цикле событий asyncio и обрабатывающий комнаты параллельно"""
+
+    def __init__(
+        self,
+        *args,
+        max_concurrency: int = 16,
+        executor_workers: int = 16,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.max_concurrency: int = max_concurrency
+        # Блокирующие вызовы Jira и БД выполняются в ограниченном пуле потоков
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=executor_workers, thread_name_prefix='bot-worker'
+        )
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Set[str] = set()
+        # Последние сообщения комнат, изменившихся во время их обработки
+        self._deferred: Dict[str, Dict[str, Any]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.started_at: Optional[float] = None
+        self.rooms_processed: int = 0
+
+    async def request_async(
+        self,
+        method: str,
+        endpoint: str,
+        relogin: bool = True,
+        idempotent: bool = True,
+        **kwargs,
+    ) -> httpx.Response:
+        """Выполнить запрос к REST API с повторами при сбоях и повторным входом при 401"""
+        histogram = metrics.ROCKETCHAT_REQUEST_SECONDS.labels(endpoint)
+        attempt: int = 0
+        with tracing.span(
+            'rocketchat.request', endpoint=endpoint, method=method
+        ) as request_span:
+            while True:
+                if not self.rate_limiter.try_acquire(endpoint):
+                    await self.rate_limiter.acquire_async(endpoint)
+                start: float = time.perf_counter()
+                try:
+                    # Таймаут берется на каждый запрос: request_timeout меняется на ходу
+                    response = await self.client.request(
+                        method, endpoint, timeout=self.request_timeout, **kwargs
+                    )
+                except httpx.TransportError as ex:
+                    histogram.observe(time.perf_counter() - start)
+                    # Неидемпотентный запрос повторяем, только если он не ушел на сервер
+                    if attempt >= self.max_retries or not (
+                        idempotent or isinstance(ex, CONNECT_ERRORS)
+                    ):
+                        raise
+                else:
+                    histogram.observe(time.perf_counter() - start)
+                    request_span.set_attribute(
+                        'http.status_code', response.status_code
+                    )
+                    self.rate_limiter.update_from_headers(
+                        endpoint, response.status_code, response.headers
+                    )
+                    if response.status_code == 429 and attempt < self.max_retries:
+                        # Паузу до следующей попытки выдержит ограничитель частоты
+                        attempt += 1
+                        continue
+                    if response.status_code == 401 and relogin:
+                        # Токен истек - входим заново и повторяем запрос один раз
+                        relogin = False
+                        await self.get_auth_token_async()
+                        continue
+                    if (
+                        response.status_code < 500
+                        or attempt >= self.max_retries
+                        or not idempotent
+                    ):
+                        request_span.set_attribute('attempts', attempt + 1)
+                        response.raise_for_status()
+                        return response
+                await asyncio.sleep(get_backoff_delay(attempt))
+                attempt += 1
+
+    async def get_auth_token_async(self) -> None:
+        """Получить токен авторизации бота"""
+        response = await self.request_async(
+            'POST',
+            'login',
+            relogin=False,
+            json={'user': self.username, 'password': self.password},
+        )
+        self.auth_token = response.json()['data']['authToken']
+        self.client.headers.update(
+            {'X-Auth-Token': self.auth_token, 'X-User-Id': self.bot_id}
+        )
+
+    async def login_async(self) -> None:
+        """Войти и поставить статус online, повторяя попытки, пока Rocket.Chat недоступен"""
+        attempt: int = 0
+        while not self._stopping:
+            try:
+                await self.get_auth_token_async()
+                await self.set_status_async(ONLINE_STATUS)
+                return
+            except (httpx.HTTPError, KeyError, ValueError) as ex:
+                metrics.ERRORS.labels(type(ex).__name__).inc()
+                delay: float = get_backoff_delay(attempt)
+                logging.warning(
+                    f'Не удалось войти в Rocket.Chat, повтор через {delay:.1f} с: {ex}'
+                )
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def set_status_async(self, status_name: str) -> None:
+        """Задать статус бота"""
+        await self.request_async(
+            'POST', 'users.setStatus', json={'status': status_name}
+        )
+
+    async def send_message_async(self, data: Dict[str, Any]) -> None:
+        """Отправить сообщение в чат"""
+        await self.request_async(
+            'POST', 'chat.postMessage', idempotent=False, json=data
+        )
+
+    async def get_direct_messages_async(self) -> List[Dict[str, Any]]:
+        """Получить все личные чаты с последними сообщениями постранично"""
+        dms: List[Dict[str, Any]] = []
+        offset: int = 0
+        while True:
+            response = await self.request_async(
+                'GET', 'im.list', params=self.get_dm_page_params(offset)
+            )
+            data: Dict[str, Any] = response.json()
+            page: List[Dict[str, Any]] = data['ims']
+            dms.extend(page)
+            offset += len(page)
+            if self.is_last_dm_page(data, page, offset):
+                break
+        self.room_sync.on_full_sync(dms)
+        return dms
+
+    async def get_updated_direct_messages_async(self) -> List[Dict[str, Any]]:
+        """Получить личные чаты, изменившиеся с прошлого опроса"""
+        if self.room_sync.needs_full_sync():
+            return await self.get_direct_messages_async()
+        try:
+            response = await self.request_async(
+                'GET',
+                'rooms.get',
+                params={'updatedSince': self.room_sync.get_updated_since()},
+            )
+        except httpx.HTTPStatusError as ex:
+            if ex.response.status_code not in DELTA_UNSUPPORTED_STATUSES:
+                raise
+            self.on_delta_unsupported(ex.response.status_code)
+            return await self.get_direct_messages_async()
+        return self.get_updated_rooms(response.json())
+
+    async def get_room_history_async(
+        self, room_id: str, oldest: int
+    ) -> List[Dict[str, Any]]:
+        """Получить сообщения комнаты новее oldest (мс) в хронологическом порядке"""
+        messages: List[Dict[str, Any]] = []
+        offset: int = 0
+        while True:
+            params: Dict[str, Any] = {
+                'roomId': room_id,
+                'oldest': format_ts(oldest),
+                'count': HISTORY_PAGE_SIZE,
+                'offset': offset,
+            }
+            response = await self.request_async('GET', 'im.history', params=params)
+            page: List[Dict[str, Any]] = response.json()['messages']
+            messages.extend(page)
+            if len(page) < HISTORY_PAGE_SIZE:
+                break
+            offset += len(page)
+        # API отдает сообщения от новых к старым
+        messages.reverse()
+        return messages
+
+    async def replay_missed_messages_async(self) -> None:
+        """Обработать сообщения, пришедшие пока бот был недоступен"""
+        try:
+            dms: List[Dict[str, Any]] = await self.get_direct_messages_async()
+        except httpx.HTTPError as ex:
+            metrics.ERRORS.labels(type(ex).__name__).inc()
+            logging.exception(f'Возникло исключение: {ex}')
+            return
+        for dm in dms:
+            if 'lastMessage' not in dm:
+                continue
+            room_id: str = dm['_id']
+            cursor = self.cursors.get(room_id)
+            if cursor is not None and self.cursors.is_new(
+                room_id, dm['lastMessage']
+            ):
+                # Комната уже знакома - догружаем всю историю после курсора
+                try:
+                    messages: List[
+                        Dict[str, Any]
+                    ] = await self.get_room_history_async(room_id, cursor[1])
+                except httpx.HTTPError as ex:
+                    metrics.ERRORS.labels(type(ex).__name__).inc()
+                    logging.exception(f'Возникло исключение: {ex}')
+                    continue
+                for message in messages:
+                    if 'u' in message and not message.get('t'):
+                        await self.handle_message_async(room_id, message)
+            else:
+                await self.handle_message_async(room_id, dm['lastMessage'])
+
+    async def handle_message_async(
+        self, room_id: str, message: Dict[str, Any]
+    ) -> bool:
+        """Обработать сообщение в пуле потоков, сохранив текущую трассу"""
+        # run_in_executor не переносит contextvars: без копии контекста
+        # обработка сообщения начинает новую трассу вместо bot.poll
+        context: contextvars.Context = contextvars.copy_context()
+        return await self.loop.run_in_executor(
+            self.executor, context.run, self.handle_message, room_id, message
+        )
+
+    def send_message(self, data: Dict[str, Any]) -> None:
+        """Отправить сообщение из потока обработчика через цикл событий"""
+        if threading.get_ident() == self._loop_thread_id:
+            raise RuntimeError('send_message нельзя вызывать из цикла событий')
+        parent: Optional[tracing.Span] = tracing.get_current_span()
+
+        async def send() -> None:
+            # Запрос попадает в трассу стадии, из которой отправлено сообщение
+            with tracing.use_span(parent):
+                await self.send_message_async(data)
+
+        future = asyncio.run_coroutine_threadsafe(send(), self.loop)
+        try:
+            future.result(SEND_TIMEOUT)
+        except httpx.HTTPError as ex:
+            logging.exception(f'Возникло исключение: {ex}')
+
+    def dispatch(self, room_id: str, message: Dict[str, Any]) -> bool:
+        """Запланировать обработку сообщения, если комната сейчас не занята"""
+        if not self.owns_room(room_id) or not self.cursors.is_new(
+            room_id, message
+        ):
+            return False
+        if room_id in self._inflight:
+            # Следующий опрос эту комнату может уже не вернуть - обработаем после текущего
+            self._deferred[room_id] = message
+            return True
+        self._inflight.add(room_id)
+        task: asyncio.Task = asyncio.create_task(
+            self.process_room(room_id, message)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def process_room(self, room_id: str, message: Dict[str, Any]) -> None:
+        """Обработать сообщение комнаты в пуле потоков"""
+        try:
+            async with self._semaphore:
+                await self.handle_message_async(room_id, message)
+            self.rooms_processed += 1
+        except Exception as ex:
+            metrics.ERRORS.labels(type(ex).__name__).inc()
+            logging.exception(f'Ошибка обработки комнаты {room_id}: {ex}')
+        finally:
+            self._inflight.discard(room_id)
+            deferred: Optional[Dict[str, Any]] = self._deferred.pop(room_id, None)
+            if deferred is not None and not self._stopping:
+                self.dispatch(room_id, deferred)
+
+    async def poll_once(self) -> int:
+        """Получить изменившиеся личные чаты и разослать новые сообщения на обработку"""
+        start: float = time.perf_counter()
+        dispatched: int = 0
+        with tracing.span('bot.poll') as poll_span:
+            try:
+                dms: List[
+                    Dict[str, Any]
+                ] = await self.get_updated_direct_messages_async()
+            except httpx.HTTPError as ex:
+                metrics.ERRORS.labels(type(ex).__name__).inc()
+                poll_span.record_exception(ex)
+                logging.exception(f'Возникло исключение: {ex}')
+                return 0
+            poll_span.set_attribute('rooms', len(dms))
+            for dm in dms:
+                if 'lastMessage' in dm and self.dispatch(
+                    dm['_id'], dm['lastMessage']
+                ):
+                    dispatched += 1
+        metrics.POLL_ITERATION_SECONDS.observe(time.perf_counter() - start)
+        return dispatched
+
+    async def run_async(self) -> None:
+        """Запустить бота в текущем цикле событий"""
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url, timeout=self.request_timeout
+        )
+        self.started_at = time.monotonic()
+        if self.realtime_enabled:
+            logging.warning(
+                'Асинхронный бот не поддерживает Realtime API, используется опрос'
+            )
+        try:
+            await self.login_async()
+            if self._stopping:
+                return
+            if self.shard is not None:
+                await self.loop.run_in_executor(self.executor, self.shard.start)
+            await self.loop.run_in_executor(self.executor, self.cursors.load)
+            self.outbox.start()
+            # Догрузка идет через клиент цикла событий: у синхронной сессии
+            # нет токена, полученного login_async
+            await self.replay_missed_messages_async()
+            while not self._stopping:
+                dispatched: int = await self.poll_once()
+                # Пока пользователи пишут, опрос частый, в простое реже
+                await asyncio.sleep(self.polling.record(dispatched > 0))
+        finally:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            # Ответы по задачам из последнего пакета уходят через еще открытый клиент
+            await self.loop.run_in_executor(self.executor, self.outbox.stop)
+            if self.shard is not None:
+                await self.loop.run_in_executor(self.executor, self.shard.stop)
+            try:
+                if self.is_last_worker():
+                    await self.set_status_async(OFFLINE_STATUS)
+            except httpx.HTTPError as ex:
+                logging.exception(f'Возникло исключение: {ex}')
+            await self.client.aclose()
+            self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить статистику пропускной способности"""
+        elapsed: float = (
+            time.monotonic() - self.started_at if self.started_at else 0.0
+        )
+        return {
+            'rooms_processed': self.rooms_processed,
+            'rooms_in_flight': len(self._inflight),
+            'max_concurrency': self.max_concurrency,
+            'uptime': round(elapsed, 3),
+            'rooms_per_sec': round(self.rooms_processed / elapsed, 3)
+            if elapsed
+            else 0.0,
+            'rate_limiter': self.rate_limiter.stats(),
+            'shard': self.shard.stats() if self.shard is not None else None,
+            'outbox': self.outbox.stats(),
+            'room_sync': self.room_sync.stats(),
+            'poll_interval': self.polling.current,
+        }
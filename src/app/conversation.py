@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, List, Optional
+
+import database
+
+# Как часто проверять диалоги на простой (секунды)
+EVICTION_INTERVAL = 60.0
+
+
+class Conversation:
+    """Класс для представления состояния диалога создания задачи в одной комнате"""
+
+    __slots__ = (
+        'room_id',
+        'stage',
+        'project_name',
+        'summary',
+        'description',
+        'created_at',
+        'updated_at',
+    )
+
+    def __init__(
+        self,
+        room_id: str,
+        stage: int = 0,
+        project_name: Optional[str] = None,
+        summary: Optional[str] = None,
+        description: Optional[str] = None,
+        created_at: Optional[float] = None,
+        updated_at: Optional[float] = None,
+    ):
+        now: float = time.time()
+        self.room_id: str = room_id
+        self.stage: int = stage
+        self.project_name: Optional[str] = project_name
+        self.summary: Optional[str] = summary
+        self.description: Optional[str] = description
+        self.created_at: float = created_at or now
+        self.updated_at: float = updated_at or now
+
+    def reset(self) -> None:
+        """Сбросить черновик задачи и вернуться на начальную стадию"""
+        self.stage = 0
+        self.project_name = None
+        self.summary = None
+        self.description = None
+
+
+class ConversationStore:
+    """Хранилище диалогов по id комнаты с вытеснением простаивающих и ограничением размера"""
+
+    def __init__(
+        self,
+        idle_timeout: float = 3600.0,
+        max_size: int = 10000,
+        persist: bool = False,
+    ):
+        self.idle_timeout: float = idle_timeout
+        self.max_size: int = max_size
+        # Сохранять черновики в БД, чтобы они переживали перезапуск и вытеснение
+        self.persist: bool = persist
+        self._items: 'OrderedDict[str, Conversation]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._last_eviction: float = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, room_id: str) -> Conversation:
+        """Получить диалог комнаты, создав новый при отсутствии"""
+        self.evict_idle()
+        with self._lock:
+            conversation: Optional[Conversation] = self._items.get(room_id)
+            if conversation is not None:
+                self._items.move_to_end(room_id)
+                return conversation
+
+        if self.persist:
+            record = database.load_conversation(room_id)
+            if record is not None:
+                conversation = Conversation(
+                    room_id,
+                    record.stage,
+                    record.project_name,
+                    record.summary,
+                    record.description,
+                    record.created_at.timestamp(),
+                    record.updated_at.timestamp(),
+                )
+        if conversation is None:
+            conversation = Conversation(room_id)
+
+        with self._lock:
+            # Другой поток мог успеть добавить диалог, пока шло обращение к БД
+            existing: Optional[Conversation] = self._items.get(room_id)
+            if existing is not None:
+                return existing
+            self._items[room_id] = conversation
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return conversation
+
+    def save(self, conversation: Conversation) -> None:
+        """Зафиксировать изменения диалога"""
+        conversation.updated_at = time.time()
+        if self.persist:
+            database.save_conversation(
+                conversation.room_id,
+                conversation.stage,
+                conversation.project_name,
+                conversation.summary,
+                conversation.description,
+                datetime.fromtimestamp(conversation.created_at),
+                datetime.fromtimestamp(conversation.updated_at),
+            )
+
+    def retain(self, predicate: Callable[[str], bool]) -> List[str]:
+        """Оставить в памяти только диалоги комнат, для которых predicate истинен"""
+        with self._lock:
+            removed: List[str] = [
+                room_id for room_id in self._items if not predicate(room_id)
+            ]
+            for room_id in removed:
+                del self._items[room_id]
+        return removed
+
+    def evict_idle(self, force: bool = False) -> List[str]:
+        """Убрать из памяти диалоги, простаивающие дольше idle_timeout"""
+        now: float = time.monotonic()
+        if not force and now - self._last_eviction < EVICTION_INTERVAL:
+            return []
+        self._last_eviction = now
+        deadline: float = time.time() - self.idle_timeout
+        with self._lock:
+            evicted: List[str] = [
+                room_id
+                for room_id, conversation in self._items.items()
+                if conversation.updated_at < deadline
+            ]
+            for room_id in evicted:
+                del self._items[room_id]
+        if self.persist:
+            database.delete_conversations_before(
+                datetime.fromtimestamp(deadline)
+            )
+        return evicted
@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import database
+
+
+def parse_ts(ts: Any) -> int:
+    """Получить время в миллисекундах (REST API и Realtime API отдают его по-разному)"""
+    if isinstance(ts, dict):
+        return int(ts['$date'])
+    parsed: datetime = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    return int(parsed.timestamp() * 1000)
+
+
+def get_message_ts(message: Dict[str, Any]) -> int:
+    """Получить время сообщения в миллисекундах"""
+    return parse_ts(message['ts'])
+
+
+def format_ts(ts: int) -> str:
+    """Преобразовать время в миллисекундах в формат ISO 8601, принимаемый REST API"""
+    moment: datetime = datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{ts % 1000:03d}Z'
+
+
+class CursorStore:
+    """Курсоры комнат: последнее обработанное сообщение в каждом личном чате"""
+
+    def __init__(self):
+        # room_id -> (id сообщения, время сообщения в миллисекундах)
+        self._cursors: Dict[str, Tuple[str, int]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def load(self) -> None:
+        """Загрузить сохраненные курсоры из БД"""
+        cursors: Dict[str, Tuple[str, int]] = database.get_room_cursors()
+        with self._lock:
+            self._cursors.update(cursors)
+
+    def get(self, room_id: str) -> Optional[Tuple[str, int]]:
+        """Получить курсор комнаты"""
+        with self._lock:
+            return self._cursors.get(room_id)
+
+    def is_new(self, room_id: str, message: Dict[str, Any]) -> bool:
+        """Проверить, что сообщение еще не было обработано"""
+        cursor: Optional[Tuple[str, int]] = self.get(room_id)
+        if cursor is None:
+            return True
+        message_id, ts = cursor
+        message_ts: int = get_message_ts(message)
+        return message_ts > ts or (
+            message_ts == ts and message['_id'] != message_id
+        )
+
+    def advance(self, room_id: str, message: Dict[str, Any]) -> None:
+        """Сдвинуть курсор комнаты на сообщение и сохранить его в БД"""
+        cursor: Tuple[str, int] = (message['_id'], get_message_ts(message))
+        with self._lock:
+            current: Optional[Tuple[str, int]] = self._cursors.get(room_id)
+            if current is not None and current[1] > cursor[1]:
+                return
+            self._cursors[room_id] = cursor
+        database.save_room_cursor(room_id, *cursor)
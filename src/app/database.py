@@ -1,192 +1,956 @@
-from datetime import datetime
-from typing import Any, List, Tuple, Dict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date, datetime
+from typing import (
+    Any,
+    AsyncIterator,
+    Iterator,
+    List,
+    Tuple,
+    Dict,
+    Optional,
+)
+import atexit
+import functools
 import logging
-import json
+import threading
+import uuid
 
 from sqlalchemy import (
+    and_,
+    bindparam,
     create_engine,
+    func,
+    insert,
+    or_,
+    select,
+    update,
     Column,
     Integer,
     String,
     DateTime,
     Boolean,
+    BigInteger,
+    Text,
+    Index,
+    Date,
+)
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import Session as OrmSession, scoped_session, sessionmaker
+from sqlalchemy.sql import Select
+from sqlalchemy.exc import (
+    InterfaceError,
+    OperationalError,
+    SQLAlchemyError,
+    TimeoutError as PoolTimeoutError,
 )
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.engine.url import URL
 
+from metrics import DB_POOL, DB_QUERY_SECONDS, ERRORS, timed
+from settings import ConfigError, settings
+from tracing import instrument_engine
+from user_cache import UserCache, UserProfile
+from write_queue import WriteBehindQueue
+
 Base: Any = declarative_base()
 
+# Время жизни записи в кэше пользователей (секунды) и максимальный размер кэша
+USER_CACHE_TTL: float = 60.0
+USER_CACHE_MAX_SIZE: int = 10000
+
+# Кэш статусов пользователей для проверок при обработке каждого сообщения
+user_cache: UserCache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL)
+
+# Размер пачки и максимальная задержка (секунды) отложенной записи в БД
+WRITE_BATCH_SIZE: int = 100
+WRITE_FLUSH_INTERVAL: float = 1.0
+
+# Сколько строк за раз читать из курсора при выгрузке истории
+EXPORT_BATCH_SIZE: int = 1000
+
+# Статусы задач в outbox: ждет создания в Jira, создана, создать не удалось
+OUTBOX_PENDING: str = 'pending'
+OUTBOX_DONE: str = 'done'
+OUTBOX_FAILED: str = 'failed'
+
+# Асинхронные драйверы для веб-обработчиков по синхронному drivername из конфигурации
+ASYNC_DRIVERS: Dict[str, str] = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'mysql+mysqldb': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+class DatabaseError(SQLAlchemyError):
+    """Ошибка конфигурации или подключения к базе данных"""
+
+
+def log_db_error(ex: Exception) -> None:
+    """Записать ошибку операции с базой данных в лог и в счетчик ошибок"""
+    ERRORS.labels(type(ex).__name__).inc()
+    logging.error(f'Возникла ошибка при выполнении операции с базой данных: {ex}')
 
-def create_session() -> sessionmaker:
-    """Создать сессию для работы с базой данных"""
-    try:
-        with open('src/data/config_mysql.json') as db_config_file:
-            config_data: Dict[str, Any] = json.load(db_config_file)
 
-        drivername: str = config_data['drivername']
-        username: str = config_data['username']
-        password: str = config_data['password']
-        host: str = config_data['host']
-        port: int = config_data['port']
-        database: str = config_data['database']
+# Общий для процесса движок с пулом соединений, создается при первом обращении
+_engine: Optional[Engine] = None
+_engine_lock: threading.Lock = threading.Lock()
+# Асинхронный движок веб-обработчиков с собственным пулом
+_async_engine: Optional[AsyncEngine] = None
+_async_sessionmaker: Optional[async_sessionmaker] = None
+# Конфигурация, по которой созданы движки
+_db_config: Optional[Dict[str, Any]] = None
 
-        url_object: URL = URL.create(
-            drivername, username, password, host, port, database
+# Потокобезопасная фабрика сессий: у потока бота и у каждого потока FastAPI своя сессия
+Session: scoped_session = scoped_session(sessionmaker())
+
+
+def get_db_url(config_data: Dict[str, Any], drivername: str) -> URL:
+    """Получить URL базы данных из конфигурации"""
+    return URL.create(
+        drivername,
+        config_data['username'] or None,
+        config_data['password'] or None,
+        config_data['host'] or None,
+        config_data['port'] or None,
+        config_data['database'],
+    )
+
+
+def get_pool_options(config_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Получить параметры пула соединений из конфигурации"""
+    return {
+        'pool_size': config_data.get('pool_size', 5),
+        'max_overflow': config_data.get('max_overflow', 10),
+        'pool_timeout': config_data.get('pool_timeout', 30),
+        'pool_recycle': config_data.get('pool_recycle', 3600),
+        'pool_pre_ping': config_data.get('pool_pre_ping', True),
+    }
+
+
+def create_db_engine(config_data: Dict[str, Any]) -> Engine:
+    """Создать движок с пулом соединений по параметрам из конфигурации"""
+    engine: Engine = create_engine(
+        get_db_url(config_data, config_data['drivername']),
+        echo=False,
+        **get_pool_options(config_data),
+    )
+    instrument_engine(engine)
+    return engine
+
+
+def create_async_db_engine(config_data: Dict[str, Any]) -> AsyncEngine:
+    """Создать асинхронный движок по той же конфигурации, что и синхронный"""
+    drivername: Optional[str] = config_data.get(
+        'async_drivername'
+    ) or ASYNC_DRIVERS.get(config_data['drivername'])
+    if drivername is None:
+        raise DatabaseError(
+            f'Нет асинхронного драйвера для {config_data["drivername"]}, '
+            'укажите async_drivername в config_mysql.json'
         )
-        engine = create_engine(url_object, echo=False)
+    engine: AsyncEngine = create_async_engine(
+        get_db_url(config_data, drivername),
+        echo=False,
+        **get_pool_options(config_data),
+    )
+    # События SQLAlchemy приходят от синхронного движка внутри асинхронного
+    instrument_engine(engine.sync_engine)
+    return engine
 
-        Session: sessionmaker = sessionmaker(bind=engine)
-        session: sessionmaker = Session()
 
-        return session
-    except (FileNotFoundError, KeyError, SQLAlchemyError) as ex:
-        logging.error(f'Ошибка при создании сессии базы данных: {ex}')
-        return None
+def load_db_config() -> Dict[str, Any]:
+    """Загрузить параметры подключения к БД (один раз на процесс)"""
+    global _db_config
+    if _db_config is None:
+        try:
+            _db_config = settings.db.as_dict()
+        except ConfigError as ex:
+            raise DatabaseError(
+                f'Ошибка при чтении конфигурации базы данных: {ex}'
+            ) from ex
+    return _db_config
+
+
+def on_db_config_change(section) -> None:
+    # Пулы уже открыты по старым параметрам, пересоздавать их на ходу небезопасно
+    if _engine is not None or _async_engine is not None:
+        logging.warning(
+            'Параметры подключения к БД изменены, они вступят в силу после перезапуска'
+        )
+
 
+settings.db.subscribe(on_db_config_change)
 
-def close_session(session) -> None:
-    """Закрыть сессию базы данных"""
+
+def get_engine() -> Engine:
+    """Получить движок базы данных, создав его при первом обращении"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                try:
+                    engine: Engine = create_db_engine(load_db_config())
+                except (KeyError, SQLAlchemyError) as ex:
+                    raise DatabaseError(
+                        f'Ошибка при создании движка базы данных: {ex}'
+                    ) from ex
+                Session.configure(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """Получить асинхронный движок базы данных, создав его при первом обращении"""
+    global _async_engine, _async_sessionmaker
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                try:
+                    engine: AsyncEngine = create_async_db_engine(
+                        load_db_config()
+                    )
+                except (KeyError, ImportError, SQLAlchemyError) as ex:
+                    raise DatabaseError(
+                        f'Ошибка при создании асинхронного движка базы данных: {ex}'
+                    ) from ex
+                _async_sessionmaker = async_sessionmaker(
+                    engine, expire_on_commit=False
+                )
+                _async_engine = engine
+    return _async_engine
+
+
+def configure_engine(config_data: Dict[str, Any]) -> Engine:
+    """Создать движок по переданной конфигурации вместо config_mysql.json"""
+    global _engine, _db_config
+    with _engine_lock:
+        engine: Engine = create_db_engine(config_data)
+        Session.configure(bind=engine)
+        _engine = engine
+        _db_config = config_data
+    return engine
+
+
+def dispose_engine() -> None:
+    """Закрыть все соединения пула и сбросить движок"""
+    global _engine
+    with _engine_lock:
+        Session.remove()
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+async def dispose_async_engine() -> None:
+    """Закрыть все соединения асинхронного пула и сбросить движок"""
+    global _async_engine, _async_sessionmaker
+    engine: Optional[AsyncEngine] = _async_engine
+    _async_engine = None
+    _async_sessionmaker = None
+    if engine is not None:
+        await engine.dispose()
+
+
+@contextmanager
+def session_scope() -> Iterator[OrmSession]:
+    """Выдать сессию текущего потока и вернуть соединение в пул после использования"""
+    get_engine()
+    session: OrmSession = Session()
     try:
-        session.close()
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+
+@asynccontextmanager
+async def async_session_scope() -> AsyncIterator[AsyncSession]:
+    """Выдать асинхронную сессию и вернуть соединение в пул после использования"""
+    get_async_engine()
+    async with _async_sessionmaker() as session:
+        yield session
+
+
+@timed(DB_QUERY_SECONDS)
+def init_db() -> None:
+    """Создать недостающие таблицы"""
+    Base.metadata.create_all(get_engine())
+
+
+def get_pool_status() -> Dict[str, Any]:
+    """Получить статистику пула соединений"""
+    if _engine is None:
+        return {'initialized': False}
+    pool = _engine.pool
+    status: Dict[str, Any] = {'initialized': True, 'status': pool.status()}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    return status
+
+
+def get_user_profile(user_id) -> Optional[UserProfile]:
+    """Получить статус пользователя (существует, забанен, админ) из кэша или БД"""
+    profile: Optional[UserProfile] = user_cache.get(user_id)
+    if profile is not None:
+        return profile
+    profile = load_user_profile(user_id)
+    if profile is not None:
+        user_cache.put(user_id, profile)
+    return profile
+
+
+@timed(DB_QUERY_SECONDS)
+def load_user_profile(user_id) -> Optional[UserProfile]:
+    """Прочитать статус пользователя из БД"""
+    try:
+        with session_scope() as session:
+            user = session.query(User).filter_by(user_id=user_id).first()
+            if user is None:
+                return UserProfile(False, False, False)
+            return UserProfile(True, user.banned, user.is_admin)
     except SQLAlchemyError as ex:
-        logging.error(f'Ошибка при закрытии сессии базы данных: {ex}')
+        log_db_error(ex)
+        return None
 
 
-def check_user_exists(user_id) -> bool:
+def check_user_exists(user_id) -> Optional[bool]:
     """Проверка существования пользователя в БД по user_id"""
-    session = create_session()
-    if session is None:
-        return
+    profile: Optional[UserProfile] = get_user_profile(user_id)
+    if profile is not None:
+        return profile.exists
+
+
+def check_user_banned(user_id) -> Optional[bool]:
+    """Проверка забанен ли пользователь"""
+    profile: Optional[UserProfile] = get_user_profile(user_id)
+    if profile is not None:
+        return not profile.exists or profile.banned
+
+
+def check_user_admin(user_id) -> Optional[bool]:
+    """Проверка Пользователя на роль админа"""
+    profile: Optional[UserProfile] = get_user_profile(user_id)
+    if profile is not None:
+        return profile.is_admin
+
+
+def insert_new_user(user_name, user_id) -> None:
+    """Добавить в БД информацию о пользователе, который начал диалог с ботом"""
+    # Запись выполняется пачкой в фоне, кэш обновляется сразу - но только если БД
+    # подтвердила, что пользователя нет, иначе забаненный мог бы попасть в кэш
+    profile: Optional[UserProfile] = user_cache.get(user_id)
+    if profile is not None and not profile.exists:
+        user_cache.put(user_id, UserProfile(True, False, False))
+    write_queue.add({'user_name': user_name, 'user_id': user_id})
+
+
+@timed(DB_QUERY_SECONDS)
+def flush_writes(users: List[Dict[str, Any]]) -> None:
+    """Записать накопленных пользователей одной транзакцией"""
     try:
-        user = session.query(User).filter_by(user_id=user_id).first()
-        return user is not None
+        with session_scope() as session:
+            # Пользователь мог быть добавлен раньше - дубликаты пропускаем
+            session.execute(
+                insert(User.__table__)
+                .prefix_with('IGNORE', dialect='mysql')
+                .prefix_with('OR IGNORE', dialect='sqlite'),
+                users,
+            )
+            session.commit()
     except SQLAlchemyError as ex:
-        logging.error(
-            f'Возникла ошибка при выполнении операции с базой данных: {ex}'
+        # Повтор и запись по одной строке выполняет очередь
+        ERRORS.labels(type(ex).__name__).inc()
+        raise
+
+
+def is_transient_error(ex: Exception) -> bool:
+    """Проверить, что ошибка БД временная (нет связи, блокировка) и запись можно повторить"""
+    return isinstance(ex, (OperationalError, InterfaceError, PoolTimeoutError))
+
+
+def on_write_dropped(row: Dict[str, Any]) -> None:
+    """Сбросить кэш пользователя, чья строка не записана в БД"""
+    # Иначе кэш считает пользователя добавленным, и он не будет добавлен повторно
+    user_cache.invalidate(row['user_id'])
+
+
+def insert_task_logs(session, task_records: List[Dict[str, Any]]) -> int:
+    """Добавить записи tasks_log и дневной сводки и вернуть число добавленных записей"""
+    # users.id определяется подзапросом, без отдельного SELECT на каждую запись
+    result = session.execute(
+        insert(TaskLog.__table__).from_select(
+            ['user', 'task_link', 'datetime_creating', 'project_id'],
+            select(
+                User.id,
+                bindparam('b_task_link', type_=TaskLog.task_link.type),
+                bindparam(
+                    'b_datetime_creating',
+                    type_=TaskLog.datetime_creating.type,
+                ),
+                bindparam('b_project_id', type_=TaskLog.project_id.type),
+            ).where(User.user_id == bindparam('b_user_id')),
+        ),
+        task_records,
+    )
+    update_daily_stats(session, task_records)
+    return result.rowcount
+
+
+def update_daily_stats(session, task_records: List[Dict[str, Any]]) -> None:
+    """Увеличить счетчики дневной сводки на записи из пачки tasks_log"""
+    counts: Dict[Tuple[date, int, str], int] = {}
+    for record in task_records:
+        key: Tuple[date, int, str] = (
+            record['b_datetime_creating'].date(),
+            record['b_project_id'],
+            record['b_user_id'],
         )
-    finally:
-        close_session(session)
+        counts[key] = counts.get(key, 0) + 1
 
+    table = TaskDailyStats.__table__
+    columns: List[str] = ['day', 'project_id', 'user', 'tasks_count']
+    # Как и в tasks_log, записи неизвестных пользователей пропускаются
+    source = select(
+        bindparam('b_day', type_=table.c.day.type),
+        bindparam('b_project_id', type_=table.c.project_id.type),
+        User.id,
+        bindparam('b_count', type_=table.c.tasks_count.type),
+    ).where(User.user_id == bindparam('b_user_id'))
 
-def check_user_banned(user_id) -> bool:
-    """Проверка забанен ли пользователь"""
-    session = create_session()
-    if session is None:
-        return
-    try:
-        user = (
-            session.query(User)
-            .filter_by(user_id=user_id, banned=False)
-            .first()
+    if session.get_bind().dialect.name == 'mysql':
+        stmt = mysql_insert(table).from_select(columns, source)
+        stmt = stmt.on_duplicate_key_update(
+            tasks_count=table.c.tasks_count + stmt.inserted.tasks_count
+        )
+    else:
+        # SQLite (тесты и нагрузочный стенд)
+        stmt = sqlite_insert(table).from_select(columns, source)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'project_id', 'user'],
+            set_={'tasks_count': table.c.tasks_count + stmt.excluded.tasks_count},
         )
-        return user is None
+    session.execute(
+        stmt,
+        [
+            {
+                'b_day': day,
+                'b_project_id': project_id,
+                'b_user_id': user_id,
+                'b_count': count,
+            }
+            for (day, project_id, user_id), count in counts.items()
+        ],
+    )
+
+
+def get_task_stats_statements(
+    startDate, endDate, project_id=None
+) -> Dict[str, Select]:
+    """Построить запросы сводки по дням, пользователям и проектам за период"""
+    start_datetime, end_datetime = parse_date_range(startDate, endDate)
+    conditions: List[Any] = [
+        TaskDailyStats.day.between(start_datetime.date(), end_datetime.date())
+    ]
+    if project_id is not None:
+        conditions.append(TaskDailyStats.project_id == project_id)
+    total = func.sum(TaskDailyStats.tasks_count)
+    return {
+        'per_day': select(TaskDailyStats.day, total)
+        .where(*conditions)
+        .group_by(TaskDailyStats.day)
+        .order_by(TaskDailyStats.day),
+        'per_user': select(User.user_name, User.user_id, total)
+        .join(User, TaskDailyStats.user == User.id)
+        .where(*conditions)
+        .group_by(User.id, User.user_name, User.user_id)
+        .order_by(total.desc()),
+        'per_project': select(TaskDailyStats.project_id, total)
+        .where(*conditions)
+        .group_by(TaskDailyStats.project_id)
+        .order_by(total.desc()),
+    }
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_task_stats_async(
+    startDate, endDate, project_id=None
+) -> Optional[Dict[str, List[Tuple]]]:
+    """Получить число созданных задач по дням, пользователям и проектам из дневной сводки"""
+    statements: Dict[str, Select] = get_task_stats_statements(
+        startDate, endDate, project_id
+    )
+    try:
+        async with async_session_scope() as session:
+            return {
+                name: (await session.execute(statement)).all()
+                for name, statement in statements.items()
+            }
     except SQLAlchemyError as ex:
-        logging.error(
-            f'Возникла ошибка при выполнении операции с базой данных: {ex}'
+        log_db_error(ex)
+
+
+def parse_date_range(startDate, endDate) -> Tuple[datetime, datetime]:
+    """Преобразовать startDate и endDate (ГГГГ-ММ-ДД) в границы периода"""
+    if not startDate or not endDate:
+        raise ValueError('Не указаны startDate и endDate')
+    start_datetime: datetime = datetime.strptime(startDate, '%Y-%m-%d').replace(
+        hour=0, minute=0, second=0
+    )
+    end_datetime: datetime = datetime.strptime(endDate, '%Y-%m-%d').replace(
+        hour=23, minute=59, second=59
+    )
+    return start_datetime, end_datetime
+
+
+def get_logs_statement(project_id, startDate, endDate, *entities) -> Select:
+    """Построить запрос истории создания задач по проекту за период (от новых к старым)"""
+    start_datetime, end_datetime = parse_date_range(startDate, endDate)
+    if not entities:
+        entities = (TaskLog, User.user_name, User.user_id)
+    return (
+        select(*entities)
+        .join(User, TaskLog.user == User.id)
+        .where(
+            TaskLog.project_id == project_id,
+            TaskLog.datetime_creating.between(start_datetime, end_datetime),
         )
-    finally:
-        close_session(session)
+        .order_by(TaskLog.datetime_creating.desc(), TaskLog.id.desc())
+    )
 
 
-def check_user_admin(user_id) -> bool:
-    """Проверка Пользователя на роль админа"""
-    session = create_session()
-    if session is None:
-        return
-    try:
-        user = (
-            session.query(User)
-            .filter_by(user_id=user_id, is_admin=True)
-            .first()
+def encode_logs_cursor(log: 'TaskLog') -> str:
+    """Получить курсор страницы: время и id последней выданной записи"""
+    return f'{log.datetime_creating.isoformat()}_{log.id}'
+
+
+def decode_logs_cursor(after: str) -> Tuple[datetime, int]:
+    """Разобрать курсор страницы"""
+    try:
+        datetime_part, id_part = after.rsplit('_', 1)
+        return datetime.fromisoformat(datetime_part), int(id_part)
+    except ValueError as ex:
+        raise ValueError(f'Некорректный курсор страницы: {after}') from ex
+
+
+def get_logs_page_statement(
+    project_id, startDate, endDate, limit: int, after: Optional[str] = None
+) -> Select:
+    """Построить запрос страницы истории (на одну запись больше limit)"""
+    statement: Select = get_logs_statement(project_id, startDate, endDate)
+    if after:
+        # Пагинация по ключу: продолжаем строго после последней записи страницы
+        after_datetime, after_id = decode_logs_cursor(after)
+        statement = statement.where(
+            or_(
+                TaskLog.datetime_creating < after_datetime,
+                and_(
+                    TaskLog.datetime_creating == after_datetime,
+                    TaskLog.id < after_id,
+                ),
+            )
         )
-        return user is not None
+    # Лишняя запись показывает, есть ли следующая страница
+    return statement.limit(limit + 1)
+
+
+def split_logs_page(
+    rows: List[Tuple], limit: int
+) -> Tuple[List[Tuple], Optional[str]]:
+    """Отрезать лишнюю запись страницы и получить курсор следующей"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_logs_cursor(rows[-1][0])
+    return rows, None
+
+
+@timed(DB_QUERY_SECONDS)
+async def get_logs_page_async(
+    project_id, startDate, endDate, limit: int, after: Optional[str] = None
+) -> Tuple[List[Tuple], Optional[str]]:
+    """Получить страницу истории создания задач и курсор следующей страницы"""
+    statement: Select = get_logs_page_statement(
+        project_id, startDate, endDate, limit, after
+    )
+    try:
+        async with async_session_scope() as session:
+            rows: List[Tuple] = (await session.execute(statement)).all()
     except SQLAlchemyError as ex:
-        logging.error(
-            f'Возникла ошибка при выполнении операции с базой данных: {ex}'
+        log_db_error(ex)
+        return [], None
+    return split_logs_page(rows, limit)
+
+
+def get_export_statement(project_id, startDate, endDate) -> Select:
+    """Построить запрос выгрузки истории (только нужные колонки)"""
+    return get_logs_statement(
+        project_id,
+        startDate,
+        endDate,
+        User.user_name,
+        User.user_id,
+        TaskLog.task_link,
+        TaskLog.datetime_creating,
+    )
+
+
+async def iter_logs_async(
+    project_id, startDate, endDate, batch_size: int = EXPORT_BATCH_SIZE
+) -> AsyncIterator[Tuple]:
+    """Построчно выдать историю создания задач, читая ее курсором на стороне сервера"""
+    async with async_session_scope() as session:
+        result = await session.stream(
+            get_export_statement(project_id, startDate, endDate).execution_options(
+                yield_per=batch_size
+            )
         )
-    finally:
-        close_session(session)
+        async for row in result:
+            yield row
 
 
-def insert_new_user(user_name, user_id) -> None:
-    """Добавить в БД информацию о пользователе, который начал диалог с ботом"""
-    session = create_session()
-    if session is None:
-        return
+def get_pool_size(name: str) -> int:
+    """Получить показатель пула соединений для метрик"""
+    return get_pool_status().get(name, 0)
+
+
+for pool_state in ('size', 'checkedin', 'checkedout', 'overflow'):
+    DB_POOL.set_function(functools.partial(get_pool_size, pool_state), pool_state)
+
+
+# Очередь отложенной записи пользователей
+write_queue: WriteBehindQueue = WriteBehindQueue(
+    flush_writes,
+    WRITE_BATCH_SIZE,
+    WRITE_FLUSH_INTERVAL,
+    is_transient=is_transient_error,
+    on_drop=on_write_dropped,
+)
+atexit.register(write_queue.stop)
+
+
+@timed(DB_QUERY_SECONDS)
+def get_room_cursors() -> Dict[str, Tuple[str, int]]:
+    """Получить сохраненные курсоры всех комнат"""
     try:
-        new_user = User(user_name=user_name, user_id=user_id)
-        session.add(new_user)
-        session.commit()
+        with session_scope() as session:
+            return {
+                cursor.room_id: (cursor.message_id, cursor.message_ts)
+                for cursor in session.query(RoomCursor)
+            }
     except SQLAlchemyError as ex:
-        session.rollback()
-        logging.error(
-            f'Возникла ошибка при выполнении операции с базой данных: {ex}'
-        )
-    finally:
-        close_session(session)
-
-
-def insert_task_record(id_user, task_link, project_id) -> None:
-    """Добавить новую запись в таблицу tasks_log о создании задачи пользователем"""
-    session = create_session()
-    if session is None:
-        return
-    try:
-        # Получение users.id по user_id
-        user = session.query(User).filter(User.user_id == id_user).first()
-        if user:
-            # Вставка записи в tasks_log
-            new_task_log = TaskLog(
-                user=user.id,
-                task_link=task_link,
-                datetime_creating=datetime.now(),
-                project_id=project_id,
+        log_db_error(ex)
+        return {}
+
+
+@timed(DB_QUERY_SECONDS)
+def save_room_cursor(room_id, message_id, message_ts) -> None:
+    """Сохранить курсор комнаты (последнее обработанное сообщение)"""
+    try:
+        with session_scope() as session:
+            session.merge(
+                RoomCursor(
+                    room_id=room_id,
+                    message_id=message_id,
+                    message_ts=message_ts,
+                )
             )
-            session.add(new_task_log)
             session.commit()
     except SQLAlchemyError as ex:
-        session.rollback()
-        logging.error(
-            f'Возникла ошибка при выполнении операции с базой данных: {ex}'
-        )
-    finally:
-        close_session(session)
-
-
-def get_logs_from_db(project_id, startDate, endDate) -> List[Tuple]:
-    """Получить информацию об истории создания задач для формирования таблицы"""
-    session = create_session()
-    if session is None:
-        return
-    try:
-        # Преобразование startDate и endDate в объекты типа datetime
-        start_datetime: datetime = datetime.strptime(
-            startDate, '%Y-%m-%d'
-        ).replace(hour=0, minute=0, second=0)
-        end_datetime: datetime = datetime.strptime(
-            endDate, '%Y-%m-%d'
-        ).replace(hour=23, minute=59, second=59)
-
-        return (
-            session.query(TaskLog, User.user_name, User.user_id)
-            .join(User, TaskLog.user == User.id)
-            .where(
-                TaskLog.project_id == project_id,
-                TaskLog.datetime_creating.between(
-                    start_datetime, end_datetime
-                ),
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def load_conversation(room_id) -> Optional['ConversationRecord']:
+    """Получить сохраненный черновик диалога комнаты"""
+    try:
+        with session_scope() as session:
+            return session.get(ConversationRecord, room_id)
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def save_conversation(
+    room_id, stage, project_name, summary, description, created_at, updated_at
+) -> None:
+    """Сохранить черновик диалога комнаты"""
+    try:
+        with session_scope() as session:
+            session.merge(
+                ConversationRecord(
+                    room_id=room_id,
+                    stage=stage,
+                    project_name=project_name,
+                    summary=summary,
+                    description=description,
+                    created_at=created_at,
+                    updated_at=updated_at,
+                )
             )
-            .order_by(TaskLog.datetime_creating.desc())
-            .all()
-        )
+            session.commit()
     except SQLAlchemyError as ex:
-        logging.error(
-            f'Произошла ошибка при выполнении операции с базой данных: {ex}'
-        )
-    finally:
-        close_session(session)
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def delete_conversations_before(updated_before: datetime) -> None:
+    """Удалить черновики диалогов, не менявшиеся с указанного момента"""
+    try:
+        with session_scope() as session:
+            session.query(ConversationRecord).filter(
+                ConversationRecord.updated_at < updated_before
+            ).delete()
+            session.commit()
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def heartbeat_worker(worker_id: str, heartbeat_at: datetime) -> bool:
+    """Продлить аренду воркера бота"""
+    try:
+        with session_scope() as session:
+            session.merge(BotWorker(worker_id=worker_id, heartbeat_at=heartbeat_at))
+            session.commit()
+        return True
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+def get_live_workers(since: datetime) -> Optional[List[str]]:
+    """Получить id воркеров, продливших аренду после since (None при ошибке БД)"""
+    try:
+        with session_scope() as session:
+            return list(
+                session.scalars(
+                    select(BotWorker.worker_id).where(
+                        BotWorker.heartbeat_at >= since
+                    )
+                )
+            )
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+        return None
+
+
+@timed(DB_QUERY_SECONDS)
+def delete_worker(worker_id: str) -> None:
+    """Удалить воркер из кластера"""
+    try:
+        with session_scope() as session:
+            session.query(BotWorker).filter_by(worker_id=worker_id).delete()
+            session.commit()
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def delete_workers_before(heartbeat_at: datetime) -> None:
+    """Удалить записи воркеров, давно не продлевавших аренду"""
+    try:
+        with session_scope() as session:
+            session.query(BotWorker).filter(
+                BotWorker.heartbeat_at < heartbeat_at
+            ).delete()
+            session.commit()
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def enqueue_issue(
+    idempotency_key: str,
+    room_id: str,
+    user_id: str,
+    project_id: Optional[int],
+    project_key: Optional[str],
+    summary: str,
+    description: str,
+    created_at: datetime,
+) -> bool:
+    """Сохранить задачу в outbox для создания в Jira фоновым обработчиком"""
+    try:
+        with session_scope() as session:
+            session.add(
+                IssueOutboxRecord(
+                    idempotency_key=idempotency_key,
+                    room_id=room_id,
+                    user_id=user_id,
+                    project_id=project_id,
+                    project_key=project_key,
+                    summary=summary,
+                    description=description,
+                    status=OUTBOX_PENDING,
+                    attempts=0,
+                    next_attempt_at=created_at,
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+            )
+            session.commit()
+        return True
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+def claim_outbox_issues(
+    now: datetime, locked_until: datetime, limit: int
+) -> List['IssueOutboxRecord']:
+    """Захватить задачи outbox, которым пора в Jira (attempts - число прошлых попыток)"""
+    claimable = and_(
+        IssueOutboxRecord.status == OUTBOX_PENDING,
+        IssueOutboxRecord.next_attempt_at <= now,
+        or_(
+            IssueOutboxRecord.locked_until.is_(None),
+            IssueOutboxRecord.locked_until < now,
+        ),
+    )
+    claim_token: str = uuid.uuid4().hex
+    try:
+        with session_scope() as session:
+            records: List[IssueOutboxRecord] = list(
+                session.scalars(
+                    select(IssueOutboxRecord)
+                    .where(claimable)
+                    .order_by(IssueOutboxRecord.next_attempt_at)
+                    .limit(limit)
+                )
+            )
+            claimed: List[IssueOutboxRecord] = []
+            for record in records:
+                # Условный UPDATE: ту же запись мог захватить другой процесс бота
+                result = session.execute(
+                    update(IssueOutboxRecord)
+                    .where(IssueOutboxRecord.id == record.id, claimable)
+                    .values(
+                        locked_until=locked_until,
+                        claim_token=claim_token,
+                        attempts=IssueOutboxRecord.attempts + 1,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    claimed.append(record)
+            session.expunge_all()
+            session.commit()
+        # По метке захвата результат попытки проверяет, что захват не перехвачен
+        for record in claimed:
+            record.locked_until = locked_until
+            record.claim_token = claim_token
+        return claimed
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+        return []
+
+
+@timed(DB_QUERY_SECONDS)
+def finish_outbox_issue(
+    record: 'IssueOutboxRecord',
+    status: str,
+    updated_at: datetime,
+    issue_url: Optional[str] = None,
+    error: Optional[str] = None,
+    next_attempt_at: Optional[datetime] = None,
+) -> bool:
+    """Записать результат попытки: задача создана, отложена до next_attempt_at или провалена"""
+    values: Dict[str, Any] = {
+        'status': status,
+        'locked_until': None,
+        'claim_token': None,
+        'issue_url': issue_url,
+        'last_error': error,
+        'updated_at': updated_at,
+    }
+    if next_attempt_at is not None:
+        values['next_attempt_at'] = next_attempt_at
+    if status == OUTBOX_DONE:
+        # Пользователь мог еще не попасть в БД из очереди отложенной записи
+        write_queue.flush()
+    try:
+        with session_scope() as session:
+            # Захват мог истечь, и задачу уже обрабатывает другой процесс бота
+            result = session.execute(
+                update(IssueOutboxRecord)
+                .where(
+                    IssueOutboxRecord.id == record.id,
+                    IssueOutboxRecord.claim_token == record.claim_token,
+                )
+                .values(**values)
+            )
+            if result.rowcount != 1:
+                session.rollback()
+                logging.warning(
+                    f'Задача outbox {record.idempotency_key} захвачена другим '
+                    'обработчиком, результат попытки не записан'
+                )
+                return False
+            if status == OUTBOX_DONE:
+                # Запись о задаче сохраняется в одной транзакции с ее статусом
+                if not insert_task_logs(
+                    session,
+                    [
+                        {
+                            'b_user_id': record.user_id,
+                            'b_task_link': issue_url,
+                            'b_datetime_creating': datetime.now(),
+                            'b_project_id': record.project_id,
+                        }
+                    ],
+                ):
+                    logging.warning(
+                        f'Пользователь {record.user_id} не найден, '
+                        f'задача {issue_url} не записана в tasks_log'
+                    )
+            session.commit()
+        return True
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+        return False
+
+
+@timed(DB_QUERY_SECONDS)
+def get_outbox_counts() -> Optional[Dict[str, int]]:
+    """Получить число задач outbox по статусам"""
+    try:
+        with session_scope() as session:
+            return dict(
+                session.execute(
+                    select(
+                        IssueOutboxRecord.status, func.count(IssueOutboxRecord.id)
+                    ).group_by(IssueOutboxRecord.status)
+                ).all()
+            )
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
+
+
+@timed(DB_QUERY_SECONDS)
+def delete_outbox_before(updated_before: datetime) -> None:
+    """Удалить завершенные задачи outbox, не менявшиеся с указанного момента"""
+    try:
+        with session_scope() as session:
+            session.query(IssueOutboxRecord).filter(
+                IssueOutboxRecord.status != OUTBOX_PENDING,
+                IssueOutboxRecord.updated_at < updated_before,
+            ).delete()
+            session.commit()
+    except SQLAlchemyError as ex:
+        log_db_error(ex)
 
 
 class User(Base):
@@ -210,4 +974,90 @@ class TaskLog(Base):
     user: int = Column(Integer, nullable=False)
     task_link: str = Column(String(100), nullable=False)
     datetime_creating: datetime = Column(DateTime, nullable=False)
-    project_id: str = Column(DateTime, nullable=False)
+    project_id: int = Column(Integer, nullable=False)
+
+    # Индекс под выборку истории по проекту за период с сортировкой по времени
+    __table_args__ = (
+        Index(
+            'ix_tasks_log_project_datetime',
+            'project_id',
+            'datetime_creating',
+            'id',
+        ),
+    )
+
+
+class RoomCursor(Base):
+    """Класс для представления таблицы room_cursors"""
+
+    __tablename__ = 'room_cursors'
+
+    room_id: str = Column(String(64), primary_key=True)
+    message_id: str = Column(String(32), nullable=False)
+    message_ts: int = Column(BigInteger, nullable=False)
+
+
+class ConversationRecord(Base):
+    """Класс для представления таблицы conversations"""
+
+    __tablename__ = 'conversations'
+
+    room_id: str = Column(String(64), primary_key=True)
+    stage: int = Column(Integer, nullable=False, default=0)
+    project_name: str = Column(String(255))
+    summary: str = Column(String(255))
+    description: str = Column(Text)
+    created_at: datetime = Column(DateTime, nullable=False)
+    updated_at: datetime = Column(DateTime, nullable=False, index=True)
+
+
+class TaskDailyStats(Base):
+    """Класс для представления таблицы tasks_daily_stats (дневная сводка по tasks_log)"""
+
+    __tablename__ = 'tasks_daily_stats'
+
+    day: date = Column(Date, primary_key=True)
+    project_id: int = Column(Integer, primary_key=True)
+    user: int = Column(Integer, primary_key=True)
+    tasks_count: int = Column(Integer, nullable=False, default=0)
+
+
+class BotWorker(Base):
+    """Класс для представления таблицы bot_workers (аренды воркеров бота)"""
+
+    __tablename__ = 'bot_workers'
+
+    worker_id: str = Column(String(128), primary_key=True)
+    heartbeat_at: datetime = Column(DateTime, nullable=False, index=True)
+
+
+class IssueOutboxRecord(Base):
+    """Класс для представления таблицы issue_outbox (задачи, ожидающие создания в Jira)"""
+
+    __tablename__ = 'issue_outbox'
+
+    id: int = Column(Integer, primary_key=True, autoincrement=True)
+    # Метка задачи в Jira, по которой повтор находит уже созданную задачу
+    idempotency_key: str = Column(String(64), nullable=False, unique=True)
+    room_id: str = Column(String(64), nullable=False)
+    user_id: str = Column(String(20), nullable=False)
+    project_id: int = Column(Integer)
+    project_key: str = Column(String(64))
+    summary: str = Column(Text, nullable=False)
+    description: str = Column(Text)
+    status: str = Column(String(16), nullable=False, default=OUTBOX_PENDING)
+    attempts: int = Column(Integer, nullable=False, default=0)
+    next_attempt_at: datetime = Column(DateTime, nullable=False)
+    locked_until: datetime = Column(DateTime)
+    # Метка последнего захвата: время захвата в MySQL хранится без долей секунды
+    # и для сравнения не годится
+    claim_token: str = Column(String(32))
+    issue_url: str = Column(String(100))
+    last_error: str = Column(Text)
+    created_at: datetime = Column(DateTime, nullable=False)
+    updated_at: datetime = Column(DateTime, nullable=False)
+
+    # Индекс под выборку задач, которым пора в Jira
+    __table_args__ = (
+        Index('ix_issue_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
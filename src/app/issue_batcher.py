@@ -0,0 +1,129 @@
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from jira_client import IssueResult, JiraClient
+
+# Максимальное число задач в одном запросе к /issue/bulk (ограничение Jira)
+MAX_BATCH_SIZE = 50
+
+
+class IssueBatcher:
+    """Накапливает задачи на создание за короткое окно и создает их одним запросом к Jira"""
+
+    def __init__(
+        self,
+        jira_client: JiraClient,
+        batch_size: int = MAX_BATCH_SIZE,
+        batch_interval: float = 0.2,
+    ):
+        self.jira_client: JiraClient = jira_client
+        self.batch_size: int = min(batch_size, MAX_BATCH_SIZE)
+        # Сколько ждать попутчиков после первой задачи в пакете (секунды)
+        self.batch_interval: float = batch_interval
+        self.batches: int = 0
+        self.issues_submitted: int = 0
+        self._pending: List[Tuple[Dict[str, Any], Future]] = []
+        self._condition: threading.Condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: bool = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(
+        self,
+        project_key: Optional[str],
+        summary: str,
+        description: str,
+        labels: Optional[List[str]] = None,
+    ) -> 'Future[IssueResult]':
+        """Поставить задачу в очередь на создание и получить Future с результатом"""
+        future: Future = Future()
+        fields: Dict[str, Any] = self.jira_client.get_data_for_issue(
+            project_key, summary, description, labels
+        )
+        self.start()
+        with self._condition:
+            self._pending.append((fields, future))
+            self._condition.notify()
+        return future
+
+    def start(self) -> None:
+        """Запустить фоновый поток отправки, если он еще не запущен"""
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(
+                    target=self._run, name='issue-batcher', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    # Первая задача пришла - ждем остальных не дольше окна
+                    self._condition.wait_for(
+                        lambda: self._stopping
+                        or len(self._pending) >= self.batch_size,
+                        self.batch_interval,
+                    )
+                batch = self._pending[: self.batch_size]
+                del self._pending[: self.batch_size]
+                stopping: bool = self._stopping
+            if batch:
+                self._send(batch)
+            if stopping and not self._pending:
+                return
+
+    def _send(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        """Создать пакет задач и раздать результаты по Future"""
+        try:
+            if len(batch) == 1:
+                fields: Dict[str, Any] = batch[0][0]
+                results: List[IssueResult] = [
+                    self.jira_client.create_new_issue(
+                        fields['project']['key'],
+                        fields['summary'],
+                        fields['description'],
+                        fields.get('labels'),
+                    )
+                ]
+            else:
+                results = self.jira_client.create_issues(
+                    [fields for fields, _ in batch]
+                )
+            self.batches += 1
+            self.issues_submitted += len(batch)
+        except Exception as ex:
+            logging.exception(f'Ошибка при создании пакета задач: {ex}')
+            results = [IssueResult(error=str(ex)) for _ in batch]
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def stop(self) -> None:
+        """Остановить фоновый поток, предварительно создав все накопленные задачи"""
+        with self._condition:
+            thread: Optional[threading.Thread] = self._thread
+            self._stopping = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить статистику пакетной отправки"""
+        return {
+            'pending': len(self),
+            'batches': self.batches,
+            'issues_submitted': self.issues_submitted,
+            'avg_batch_size': round(self.issues_submitted / self.batches, 2)
+            if self.batches
+            else 0.0,
+        }
@@ -0,0 +1,334 @@
+import functools
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import database
+import metrics
+from issue_batcher import IssueBatcher
+from jira_client import IssueResult, JiraClient
+
+# Как часто проверять outbox, если новых задач не поступало (секунды)
+POLL_INTERVAL = 1.0
+# Сколько задач захватывать за раз
+CLAIM_BATCH_SIZE = 50
+# На сколько захватывается задача: после падения процесса ее подберет другой (секунды)
+CLAIM_TIMEOUT = 120.0
+# Число попыток создания и границы задержки между ними (секунды)
+MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+# Сколько хранить завершенные задачи и как часто их чистить (секунды)
+RETENTION = 7 * 24 * 3600.0
+CLEANUP_INTERVAL = 3600.0
+# Подряд идущих сбоев Jira до размыкания цепи и пауза до пробного запроса (секунды)
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+# Префикс метки Jira, по которой повтор находит уже созданную задачу
+IDEMPOTENCY_LABEL_PREFIX = 'rcbot-'
+
+# Вызывается с записью outbox, когда задача создана или попытки исчерпаны
+OnDone = Callable[['database.IssueOutboxRecord', IssueResult], None]
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+OUTBOX_RETRIES: metrics.Counter = metrics.Counter(
+    'jira_outbox_retries', 'Повторные попытки создания задач из outbox'
+)
+CIRCUIT_STATE: metrics.Gauge = metrics.Gauge(
+    'jira_circuit_open', 'Цепь запросов к Jira разомкнута (1) или замкнута (0)'
+)
+
+
+def utcnow() -> datetime:
+    # Время захвата сравнивается между процессами на разных хостах
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_retry_delay(attempt: int) -> float:
+    """Получить задержку перед следующей попыткой: экспоненциальный рост с разбросом"""
+    delay: float = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: после серии сбоев Jira перестает получать запросы на время"""
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+    ):
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.state: str = CIRCUIT_CLOSED
+        self.failures: int = 0
+        self.opened_at: float = 0.0
+        self.trips: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        CIRCUIT_STATE.set_function(lambda: int(self.state != CIRCUIT_CLOSED))
+
+    def allow(self) -> bool:
+        """Проверить, можно ли отправлять запросы; по истечении паузы цепь полуоткрывается"""
+        with self._lock:
+            if (
+                self.state == CIRCUIT_OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.state = CIRCUIT_HALF_OPEN
+            return self.state != CIRCUIT_OPEN
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if (
+                self.state == CIRCUIT_HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                if self.state != CIRCUIT_OPEN:
+                    self.trips += 1
+                    logging.warning(
+                        f'Jira недоступна, запросы приостановлены на {self.reset_timeout:.0f} с'
+                    )
+                self.state = CIRCUIT_OPEN
+                self.opened_at = time.monotonic()
+
+
+class IssueOutbox:
+    """Создание задач из таблицы issue_outbox: чат не ждет Jira, задачи переживают сбои"""
+
+    def __init__(
+        self,
+        jira_client: JiraClient,
+        issue_batcher: IssueBatcher,
+        on_done: Optional[OnDone] = None,
+        use_labels: bool = True,
+        poll_interval: float = POLL_INTERVAL,
+        batch_size: int = CLAIM_BATCH_SIZE,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.jira_client: JiraClient = jira_client
+        self.issue_batcher: IssueBatcher = issue_batcher
+        self.on_done: Optional[OnDone] = on_done
+        # Метка идемпотентности в задаче Jira (поле labels должно быть на экране создания)
+        self.use_labels: bool = use_labels
+        self.poll_interval: float = poll_interval
+        self.batch_size: int = batch_size
+        self.max_attempts: int = max_attempts
+        self.breaker: CircuitBreaker = CircuitBreaker()
+        self.created: int = 0
+        self.retried: int = 0
+        self.failed: int = 0
+        self._inflight: int = 0
+        self._inflight_lock: threading.Lock = threading.Lock()
+        # Результаты из потока пакетного создания, записываемые потоком outbox
+        self._results: queue.Queue = queue.Queue()
+        self._wake: threading.Event = threading.Event()
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._cleaned_at: float = 0.0
+
+    def add(
+        self,
+        room_id: str,
+        user_id: str,
+        project_id: Optional[int],
+        project_key: Optional[str],
+        summary: str,
+        description: str,
+    ) -> bool:
+        """Сохранить задачу в outbox; True - задача не потеряется, даже если Jira недоступна"""
+        if not database.enqueue_issue(
+            uuid.uuid4().hex,
+            room_id,
+            user_id,
+            project_id,
+            project_key,
+            summary,
+            description,
+            utcnow(),
+        ):
+            return False
+        self._wake.set()
+        return True
+
+    def start(self) -> None:
+        """Запустить фоновый обработчик outbox"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='issue-outbox', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            claimed: int = 0
+            try:
+                self.process_results()
+                claimed = self.process_due()
+                self.cleanup()
+            except Exception as ex:
+                logging.exception(f'Ошибка обработки outbox задач: {ex}')
+            if claimed < self.batch_size and self._results.empty():
+                # Новая задача будит обработчик сразу, отложенные ждут интервала
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def process_due(self) -> int:
+        """Захватить задачи, которым пора в Jira, и отправить их в пакетное создание"""
+        if not self.breaker.allow():
+            return 0
+        # Пока цепь полуоткрыта, проверяем Jira одной пробной задачей
+        limit: int = (
+            1 if self.breaker.state == CIRCUIT_HALF_OPEN else self.batch_size
+        ) - self._inflight
+        if limit <= 0:
+            return 0
+        now: datetime = utcnow()
+        records: List[
+            database.IssueOutboxRecord
+        ] = database.claim_outbox_issues(
+            now, now + timedelta(seconds=CLAIM_TIMEOUT), limit
+        )
+        for record in records:
+            with self._inflight_lock:
+                self._inflight += 1
+            self._submit(record)
+        return len(records)
+
+    def _submit(self, record: database.IssueOutboxRecord) -> None:
+        """Создать задачу, если прошлая попытка не успела этого сделать"""
+        if record.project_key is None:
+            self._finish(
+                record, IssueResult(error='Проект не найден', retryable=False)
+            )
+            return
+        label: str = f'{IDEMPOTENCY_LABEL_PREFIX}{record.idempotency_key}'
+        if self.use_labels and record.attempts > 0:
+            # Прошлая попытка могла создать задачу, но не дождаться ответа
+            try:
+                existing: Optional[IssueResult] = (
+                    self.jira_client.find_issue_by_label(label)
+                )
+            except Exception as ex:
+                self._finish(record, IssueResult(error=str(ex)))
+                return
+            if existing is not None:
+                self._finish(record, existing)
+                return
+        future: Future = self.issue_batcher.submit(
+            record.project_key,
+            record.summary,
+            record.description,
+            [label] if self.use_labels else None,
+        )
+        future.add_done_callback(functools.partial(self._on_created, record))
+
+    def _on_created(self, record: database.IssueOutboxRecord, future: Future) -> None:
+        # Вызывается в потоке пакетного создания: запись в БД и ответ в чат
+        # не должны задерживать следующий пакет
+        self._results.put((record, future.result()))
+        self._wake.set()
+
+    def process_results(self) -> None:
+        """Записать результаты созданных задач и сообщить о них пользователям"""
+        while True:
+            try:
+                record, result = self._results.get_nowait()
+            except queue.Empty:
+                return
+            self._finish(record, result)
+
+    def _finish(self, record: database.IssueOutboxRecord, result: IssueResult) -> None:
+        """Записать результат попытки и сообщить пользователю окончательный итог"""
+        try:
+            attempt: int = record.attempts + 1
+            now: datetime = utcnow()
+            if result.success:
+                self.breaker.record_success()
+            elif result.retryable:
+                # Ошибки в полях задачи не говорят о состоянии Jira
+                self.breaker.record_failure()
+
+            if result.success:
+                if not database.finish_outbox_issue(
+                    record, database.OUTBOX_DONE, now, issue_url=result.url
+                ):
+                    # Захват истек или БД недоступна: задачу повторно подберет
+                    # обработчик outbox и найдет в Jira по метке
+                    return
+                self.created += 1
+            elif result.retryable and attempt < self.max_attempts:
+                self.retried += 1
+                OUTBOX_RETRIES.inc()
+                delay: float = get_retry_delay(attempt)
+                logging.warning(
+                    f'Задача {record.idempotency_key} не создана (попытка {attempt}), '
+                    f'повтор через {delay:.0f} с: {result.error}'
+                )
+                database.finish_outbox_issue(
+                    record,
+                    database.OUTBOX_PENDING,
+                    now,
+                    error=result.error,
+                    next_attempt_at=now + timedelta(seconds=delay),
+                )
+                return
+            else:
+                if not database.finish_outbox_issue(
+                    record, database.OUTBOX_FAILED, now, error=result.error
+                ):
+                    return
+                self.failed += 1
+            if self.on_done is not None:
+                self.on_done(record, result)
+        except Exception as ex:
+            logging.exception(f'Ошибка при обработке результата задачи: {ex}')
+        finally:
+            with self._inflight_lock:
+                self._inflight -= 1
+
+    def cleanup(self) -> None:
+        """Удалить давно завершенные задачи"""
+        if time.monotonic() - self._cleaned_at < CLEANUP_INTERVAL:
+            return
+        self._cleaned_at = time.monotonic()
+        database.delete_outbox_before(utcnow() - timedelta(seconds=RETENTION))
+
+    def stop(self) -> None:
+        """Остановить обработчик; незавершенные задачи останутся в outbox до следующего запуска"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # Задачи из последнего пакета создаются при остановке, их результаты
+        # записываются здесь
+        self.issue_batcher.stop()
+        self.process_results()
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить статистику обработчика outbox"""
+        return {
+            'in_flight': self._inflight,
+            'created': self.created,
+            'retried': self.retried,
+            'failed': self.failed,
+            'circuit': self.breaker.state,
+            'circuit_trips': self.breaker.trips,
+        }
@@ -1,7 +1,26 @@
-import json
 import logging
-from typing import Any, List, Dict, Optional
+import threading
+from typing import Any, Callable, List, Dict, Optional, TypeVar
 from jira import JIRA
+from jira.exceptions import JIRAError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+
+from metrics import JIRA_REQUEST_SECONDS, timed
+from settings import ConfigError, settings
+from tracing import record_exception, traced
+
+T = TypeVar('T')
+
+# Ответы Jira, которые не изменятся при повторе того же запроса
+PERMANENT_STATUS_CODES = (400, 403, 404)
+
+
+def is_retryable(ex: Exception) -> bool:
+    """Проверить, может ли повтор запроса к Jira закончиться успехом"""
+    return not (
+        isinstance(ex, JIRAError) and ex.status_code in PERMANENT_STATUS_CODES
+    )
 
 
 class JiraClient:
@@ -9,105 +28,201 @@ class JiraClient:
 
     def __init__(self):
         self.jira: Optional[JIRA] = None
-        self.project_name: Optional[str] = None
-
+        self._connect_lock: threading.Lock = threading.Lock()
+        settings.jira.subscribe(self.on_config_change)
+
+    def on_config_change(self, section) -> None:
+        """Переподключиться с новыми адресом и токеном при следующем запросе"""
+        with self._connect_lock:
+            jira: Optional[JIRA] = self.jira
+            self.jira = None
+        if jira is not None:
+            jira.close()
+
+    @traced('jira.connect')
+    @timed(JIRA_REQUEST_SECONDS)
     def connect(self):
         """Подключиться к серверу Jira"""
         try:
-            with open('src/data/config_jira.json') as jira_config_file:
-                jira_config: Dict[str, Any] = json.load(jira_config_file)
-                url: str = jira_config['url']
-                jira_token: str = jira_config['jira_token']
-                self.jira = JIRA(server=url, token_auth=jira_token)
-        except FileNotFoundError:
-            logging.error('Ошибка: файл config_jira.json не найден.')
-        except json.JSONDecodeError:
-            logging.error(
-                'Ошибка: некорректный формат JSON в файле config_jira.json.'
+            jira: JIRA = JIRA(
+                server=settings.jira.url,
+                token_auth=settings.jira.jira_token,
+                timeout=settings.jira.timeout,
+                # Встроенные повторы jira повторяют и создание задач: повтор
+                # выполняют call() и outbox, который проверяет метку задачи
+                max_retries=0,
+            )
+            # Пул keep-alive соединений на все потоки бота и веб-обработчиков
+            adapter: HTTPAdapter = HTTPAdapter(
+                pool_connections=settings.jira.pool_size,
+                pool_maxsize=settings.jira.pool_size,
             )
+            jira._session.mount('http://', adapter)
+            jira._session.mount('https://', adapter)
+            self.jira = jira
+        except ConfigError as ex:
+            logging.error(f'Ошибка конфигурации Jira: {ex}')
         except Exception as ex:
             logging.exception(f'Ошибка при подключении к серверу Jira: {ex}')
 
+    def get_connection(self) -> JIRA:
+        """Получить общее подключение, создав его при первом обращении"""
+        jira: Optional[JIRA] = self.jira
+        if jira is None:
+            # Потоки, пришедшие одновременно, ждут одно подключение, а не создают свои
+            with self._connect_lock:
+                if self.jira is None:
+                    self.connect()
+                jira = self.jira
+        if jira is None:
+            raise JIRAError('Нет подключения к серверу Jira')
+        return jira
+
+    def reset(self, jira: JIRA) -> None:
+        """Сбросить подключение, чтобы следующий запрос создал новое"""
+        with self._connect_lock:
+            if self.jira is jira:
+                self.jira = None
+                jira.close()
+
+    def call(self, func: Callable[[JIRA], T], idempotent: bool = True) -> T:
+        """Выполнить запрос, переподключившись один раз при отзыве токена или рестарте сервера"""
+        jira: JIRA = self.get_connection()
+        try:
+            return func(jira)
+        except (JIRAError, ConnectionError) as ex:
+            # Оборванный запрос на создание мог дойти до сервера - повторяем только 401
+            if isinstance(ex, JIRAError) and ex.status_code != 401:
+                raise
+            if isinstance(ex, ConnectionError) and not idempotent:
+                raise
+            logging.warning(f'Подключение к Jira потеряно, переподключение: {ex}')
+            self.reset(jira)
+        return func(self.get_connection())
+
     def get_data_for_issue(
-        self, project_key: str, summary: str, description: str
+        self,
+        project_key: str,
+        summary: str,
+        description: str,
+        labels: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
         """Получить JSON-представление для создания задачи"""
-        return {
+        fields: Dict[str, Any] = {
             'project': {'key': project_key},
             'summary': summary,
             'description': description,
             'issuetype': {'name': 'Task'},
         }
-
+        if labels:
+            fields['labels'] = labels
+        return fields
+
+    @traced('jira.find_issue_by_label')
+    @timed(JIRA_REQUEST_SECONDS)
+    def find_issue_by_label(self, label: str) -> Optional['IssueResult']:
+        """Найти задачу по метке (исключения пробрасываются - результат поиска важен)"""
+        issues = self.call(
+            lambda jira: jira.search_issues(
+                f'labels = "{label}"', maxResults=1, fields='key'
+            )
+        )
+        if not issues:
+            return None
+        key: str = issues[0].key
+        return IssueResult(key=key, url=self.get_issue_url(key))
+
+    @traced('jira.get_projects')
+    @timed(JIRA_REQUEST_SECONDS)
     def get_projects(self) -> List[Any]:
         """Получить список проектов из результатов запроса к серверу"""
         try:
-            if not self.jira:
-                self.connect()
-            return self.jira.projects()
+            return self.call(lambda jira: jira.projects())
         except Exception as ex:
+            record_exception(ex)
             logging.exception(f'Ошибка при получении списка проектов: {ex}')
             return []
 
+    @traced('jira.create_new_issue')
+    @timed(JIRA_REQUEST_SECONDS)
     def create_new_issue(
-        self, project_key: str, summary: str, description: str
-    ):
-        """Создать задачу в проекте"""
+        self,
+        project_key: str,
+        summary: str,
+        description: str,
+        labels: Optional[List[str]] = None,
+    ) -> 'IssueResult':
+        """Создать задачу в проекте и получить ее ключ и ссылку из ответа Jira"""
         try:
-            if not self.jira:
-                self.connect()
-            self.jira.create_issue(
-                fields=self.get_data_for_issue(
-                    project_key, summary, description
-                )
+            fields: Dict[str, Any] = self.get_data_for_issue(
+                project_key, summary, description, labels
             )
-            return True
+            issue = self.call(
+                lambda jira: jira.create_issue(fields=fields), idempotent=False
+            )
+            return IssueResult(key=issue.key, url=self.get_issue_url(issue.key))
         except Exception as ex:
+            record_exception(ex)
             logging.exception(f'Ошибка при создании задачи: {ex}')
-            return False
-
-    def get_issue_link(
-        self, project_key: str, issue_summary: str
-    ) -> Optional[str]:
-        """Запрос на поиск задач с указанным названием в проекте"""
+            return IssueResult(error=str(ex), retryable=is_retryable(ex))
+
+    @traced('jira.create_issues')
+    @timed(JIRA_REQUEST_SECONDS)
+    def create_issues(
+        self, issues: List[Dict[str, Any]]
+    ) -> List['IssueResult']:
+        """Создать несколько задач одним запросом к /issue/bulk (результаты в порядке входных данных)"""
         try:
-            issues = self.jira.search_issues(
-                f'project={project_key} AND summary~"{issue_summary}"'
+            created: List[Dict[str, Any]] = self.call(
+                lambda jira: jira.create_issues(field_list=issues, prefetch=False),
+                idempotent=False,
             )
-            # Проверка, найдены ли задачи
-            if len(issues) > 0:
-                # Получение ключа последней найденной задачи
-                last_issue = max(issues, key=lambda issue: int(issue.id))
-                issue_key = last_issue.key
-                return f'{self.jira.server_url}/browse/{issue_key}'
         except Exception as ex:
-            logging.exception(f'Ошибка при получении ссылки на задачу: {ex}')
-        return None
-
-    def get_project_name(self) -> None:
-        """Получить название проекта"""
-        return self.project_name
+            record_exception(ex)
+            logging.exception(f'Ошибка при пакетном создании задач: {ex}')
+            return [
+                IssueResult(error=str(ex), retryable=is_retryable(ex))
+                for _ in issues
+            ]
+
+        results: List[IssueResult] = []
+        for item in created:
+            if item['status'] == 'Success':
+                key: str = item['issue'].key
+                results.append(IssueResult(key=key, url=self.get_issue_url(key)))
+            else:
+                # Ошибки отдельных задач пакета - ошибки проверки полей
+                logging.error(f'Ошибка при создании задачи: {item["error"]}')
+                results.append(
+                    IssueResult(error=str(item['error']), retryable=False)
+                )
+        return results
 
-    def set_project_name(self, project_name) -> None:
-        """Установить название проекта, чтобы в дальнейшем его использовать"""
-        self.project_name = project_name
+    def get_issue_url(self, issue_key: str) -> str:
+        """Получить ссылку на задачу по ее ключу"""
+        return f'{self.get_connection().server_url}/browse/{issue_key}'
 
 
-class Issue:
-    """Класс для представления задачи"""
+class IssueResult:
+    """Класс для представления результата создания задачи"""
 
-    def __init__(self):
-        self.issue_summary = None
-        self.issue_description = None
-
-    def get_issue_summary(self):
-        return self.issue_summary
+    def __init__(
+        self,
+        key: Optional[str] = None,
+        url: Optional[str] = None,
+        error: Optional[str] = None,
+        retryable: bool = True,
+    ):
+        self.key: Optional[str] = key
+        self.url: Optional[str] = url
+        self.error: Optional[str] = error
+        # Имеет ли смысл повторить создание (сбой сети или сервера, а не ошибка в полях)
+        self.retryable: bool = retryable
 
-    def set_issue_summary(self, issue_summary):
-        self.issue_summary = issue_summary
+    @property
+    def success(self) -> bool:
+        return self.key is not None
 
-    def get_issue_description(self):
-        return self.issue_description
 
-    def set_issue_description(self, issue_description):
-        self.issue_description = issue_description
+# Общий для процесса клиент: бот и веб-обработчики используют одно подключение
+jira_client: JiraClient = JiraClient()
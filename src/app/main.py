@@ -1,42 +1,206 @@
+import asyncio
+import csv
+import io
 import json
 import logging
+import os
+import signal
+import sys
 import threading
 import database
-from typing import Any, List, Tuple, Dict, Optional
+import metrics
+import profiler
+import requests
+import tracing
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Tuple, Dict, Optional
 
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Header, Query, Request
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import uvicorn
 
-from jira_client import JiraClient
-from rocketchat_bot import RocketChatBot
+from conversation import ConversationStore
+from jira.exceptions import JIRAError
+from sqlalchemy.exc import SQLAlchemyError
+from project_catalog import project_catalog
+from issue_outbox import IssueOutbox
+from jira_client import jira_client
+from rocketchat_bot import OFFLINE_STATUS, RocketChatBot, issue_batcher
+from settings import STATIC_DIR, TEMPLATES_DIR, ConfigError, settings
+from sharding import ShardCoordinator
+from supervisor import WEB_ONLY_ENV
+
+# Режим, в котором бот работает в цикле событий uvicorn, а не в отдельном потоке
+ASYNC_RUNTIME: str = 'async'
+
+# Размер страницы истории создания задач по умолчанию и максимальный
+LOGS_PAGE_SIZE: int = 50
+LOGS_MAX_PAGE_SIZE: int = 500
+
+# Колонки и типы содержимого выгрузки истории, размер отправляемой части (символы)
+EXPORT_COLUMNS: Tuple[str, ...] = (
+    'user_name',
+    'user_id',
+    'task_link',
+    'task',
+    'datetime_creating',
+)
+EXPORT_MEDIA_TYPES: Dict[str, str] = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_CHUNK_SIZE: int = 64 * 1024
+
+# Запас времени сверх длительности снимка при запросе профиля у процесса бота (секунды)
+PROFILE_REQUEST_MARGIN: float = 10.0
+# Таймаут запроса статистики и метрик у процесса бота (секунды)
+BOT_PROCESS_TIMEOUT: float = 5.0
+
+
+def create_bot(config_rc: Dict[str, Any], bot_class=RocketChatBot, **kwargs):
+    """Создать бота по параметрам из конфигурации"""
+    sharding: bool = config_rc['sharding']
+    shard: Optional[ShardCoordinator] = None
+    if sharding:
+        # Комнаты делятся между процессами, общая БД хранит аренды и черновики
+        shard = ShardCoordinator(
+            worker_id=config_rc['worker_id'],
+            heartbeat_interval=config_rc['shard_heartbeat_interval'],
+            lease_timeout=config_rc['shard_lease_timeout'],
+        )
+    bot: RocketChatBot = bot_class(
+        # Параметры аутентификации
+        config_rc['base_url'],
+        config_rc['username'],
+        config_rc['password'],
+        config_rc['bot_id'],
+        realtime_enabled=config_rc['realtime'],
+        websocket_url=config_rc['websocket_url'],
+        conversations=ConversationStore(
+            idle_timeout=config_rc['conversation_idle_timeout'],
+            max_size=config_rc['conversation_max_size'],
+            # Черновик должен переезжать вместе с комнатой на другой воркер
+            persist=sharding or config_rc['conversation_persist'],
+        ),
+        request_timeout=config_rc['request_timeout'],
+        max_retries=config_rc['max_retries'],
+        rate_limits=config_rc['rate_limits'],
+        poll_interval=config_rc['poll_interval'],
+        idle_poll_interval=config_rc['idle_poll_interval'],
+        shard=shard,
+        outbox=IssueOutbox(
+            jira_client,
+            issue_batcher,
+            use_labels=settings.jira.idempotency_labels,
+        ),
+        **kwargs,
+    )
+    # Таймауты, бюджеты частоты и интервал опроса меняются правкой config_bot.json без перезапуска
+    settings.bot.subscribe(lambda section: bot.apply_config(section.as_dict()))
+    # Трассировку тоже можно включить и выключить на работающем боте
+    tracing.configure(config_rc)
+    settings.bot.subscribe(lambda section: tracing.configure(section.as_dict()))
+    return bot
+
+
+def create_async_bot(config_rc: Dict[str, Any]):
+    """Создать бота для работы в цикле событий asyncio"""
+    from async_bot import AsyncRocketChatBot
+
+    return create_bot(
+        config_rc,
+        AsyncRocketChatBot,
+        max_concurrency=config_rc['max_concurrency'],
+        executor_workers=config_rc['executor_workers'],
+    )
+
+
+def is_web_only() -> bool:
+    """Проверить, что процесс запущен супервизором только как веб-сервер"""
+    return os.environ.get(WEB_ONLY_ENV) == '1'
+
+
+def is_async_runtime() -> bool:
+    """Проверить, должен ли бот работать в цикле событий веб-сервера"""
+    return settings.bot.runtime == ASYNC_RUNTIME
+
+
+def on_bot_task_done(task: asyncio.Task) -> None:
+    """Сообщить об остановке бота с ошибкой сразу, а не при остановке веб-сервера"""
+    if task.cancelled() or task.exception() is None:
+        return
+    ex: BaseException = task.exception()
+    metrics.ERRORS.labels(type(ex).__name__).inc()
+    logging.error(f'Бот остановился с ошибкой: {ex}', exc_info=ex)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Запустить асинхронного бота вместе с веб-сервером и остановить при завершении"""
+    task: Optional[asyncio.Task] = None
+    settings.start_watching()
+    if not is_web_only() and is_async_runtime():
+        await asyncio.to_thread(database.init_db)
+        app.state.bot = create_async_bot(settings.bot.as_dict())
+        task = asyncio.create_task(app.state.bot.run_async())
+        task.add_done_callback(on_bot_task_done)
+    try:
+        yield
+    finally:
+        if task is not None:
+            app.state.bot.stop()
+            # Ошибка бота уже записана в лог в on_bot_task_done
+            await asyncio.gather(task, return_exceptions=True)
+        # Создать задачи, накопленные для пакетной отправки в Jira
+        await asyncio.to_thread(issue_batcher.stop)
+        # Дописать в БД все, что накопилось в очереди отложенной записи
+        await asyncio.to_thread(database.write_queue.stop)
+        await database.dispose_async_engine()
+        settings.stop_watching()
 
-OFFLINE_STATUS: str = 'offline'
 
-app: FastAPI = FastAPI()
-templates: Jinja2Templates = Jinja2Templates(directory='src/templates')
+app: FastAPI = FastAPI(lifespan=lifespan)
+templates: Jinja2Templates = Jinja2Templates(directory=TEMPLATES_DIR)
 app.mount(
-    '/static', StaticFiles(directory='src/static', html=True), name='static'
+    '/static', StaticFiles(directory=STATIC_DIR, html=True), name='static'
 )
 
 
+def bad_request(ex: Exception) -> JSONResponse:
+    """Ответ 400 на некорректный параметр запроса (дату, курсор страницы)"""
+    return JSONResponse(
+        {'detail': f'Некорректный параметр запроса: {ex}'}, status_code=400
+    )
+
+
 @app.get('/logs', response_class=HTMLResponse)
-def get_logs(
+async def get_logs(
     request: Request,
     project_id: Optional[int] = None,
     startDate: Optional[str] = None,
     endDate: Optional[str] = None,
+    limit: int = Query(LOGS_PAGE_SIZE, ge=1, le=LOGS_MAX_PAGE_SIZE),
+    after: Optional[str] = None,
 ):
     """Обработчик GET-запросов для отображения логов созданных задач"""
 
     try:
         logs: List[int] = []
         if project_id is not None:
-            logs: List[Tuple] = database.get_logs_from_db(
-                project_id, startDate, endDate
-            )
+            try:
+                logs, next_cursor = await database.get_logs_page_async(
+                    project_id, startDate, endDate, limit, after
+                )
+            except ValueError as ex:
+                return bad_request(ex)
             logs_data: List[Dict[str, Any]] = [
                 {
                     'user_name': user_name,
@@ -49,10 +213,10 @@ def get_logs(
                 }
                 for log, user_name, user_id in logs
             ]
-            return json.dumps(logs_data)
+            return JSONResponse({'items': logs_data, 'next': next_cursor})
 
-        jira_client: JiraClient = JiraClient()
-        projects: List[Any] = jira_client.get_projects()
+        # Каталог может сходить в Jira синхронным клиентом - не блокируем цикл событий
+        projects: List[Any] = await asyncio.to_thread(project_catalog.get_projects)
 
         # Представление TemplateResponse для формирование таблицы
         return templates.TemplateResponse(
@@ -62,71 +226,358 @@ def get_logs(
     except database.DatabaseError as ex1:
         logging.exception(f'Произошла ошибка базы данных: {ex1}')
 
-    except jira_client.JiraError as ex2:
+    except JIRAError as ex2:
         logging.exception(f'Произошла ошибка Jira: {ex2}')
 
     except Exception as ex3:
         logging.exception(f'Возникло исключение: {ex3}')
 
 
-def load_uvicorn_conf() -> Tuple[str, int]:
-    """Загрузить параметры host и port из конфигурационного файла"""
+def format_export_row(
+    user_name: str, user_id: str, task_link: str, datetime_creating
+) -> Tuple:
+    """Получить строку выгрузки в порядке EXPORT_COLUMNS"""
+    return (
+        user_name,
+        user_id,
+        task_link,
+        task_link.split('browse/')[-1],
+        datetime_creating.strftime('%Y-%m-%d %H:%M:%S'),
+    )
+
+
+async def generate_logs_export(
+    rows: AsyncIterator[Tuple], first_row: Optional[Tuple], export_format: str
+) -> AsyncIterator[str]:
+    """Сформировать выгрузку истории по частям, не загружая ее в память целиком"""
+    buffer: io.StringIO = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+
     try:
-        with open('src/data/config_uvicorn.json') as app_json_file:
-            config_uvicorn: Dict[str, Any] = json.load(app_json_file)
+        # Первая строка прочитана до ответа, чтобы ошибка БД вернула 500, а не пустой файл
+        row: Optional[Tuple] = first_row
+        while row is not None:
+            values: Tuple = format_export_row(*row)
+            if export_format == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(
+                    json.dumps(dict(zip(EXPORT_COLUMNS, values)), ensure_ascii=False)
+                    + '\n'
+                )
+            if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            row = await anext(rows, None)
+    except SQLAlchemyError as ex:
+        # Ответ обрывается: клиент должен увидеть сбой, а не усеченный файл с кодом 200
+        logging.exception(f'Произошла ошибка базы данных при выгрузке: {ex}')
+        raise
+    finally:
+        await rows.aclose()
+    yield buffer.getvalue()
 
-        host = config_uvicorn['host']
-        port = config_uvicorn['port']
-        return host, port
 
-    except FileNotFoundError as ex1:
-        raise Exception(f'Не удалось найти конфигурационный файл: {ex1}')
+@app.get('/logs/export')
+async def export_logs(
+    project_id: int,
+    startDate: str,
+    endDate: str,
+    export_format: str = Query('csv', alias='format', pattern='^(csv|ndjson)$'),
+) -> Response:
+    """Потоковая выгрузка истории создания задач в CSV или NDJSON"""
+    try:
+        database.parse_date_range(startDate, endDate)
+    except ValueError as ex:
+        return bad_request(ex)
 
-    except json.JSONDecodeError as ex2:
-        raise Exception(f'Ошибка декодирования JSON: {ex2}')
+    rows: AsyncIterator[Tuple] = database.iter_logs_async(
+        project_id, startDate, endDate
+    )
+    try:
+        first_row: Optional[Tuple] = await anext(rows, None)
+    except (database.DatabaseError, SQLAlchemyError) as ex:
+        logging.exception(f'Произошла ошибка базы данных при выгрузке: {ex}')
+        await rows.aclose()
+        return JSONResponse({'detail': 'Ошибка базы данных'}, status_code=500)
 
-    except Exception as ex3:
-        raise Exception(f'Возникло исключение: {ex3}')
+    filename: str = f'tasks_{project_id}_{startDate}_{endDate}.{export_format}'
+    return StreamingResponse(
+        generate_logs_export(rows, first_row, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
 
 
-def run_bot() -> None:
-    """Получить все параметры аутентификации и вызвать метод запуска бота с этими параметрами"""
+@app.get('/stats')
+async def get_stats(
+    startDate: str, endDate: str, project_id: Optional[int] = None
+) -> JSONResponse:
+    """Число созданных задач по дням, пользователям и проектам за период"""
     try:
-        with open('src/data/config_bot.json') as rc_json_file:
-            config_rc: Dict[str, str] = json.load(rc_json_file)
+        database.parse_date_range(startDate, endDate)
+    except ValueError as ex:
+        return bad_request(ex)
+    stats: Optional[Dict[str, List[Tuple]]] = await database.get_task_stats_async(
+        startDate, endDate, project_id
+    )
+    if stats is None:
+        return JSONResponse({'detail': 'Ошибка базы данных'}, status_code=500)
+
+    # Каталог может сходить в Jira синхронным клиентом - ищем проекты одним вызовом
+    # вне цикла событий
+    projects: List[Optional[Any]] = await asyncio.to_thread(
+        lambda: [
+            project_catalog.find_by_id(stats_project_id)
+            for stats_project_id, _ in stats['per_project']
+        ]
+    )
+    per_project: List[Dict[str, Any]] = [
+        {
+            'project_id': stats_project_id,
+            'project_name': project.name if project else None,
+            'count': int(count),
+        }
+        for (stats_project_id, count), project in zip(stats['per_project'], projects)
+    ]
+    return JSONResponse(
+        {
+            'per_day': [
+                {'day': str(day), 'count': int(count)}
+                for day, count in stats['per_day']
+            ],
+            'per_user': [
+                {'user_name': user_name, 'user_id': user_id, 'count': int(count)}
+                for user_name, user_id, count in stats['per_user']
+            ],
+            'per_project': per_project,
+        }
+    )
+
+
+@app.get('/db/pool')
+def get_db_pool_status() -> Dict[str, Any]:
+    """Статистика пула соединений с базой данных"""
+    return database.get_pool_status()
+
+
+def get_bot_stats_data(bot: Optional[RocketChatBot]) -> Dict[str, Any]:
+    """Статистика бота: пропускную способность считает только асинхронный бот"""
+    if bot is None or not hasattr(bot, 'stats'):
+        return {'runtime': 'thread'}
+    return bot.stats()
+
+
+def request_bot_process(path: str) -> Tuple[int, str, bytes]:
+    """Запросить путь у процесса бота через его HTTP-сервер метрик"""
+    response = requests.get(
+        f'http://{settings.web.host}:{settings.web.bot_metrics_port}{path}',
+        timeout=BOT_PROCESS_TIMEOUT,
+    )
+    return response.status_code, response.headers['Content-Type'], response.content
 
-        # Параметры аутентификации
-        base_url: str = config_rc['base_url']
-        username: str = config_rc['username']
-        password: str = config_rc['password']
-        bot_id: str = config_rc['bot_id']
 
-        bot: RocketChatBot = RocketChatBot(
-            base_url, username, password, bot_id
+async def proxy_to_bot_process(path: str) -> Response:
+    """Переслать запрос процессу бота: у воркера uvicorn под супервизором бота нет"""
+    if not settings.web.bot_metrics_port:
+        return PlainTextResponse(
+            'Не задан bot_metrics_port процесса бота', status_code=503
         )
+    try:
+        status_code, content_type, content = await asyncio.to_thread(
+            request_bot_process, path
+        )
+    except requests.exceptions.RequestException as ex:
+        logging.exception(f'Не удалось получить {path} у процесса бота: {ex}')
+        return PlainTextResponse('Процесс бота недоступен', status_code=502)
+    return Response(content, status_code=status_code, media_type=content_type)
+
+
+@app.get('/bot/stats')
+async def get_bot_stats() -> Response:
+    """Статистика пропускной способности асинхронного бота"""
+    if is_web_only():
+        return await proxy_to_bot_process('/bot/stats')
+    return JSONResponse(get_bot_stats_data(getattr(app.state, 'bot', None)))
+
+
+@app.get('/jira/batcher')
+async def get_issue_batcher_stats() -> Response:
+    """Статистика пакетного создания задач в Jira"""
+    if is_web_only():
+        return await proxy_to_bot_process('/jira/batcher')
+    return JSONResponse(issue_batcher.stats())
+
+
+@app.get('/jira/outbox')
+def get_issue_outbox_stats() -> JSONResponse:
+    """Число задач в outbox по статусам (общее для всех процессов бота)"""
+    counts: Optional[Dict[str, int]] = database.get_outbox_counts()
+    if counts is None:
+        return JSONResponse({'detail': 'Ошибка базы данных'}, status_code=500)
+    return JSONResponse(counts)
+
+
+@app.get('/db/user-cache')
+async def get_user_cache_stats() -> Response:
+    """Статистика кэша пользователей"""
+    if is_web_only():
+        return await proxy_to_bot_process('/db/user-cache')
+    return JSONResponse(database.user_cache.stats())
+
 
-        # Запуск бота
+@app.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics() -> Response:
+    """Метрики бота и веб-приложения в текстовом формате Prometheus"""
+    if is_web_only():
+        # Метрики отдельного воркера случайны для балансировщика - отдаем метрики бота
+        return await proxy_to_bot_process('/metrics')
+    return PlainTextResponse(
+        metrics.render(), media_type='text/plain; version=0.0.4'
+    )
+
+
+def request_bot_profile(
+    params: Dict[str, str], admin_token: str, seconds: float
+) -> Tuple[int, str]:
+    """Запросить профиль у процесса бота через его HTTP-сервер метрик"""
+    response = requests.get(
+        f'http://{settings.web.host}:{settings.web.bot_metrics_port}/profile',
+        params=params,
+        headers={profiler.ADMIN_TOKEN_HEADER: admin_token},
+        timeout=seconds + PROFILE_REQUEST_MARGIN,
+    )
+    return response.status_code, response.text
+
+
+@app.get('/admin/profile', response_class=PlainTextResponse)
+async def get_profile(
+    request: Request,
+    seconds: float = Query(profiler.DEFAULT_DURATION, gt=0, le=profiler.MAX_DURATION),
+    mode: str = Query(profiler.SAMPLING, pattern='^(sampling|cprofile)$'),
+    output_format: str = Query(
+        profiler.TEXT_FORMAT, alias='format', pattern='^(text|collapsed)$'
+    ),
+    x_admin_token: Optional[str] = Header(None),
+) -> PlainTextResponse:
+    """Снять профиль бота за seconds секунд (только с токеном администратора)"""
+    if not profiler.is_authorized(x_admin_token):
+        return PlainTextResponse('Доступ запрещен', status_code=403)
+
+    if is_web_only():
+        # Бот работает в отдельном процессе супервизора - профиль снимает он сам
+        if not settings.web.bot_metrics_port:
+            return PlainTextResponse(
+                'Не задан bot_metrics_port процесса бота', status_code=503
+            )
+        try:
+            status_code, text = await asyncio.to_thread(
+                request_bot_profile,
+                dict(request.query_params),
+                x_admin_token,
+                seconds,
+            )
+        except requests.exceptions.RequestException as ex:
+            logging.exception(f'Не удалось получить профиль процесса бота: {ex}')
+            return PlainTextResponse('Процесс бота недоступен', status_code=502)
+        return PlainTextResponse(text, status_code=status_code)
+
+    try:
+        report: str = await asyncio.to_thread(
+            profiler.capture, mode, seconds, output_format
+        )
+    except profiler.ProfilerBusy as ex:
+        return PlainTextResponse(str(ex), status_code=409)
+    return PlainTextResponse(report)
+
+
+def run_bot(bot: Optional[RocketChatBot] = None) -> None:
+    """Получить все параметры аутентификации и вызвать метод запуска бота с этими параметрами"""
+    try:
+        if bot is None:
+            bot = create_bot(settings.bot.as_dict())
+
+        # Создание недостающих таблиц и запуск бота
+        database.init_db()
         bot.run()
-    except FileNotFoundError as ex1:
-        logging.exception(f'Не удалось найти конфигурационный файл: {ex1}')
+    except ConfigError as ex1:
+        logging.exception(f'Ошибка конфигурации: {ex1}')
 
-    except json.JSONDecodeError as ex2:
-        logging.exception(f'Ошибка декодирования JSON: {ex2}')
+    except Exception as ex2:
+        logging.exception(f'Возникло исключение: {ex2}')
+
+    finally:
+        if bot is not None:
+            # Незавершенные задачи остаются в outbox и будут созданы после перезапуска
+            bot.outbox.stop()
+        issue_batcher.stop()
+        if bot is not None:
+            if bot.is_last_worker():
+                bot.set_status(OFFLINE_STATUS)
+            if bot.shard is not None:
+                bot.shard.stop()
+        database.write_queue.stop()
 
-    except Exception as ex3:
-        logging.exception(f'Возникло исключение: {ex3}')
 
+def run_bot_process() -> None:
+    """Запустить бота отдельным процессом: SIGTERM/SIGINT завершают его корректно"""
+    logging.basicConfig(level=logging.INFO)
+    # Ошибка в любом из файлов останавливает запуск, а не всплывает при первом запросе
+    settings.load()
+    settings.start_watching()
+    config_rc: Dict[str, Any] = settings.bot.as_dict()
+    async_runtime: bool = config_rc['runtime'] == ASYNC_RUNTIME
+    bot: RocketChatBot = (
+        create_async_bot(config_rc) if async_runtime else create_bot(config_rc)
+    )
+
+    def handle_signal(signum: int, frame: Any) -> None:
+        logging.info(f'Получен сигнал {signal.Signals(signum).name}, бот завершает работу')
+        bot.stop()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    if settings.web.bot_metrics_port:
+        # Профиль и статистика снимаются внутри процесса бота, веб-сервер только
+        # пересылает запросы
+        metrics.register_route('/profile', profiler.handle_http)
+        metrics.register_route(
+            '/bot/stats', metrics.json_route(lambda: get_bot_stats_data(bot))
+        )
+        metrics.register_route('/jira/batcher', metrics.json_route(issue_batcher.stats))
+        metrics.register_route(
+            '/db/user-cache', metrics.json_route(database.user_cache.stats)
+        )
+        metrics.start_http_server(settings.web.host, settings.web.bot_metrics_port)
+
+    if not async_runtime:
+        run_bot(bot)
+        return
+    try:
+        database.init_db()
+        asyncio.run(bot.run_async())
+    except Exception as ex:
+        logging.exception(f'Возникло исключение: {ex}')
     finally:
-        bot.set_status(OFFLINE_STATUS)
+        issue_batcher.stop()
+        database.write_queue.stop()
 
 
 if __name__ == '__main__':
+    # Под супервизором бот запускается отдельным процессом: main.py bot
+    if sys.argv[1:] == ['bot']:
+        run_bot_process()
+        sys.exit(0)
     try:
-        bot_thread = threading.Thread(target=run_bot)
-        bot_thread.start()
-
-        host, port = load_uvicorn_conf()
+        settings.load()
+        if not is_async_runtime():
+            bot_thread = threading.Thread(target=run_bot)
+            bot_thread.start()
 
-        uvicorn.run(app, host=host, port=port)
+        uvicorn.run(app, host=settings.web.host, port=settings.web.port)
     except Exception as ex:
         logging.exception(f'Возникло исключение: {ex}')
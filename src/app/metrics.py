@@ -0,0 +1,338 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
+from urllib.parse import parse_qsl, urlsplit
+
+# Границы корзин гистограмм задержек по умолчанию (секунды)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+# Все созданные метрики в порядке объявления
+registry: List['Metric'] = []
+
+
+def format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    """Получить представление меток в формате Prometheus"""
+    if not labelnames:
+        return ''
+    pairs: str = ','.join(
+        '{}="{}"'.format(
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for name, value in zip(labelnames, values)
+    )
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """Базовый класс метрики с набором дочерних значений по меткам"""
+
+    type_name: str = ''
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock: threading.Lock = threading.Lock()
+        registry.append(self)
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> Any:
+        """Получить значение метрики для набора меток"""
+        key: Tuple[str, ...] = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            # Блокировка нужна только при первом появлении набора меток
+            with self._lock:
+                child = self._children.setdefault(key, self.new_child())
+        return child
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines: List[str] = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}',
+        ]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class CounterValue:
+    """Значение счетчика"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик"""
+
+    type_name = 'counter'
+
+    def new_child(self) -> CounterValue:
+        return CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[str]:
+        for key, child in list(self._children.items()):
+            labels: str = format_labels(self.labelnames, key)
+            yield f'{self.name}_total{labels} {child.value}'
+
+
+class Gauge(Metric):
+    """Текущее значение, вычисляемое функцией в момент сбора метрик"""
+
+    type_name = 'gauge'
+
+    def new_child(self) -> List[Optional[Callable[[], float]]]:
+        return [None]
+
+    def set_function(self, func: Callable[[], float], *values) -> None:
+        """Задать функцию, возвращающую значение метрики"""
+        self.labels(*values)[0] = func
+
+    def samples(self) -> Iterator[str]:
+        for key, child in list(self._children.items()):
+            if child[0] is None:
+                continue
+            try:
+                value: float = float(child[0]())
+            except Exception:
+                continue
+            yield f'{self.name}{format_labels(self.labelnames, key)} {value}'
+
+
+class HistogramValue:
+    """Значение гистограммы: счетчики корзин, сумма и количество наблюдений"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index: int = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Histogram(Metric):
+    """Гистограмма распределения значений (задержек)"""
+
+    type_name = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def new_child(self) -> HistogramValue:
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[str]:
+        labelnames: Tuple[str, ...] = self.labelnames + ('le',)
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts: List[int] = list(child.counts)
+                total: float = child.sum
+                count: int = child.count
+            cumulative: int = 0
+            for bound, bucket_count in zip(
+                self.buckets + (float('inf'),), counts
+            ):
+                cumulative += bucket_count
+                le: str = '+Inf' if bound == float('inf') else repr(bound)
+                labels: str = format_labels(labelnames, key + (le,))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {total}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+def timed(histogram: Histogram, *values):
+    """Декоратор: замерить время выполнения функции (метка по умолчанию - имя функции)"""
+
+    def decorator(func):
+        label_values = values or (
+            (func.__name__,) if histogram.labelnames else ()
+        )
+
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start: float = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    histogram.labels(*label_values).observe(
+                        time.perf_counter() - start
+                    )
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start: float = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.labels(*label_values).observe(
+                    time.perf_counter() - start
+                )
+
+        return wrapper
+
+    return decorator
+
+
+def render() -> str:
+    """Получить все метрики в текстовом формате Prometheus"""
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+# Обработчик дополнительного пути: (параметры запроса, заголовки) -> (код, тип, тело)
+RouteHandler = Callable[[Dict[str, str], Mapping[str, str]], Tuple[int, str, bytes]]
+
+# Дополнительные пути HTTP-сервера метрик (например, /profile)
+routes: Dict[str, RouteHandler] = {}
+
+
+def register_route(path: str, handler: RouteHandler) -> None:
+    """Обслуживать путь на HTTP-сервере метрик процесса"""
+    routes[path] = handler
+
+
+def json_route(func: Callable[[], Any]) -> RouteHandler:
+    """Обработчик пути, отдающий результат func() в JSON"""
+
+    def handler(
+        query: Dict[str, str], headers: Mapping[str, str]
+    ) -> Tuple[int, str, bytes]:
+        return 200, 'application/json', json.dumps(func(), default=str).encode()
+
+    return handler
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Отдает метрики процесса по GET /metrics и зарегистрированные пути"""
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            status, content_type, data = (
+                200,
+                'text/plain; version=0.0.4',
+                render().encode(),
+            )
+        elif url.path in routes:
+            status, content_type, data = routes[url.path](
+                dict(parse_qsl(url.query)), self.headers
+            )
+        else:
+            self.send_error(404)
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_http_server(host: str, port: int) -> ThreadingHTTPServer:
+    """Отдавать метрики по HTTP из процесса без веб-сервера (бот под супервизором)"""
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name='metrics-http', daemon=True
+    ).start()
+    return server
+
+
+POLL_ITERATION_SECONDS: Histogram = Histogram(
+    'bot_poll_iteration_seconds',
+    'Длительность одной итерации обработки сообщений',
+)
+JIRA_REQUEST_SECONDS: Histogram = Histogram(
+    'jira_request_seconds', 'Длительность обращений к Jira', ('method',)
+)
+ROCKETCHAT_REQUEST_SECONDS: Histogram = Histogram(
+    'rocketchat_request_seconds',
+    'Длительность запросов к REST API Rocket.Chat',
+    ('endpoint',),
+)
+DB_QUERY_SECONDS: Histogram = Histogram(
+    'db_query_seconds', 'Длительность операций с базой данных', ('helper',)
+)
+MESSAGES_PROCESSED: Counter = Counter(
+    'bot_messages_processed',
+    'Обработанные сообщения пользователей по стадиям создания задачи',
+    ('stage',),
+)
+ISSUES: Counter = Counter(
+    'bot_issues', 'Попытки создания задач в Jira', ('result',)
+)
+ERRORS: Counter = Counter('bot_errors', 'Ошибки по типам', ('type',))
+ACTIVE_CONVERSATIONS: Gauge = Gauge(
+    'bot_active_conversations', 'Диалоги создания задач в памяти'
+)
+DB_POOL: Gauge = Gauge(
+    'db_pool_connections', 'Соединения пула базы данных', ('state',)
+)
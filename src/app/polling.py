@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from cursor_store import format_ts, parse_ts
+
+# Как часто перечитывать список личных чатов целиком (секунды)
+FULL_SYNC_INTERVAL = 300.0
+# Запас при запросе изменений: часы узлов кластера Rocket.Chat могут расходиться (мс)
+UPDATED_SINCE_OVERLAP = 2000
+# Сколько опрашивать с минимальным интервалом после последнего сообщения (секунды)
+ACTIVE_WINDOW = 30.0
+# Во сколько раз растет интервал опроса в простое
+BACKOFF_FACTOR = 1.5
+
+
+class RoomSync:
+    """Отметка времени, с которой запрашиваются изменившиеся личные чаты"""
+
+    def __init__(self, full_sync_interval: float = FULL_SYNC_INTERVAL):
+        self.full_sync_interval: float = full_sync_interval
+        # Время последнего изменения комнаты по часам сервера (мс)
+        self.watermark: Optional[int] = None
+        self.delta_supported: bool = True
+        self.synced_at: float = 0.0
+        self.full_syncs: int = 0
+        self.delta_polls: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def needs_full_sync(self) -> bool:
+        """Проверить, что список чатов пора перечитать целиком"""
+        return (
+            not self.delta_supported
+            or self.watermark is None
+            or time.monotonic() - self.synced_at >= self.full_sync_interval
+        )
+
+    def get_updated_since(self) -> str:
+        """Получить параметр updatedSince для запроса изменений"""
+        return format_ts(max(0, self.watermark - UPDATED_SINCE_OVERLAP))
+
+    def advance(self, rooms: List[Dict[str, Any]]) -> None:
+        for room in rooms:
+            if '_updatedAt' in room:
+                updated_at: int = parse_ts(room['_updatedAt'])
+                if self.watermark is None or updated_at > self.watermark:
+                    self.watermark = updated_at
+
+    def on_full_sync(self, rooms: List[Dict[str, Any]]) -> None:
+        """Запомнить время последнего изменения после полного обхода"""
+        with self._lock:
+            self.synced_at = time.monotonic()
+            self.full_syncs += 1
+            # Обход идет от недавно измененных комнат: изменившиеся во время обхода
+            # переезжают в начало списка и окажутся новее отметки
+            self.advance(rooms)
+
+    def on_delta(self, rooms: List[Dict[str, Any]]) -> None:
+        """Сдвинуть отметку по комнатам из ответа с изменениями"""
+        with self._lock:
+            self.delta_polls += 1
+            self.advance(rooms)
+
+    def reset(self) -> None:
+        """Перечитать список чатов целиком при следующем опросе"""
+        with self._lock:
+            self.watermark = None
+
+    def disable_delta(self) -> None:
+        """Сервер не поддерживает запрос изменений - всегда читать список целиком"""
+        self.delta_supported = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'watermark': format_ts(self.watermark) if self.watermark else None,
+            'delta_supported': self.delta_supported,
+            'full_syncs': self.full_syncs,
+            'delta_polls': self.delta_polls,
+        }
+
+
+class AdaptivePollInterval:
+    """Интервал опроса: минимальный, пока пользователи пишут, и растущий в простое"""
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        active_window: float = ACTIVE_WINDOW,
+        factor: float = BACKOFF_FACTOR,
+    ):
+        self.min_interval: float = min_interval
+        self.max_interval: float = max_interval
+        self.active_window: float = active_window
+        self.factor: float = factor
+        self.current: float = min_interval
+        # После запуска бот сначала опрашивает часто
+        self.last_activity: float = time.monotonic()
+
+    def record(self, active: bool) -> float:
+        """Учесть результат опроса и получить паузу до следующего"""
+        now: float = time.monotonic()
+        if active:
+            self.last_activity = now
+            self.current = self.min_interval
+        elif now - self.last_activity >= self.active_window:
+            self.current = min(self.max_interval, self.current * self.factor)
+        return self.current
+
+    def configure(self, min_interval: float, max_interval: float) -> None:
+        """Задать новые границы интервала без перезапуска"""
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.current = min(max(self.current, self.min_interval), self.max_interval)
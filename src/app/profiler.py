@@ -0,0 +1,255 @@
+"""Снимок профиля работающего процесса по запросу, без перезапуска.
+
+Сэмплирование раз в несколько миллисекунд снимает стеки всех потоков через
+sys._current_frames() и почти не замедляет бота. cProfile дает точное число
+вызовов и время функций, но включается только в потоках, которые обрабатывают
+сообщения (внутри profiled()), и только на время снимка.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from settings import settings
+
+SAMPLING = 'sampling'
+CPROFILE = 'cprofile'
+MODES: Tuple[str, ...] = (SAMPLING, CPROFILE)
+TEXT_FORMAT = 'text'
+COLLAPSED_FORMAT = 'collapsed'
+FORMATS: Tuple[str, ...] = (TEXT_FORMAT, COLLAPSED_FORMAT)
+
+# Длительность снимка по умолчанию и максимальная (секунды)
+DEFAULT_DURATION = 10.0
+MAX_DURATION = 120.0
+# Интервал между снимками стеков при сэмплировании (секунды)
+SAMPLE_INTERVAL = 0.005
+# Сколько функций выводить в текстовом отчете
+TOP_FUNCTIONS = 40
+# Сколько ждать завершения обработки, начатой до конца снимка cProfile (секунды)
+CPROFILE_DRAIN_TIMEOUT = 5.0
+# Заголовок с токеном администратора
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
+
+class ProfilerBusy(Exception):
+    """Другой снимок профиля еще не завершен"""
+
+
+class CProfileCapture:
+    """Статистика cProfile, собираемая из нескольких потоков за время снимка"""
+
+    def __init__(self, deadline: float):
+        self.deadline: float = deadline
+        self.stats: Optional[pstats.Stats] = None
+        self.units: int = 0
+        self.active: int = 0
+        self.stream: io.StringIO = io.StringIO()
+        self._condition: threading.Condition = threading.Condition()
+
+    def enter(self) -> None:
+        with self._condition:
+            self.active += 1
+
+    def add(self, profile: cProfile.Profile) -> None:
+        with self._condition:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile, stream=self.stream)
+            else:
+                self.stats.add(profile)
+            self.units += 1
+            self.active -= 1
+            self._condition.notify_all()
+
+    def wait_idle(self, timeout: float) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self.active == 0, timeout)
+
+    def report(self, limit: int) -> Optional[str]:
+        """Получить функции, отсортированные по времени с учетом вложенных вызовов"""
+        with self._condition:
+            if self.stats is None:
+                return None
+            self.stats.sort_stats('cumulative').print_stats(limit)
+            return self.stream.getvalue()
+
+
+# Не более одного снимка одновременно: cProfile и так замедляет обработку
+_capture_lock: threading.Lock = threading.Lock()
+_cprofile_capture: Optional[CProfileCapture] = None
+_local: threading.local = threading.local()
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    """Проверить токен администратора; без admin_token в конфигурации профилирование выключено"""
+    admin_token: Optional[str] = settings.web.admin_token
+    if not admin_token or not token:
+        return False
+    return hmac.compare_digest(token.encode(), admin_token.encode())
+
+
+@contextmanager
+def profiled() -> Iterator[None]:
+    """Профилировать блок через cProfile, если сейчас идет снимок"""
+    current: Optional[CProfileCapture] = _cprofile_capture
+    profile: Optional[cProfile.Profile] = None
+    # Вложенный блок уже учтен внешним
+    if (
+        current is not None
+        and not getattr(_local, 'active', False)
+        and time.monotonic() < current.deadline
+    ):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик (например, отладчик)
+            profile = None
+    if profile is None:
+        yield
+        return
+    current.enter()
+    _local.active = True
+    try:
+        yield
+    finally:
+        profile.disable()
+        _local.active = False
+        current.add(profile)
+
+
+def get_frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> Tuple[Counter, int]:
+    """Снимать стеки всех потоков, кроме текущего; вернуть счетчик стеков и число снимков"""
+    own_thread_id: int = threading.get_ident()
+    stacks: Counter = Counter()
+    samples: int = 0
+    deadline: float = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        thread_names: Dict[int, str] = {
+            thread.ident: thread.name for thread in threading.enumerate()
+        }
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            frames: List[str] = []
+            while frame is not None:
+                frames.append(get_frame_name(frame))
+                frame = frame.f_back
+            frames.append(thread_names.get(thread_id, str(thread_id)))
+            stacks[';'.join(reversed(frames))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def format_samples(stacks: Counter, samples: int, seconds: float) -> str:
+    """Отчет по сэмплам: доля снимков, где функция на вершине стека и где она в стеке"""
+    total: int = sum(stacks.values()) or 1
+    own: Counter = Counter()
+    inclusive: Counter = Counter()
+    for stack, count in stacks.items():
+        # Первый элемент - имя потока
+        frames: List[str] = stack.split(';')[1:]
+        if not frames:
+            continue
+        own[frames[-1]] += count
+        for frame_name in set(frames):
+            inclusive[frame_name] += count
+
+    lines: List[str] = [
+        f'Сэмплирование: {seconds:g} с, {samples} снимков, '
+        f'интервал {SAMPLE_INTERVAL * 1000:g} мс',
+        '',
+        'Функция на вершине стека (включая ожидание):',
+    ]
+    lines.extend(
+        f'{count / total * 100:6.2f}%  {name}'
+        for name, count in own.most_common(TOP_FUNCTIONS)
+    )
+    lines.extend(['', 'Функция в стеке:'])
+    lines.extend(
+        f'{count / total * 100:6.2f}%  {name}'
+        for name, count in inclusive.most_common(TOP_FUNCTIONS)
+    )
+    return '\n'.join(lines) + '\n'
+
+
+def capture_samples(seconds: float, output_format: str = TEXT_FORMAT) -> str:
+    """Снять профиль сэмплированием"""
+    stacks, samples = sample_stacks(seconds)
+    if output_format == COLLAPSED_FORMAT:
+        # Формат flamegraph.pl и speedscope: стек через ; и число снимков
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in stacks.most_common()
+        )
+    return format_samples(stacks, samples, seconds)
+
+
+def capture_cprofile(seconds: float) -> str:
+    """Снять профиль cProfile с потоков, обрабатывающих сообщения"""
+    global _cprofile_capture
+    current: CProfileCapture = CProfileCapture(time.monotonic() + seconds)
+    _cprofile_capture = current
+    try:
+        time.sleep(seconds)
+    finally:
+        _cprofile_capture = None
+    current.wait_idle(CPROFILE_DRAIN_TIMEOUT)
+    header: str = f'cProfile: {seconds:g} с, обработано блоков: {current.units}\n'
+    report: Optional[str] = current.report(TOP_FUNCTIONS)
+    if report is None:
+        return header + 'За время снимка бот не обработал ни одного сообщения\n'
+    return header + report
+
+
+def capture(
+    mode: str = SAMPLING,
+    seconds: float = DEFAULT_DURATION,
+    output_format: str = TEXT_FORMAT,
+) -> str:
+    """Снять профиль процесса за seconds секунд"""
+    if mode not in MODES:
+        raise ValueError(f'Неизвестный режим профилирования: {mode}')
+    if output_format not in FORMATS:
+        raise ValueError(f'Неизвестный формат отчета: {output_format}')
+    if not 0 < seconds <= MAX_DURATION:
+        raise ValueError(f'Длительность снимка должна быть от 0 до {MAX_DURATION:g} с')
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilerBusy('Снимок профиля уже выполняется')
+    try:
+        if mode == CPROFILE:
+            return capture_cprofile(seconds)
+        return capture_samples(seconds, output_format)
+    finally:
+        _capture_lock.release()
+
+
+def handle_http(
+    query: Dict[str, str], headers: Mapping[str, str]
+) -> Tuple[int, str, bytes]:
+    """Обработать GET /profile на HTTP-сервере метрик процесса бота"""
+    if not is_authorized(headers.get(ADMIN_TOKEN_HEADER)):
+        return 403, 'text/plain; charset=utf-8', 'Доступ запрещен\n'.encode()
+    try:
+        report: str = capture(
+            query.get('mode', SAMPLING),
+            float(query.get('seconds', DEFAULT_DURATION)),
+            query.get('format', TEXT_FORMAT),
+        )
+    except ValueError as ex:
+        return 400, 'text/plain; charset=utf-8', f'{ex}\n'.encode()
+    except ProfilerBusy as ex:
+        return 409, 'text/plain; charset=utf-8', f'{ex}\n'.encode()
+    return 200, 'text/plain; charset=utf-8', report.encode()
@@ -0,0 +1,90 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from jira_client import JiraClient, jira_client
+
+# Время, в течение которого список проектов считается свежим (секунды)
+PROJECTS_TTL = 300.0
+# Пауза перед повторной попыткой, если Jira не вернула проекты (секунды)
+RETRY_DELAY = 10.0
+
+
+class ProjectCatalog:
+    """Кэш списка проектов Jira с индексами по названию и id и фоновым обновлением"""
+
+    def __init__(self, jira_client: JiraClient, ttl: float = PROJECTS_TTL):
+        self.jira_client: JiraClient = jira_client
+        self.ttl: float = ttl
+        self._projects: List[Any] = []
+        self._by_name: Dict[str, Any] = {}
+        self._by_id: Dict[str, Any] = {}
+        self._expires_at: float = 0.0
+        self._lock: threading.Lock = threading.Lock()
+        self._load_lock: threading.Lock = threading.Lock()
+        self._refreshing: bool = False
+
+    def refresh(self) -> None:
+        """Загрузить список проектов из Jira и перестроить индексы"""
+        try:
+            projects: List[Any] = self.jira_client.get_projects()
+            with self._lock:
+                if projects:
+                    self._projects = projects
+                    self._by_name = {project.name: project for project in projects}
+                    self._by_id = {str(project.id): project for project in projects}
+                    self._expires_at = time.monotonic() + self.ttl
+                else:
+                    # Оставляем прежний список и пробуем снова чуть позже
+                    self._expires_at = time.monotonic() + RETRY_DELAY
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _start_background_refresh(self) -> None:
+        """Запустить обновление в фоне, если оно еще не идет"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(
+            target=self.refresh, name='project-catalog-refresh', daemon=True
+        ).start()
+
+    def _ensure_loaded(self) -> None:
+        """Загрузить проекты при первом обращении, а устаревшие обновить в фоне"""
+        if time.monotonic() < self._expires_at:
+            return
+        if not self._projects:
+            # Первая загрузка выполняется одним потоком, остальные ждут ее результата
+            with self._load_lock:
+                if time.monotonic() >= self._expires_at:
+                    with self._lock:
+                        self._refreshing = True
+                    self.refresh()
+        else:
+            self._start_background_refresh()
+
+    def get_projects(self) -> List[Any]:
+        """Получить список проектов"""
+        self._ensure_loaded()
+        return self._projects
+
+    def find_by_name(self, name: Optional[str]) -> Optional[Any]:
+        """Найти проект по названию"""
+        self._ensure_loaded()
+        return self._by_name.get(name)
+
+    def find_by_id(self, project_id: Any) -> Optional[Any]:
+        """Найти проект по id"""
+        self._ensure_loaded()
+        return self._by_id.get(str(project_id))
+
+    def invalidate(self) -> None:
+        """Считать список устаревшим, чтобы при следующем обращении он обновился"""
+        with self._lock:
+            self._expires_at = 0.0
+
+
+# Общий для бота и веб-приложения каталог проектов
+project_catalog: ProjectCatalog = ProjectCatalog(jira_client)
@@ -0,0 +1,263 @@
+import asyncio
+import itertools
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import metrics
+
+# Приоритеты исходящих запросов: чем меньше, тем раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_HOUSEKEEPING = 2
+
+# Приоритет по методу REST API, остальные методы получают PRIORITY_DEFAULT
+ENDPOINT_PRIORITIES: Dict[str, int] = {
+    'login': PRIORITY_INTERACTIVE,
+    'chat.postMessage': PRIORITY_INTERACTIVE,
+    'users.setStatus': PRIORITY_HOUSEKEEPING,
+}
+
+# Бюджеты по умолчанию: (число вызовов, период в секундах).
+# 'global' ограничивает все запросы вместе, 'default' - каждый метод без своей записи
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    'global': (50, 1.0),
+    'default': (20, 1.0),
+}
+
+# Как часто асинхронный запрос перепроверяет очередь, если впереди готовый запрос (секунды)
+ASYNC_RECHECK_INTERVAL = 0.005
+
+THROTTLE_SECONDS: metrics.Counter = metrics.Counter(
+    'rocketchat_throttle_seconds',
+    'Время ожидания запросов к Rocket.Chat в ограничителе частоты',
+    ('endpoint',),
+)
+RATE_LIMITED: metrics.Counter = metrics.Counter(
+    'rocketchat_rate_limited',
+    'Ответы 429 от Rocket.Chat',
+    ('endpoint',),
+)
+QUEUE_DEPTH: metrics.Gauge = metrics.Gauge(
+    'rocketchat_request_queue_depth',
+    'Запросы к Rocket.Chat, ожидающие своей очереди',
+)
+
+
+class TokenBucket:
+    """Маркерная корзина: capacity вызовов с равномерным пополнением за period секунд"""
+
+    def __init__(self, calls: float, period: float):
+        self.capacity: float = float(calls)
+        self.rate: float = calls / period
+        self.tokens: float = self.capacity
+        self.updated_at: float = time.monotonic()
+        # До этого момента запросы запрещены сервером (Retry-After, X-RateLimit-Reset)
+        self.blocked_until: float = 0.0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд в корзине появится маркер"""
+        self.refill(now)
+        wait: float = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """Планировщик исходящих запросов с бюджетами по методам и очередью по приоритетам"""
+
+    def __init__(
+        self, rate_limits: Optional[Mapping[str, Tuple[float, float]]] = None
+    ):
+        # Ожидающие запросы: [приоритет, порядковый номер, метод]
+        self._waiters: List[List[Any]] = []
+        self._seq = itertools.count()
+        self._condition: threading.Condition = threading.Condition()
+        self.configure(rate_limits)
+        self.throttle_time: float = 0.0
+        self.rate_limited: int = 0
+        QUEUE_DEPTH.set_function(lambda: len(self._waiters))
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    def configure(
+        self, rate_limits: Optional[Mapping[str, Tuple[float, float]]] = None
+    ) -> None:
+        """Задать бюджеты частоты; корзины создаются заново с полным запасом"""
+        limits: Dict[str, Tuple[float, float]] = dict(DEFAULT_RATE_LIMITS)
+        limits.update(rate_limits or {})
+        with self._condition:
+            self.rate_limits: Dict[str, Tuple[float, float]] = limits
+            self.global_bucket: TokenBucket = TokenBucket(*limits['global'])
+            self._buckets: Dict[str, TokenBucket] = {}
+            self._condition.notify_all()
+
+    def get_bucket(self, endpoint: str) -> TokenBucket:
+        bucket: Optional[TokenBucket] = self._buckets.get(endpoint)
+        if bucket is None:
+            bucket = TokenBucket(
+                *self.rate_limits.get(endpoint, self.rate_limits['default'])
+            )
+            self._buckets[endpoint] = bucket
+        return bucket
+
+    def _wait_time(self, endpoint: str, now: float) -> float:
+        return max(
+            self.global_bucket.wait_time(now),
+            self.get_bucket(endpoint).wait_time(now),
+        )
+
+    def _grant(self, endpoint: str) -> None:
+        self.global_bucket.consume()
+        self.get_bucket(endpoint).consume()
+
+    def try_acquire(self, endpoint: str) -> bool:
+        """Занять маркер без ожидания, если очередь пуста и бюджет есть"""
+        with self._condition:
+            if self._waiters or self._wait_time(endpoint, time.monotonic()) > 0:
+                return False
+            self._grant(endpoint)
+            return True
+
+    def _try_grant(
+        self, ticket: List[Any], now: float
+    ) -> Tuple[bool, Optional[float]]:
+        """Выдать маркер запросу, если подошла его очередь; иначе вернуть время ожидания"""
+        # Вызывается под self._condition. Ожидание None - впереди готовый запрос,
+        # ждем, пока он заберет маркер
+        wait: Optional[float] = None
+        # Маркер получает самый приоритетный запрос, метод которого не исчерпал бюджет
+        for waiter in sorted(self._waiters):
+            waiter_wait: float = self._wait_time(waiter[2], now)
+            if waiter is ticket and waiter_wait <= 0:
+                self._waiters.remove(ticket)
+                self._grant(ticket[2])
+                self._condition.notify_all()
+                return True, None
+            if waiter_wait <= 0:
+                return False, None
+            wait = waiter_wait if wait is None else min(wait, waiter_wait)
+        return False, wait
+
+    def _new_ticket(self, endpoint: str, priority: Optional[int]) -> List[Any]:
+        if priority is None:
+            priority = ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_DEFAULT)
+        return [priority, next(self._seq), endpoint]
+
+    def acquire(
+        self, endpoint: str, priority: Optional[int] = None
+    ) -> float:
+        """Дождаться разрешения на запрос и получить время ожидания (секунды)"""
+        ticket: List[Any] = self._new_ticket(endpoint, priority)
+        start: float = time.monotonic()
+        with self._condition:
+            self._waiters.append(ticket)
+            while True:
+                granted, wait = self._try_grant(ticket, time.monotonic())
+                if granted:
+                    throttled: float = time.monotonic() - start
+                    self._record_throttle(endpoint, throttled)
+                    return throttled
+                self._condition.wait(wait)
+
+    async def acquire_async(
+        self, endpoint: str, priority: Optional[int] = None
+    ) -> float:
+        """Асинхронный вариант acquire: ожидание не занимает поток пула"""
+        ticket: List[Any] = self._new_ticket(endpoint, priority)
+        start: float = time.monotonic()
+        with self._condition:
+            self._waiters.append(ticket)
+        try:
+            while True:
+                with self._condition:
+                    granted, wait = self._try_grant(ticket, time.monotonic())
+                if granted:
+                    throttled: float = time.monotonic() - start
+                    self._record_throttle(endpoint, throttled)
+                    return throttled
+                # Условие потоков корутину не разбудит - перепроверяем очередь по таймеру
+                await asyncio.sleep(
+                    ASYNC_RECHECK_INTERVAL if wait is None else wait
+                )
+        except BaseException:
+            # Отмененный запрос не должен занимать место в очереди
+            with self._condition:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    self._condition.notify_all()
+            raise
+
+    def _record_throttle(self, endpoint: str, throttled: float) -> None:
+        if throttled > 0:
+            self.throttle_time += throttled
+            THROTTLE_SECONDS.labels(endpoint).inc(throttled)
+
+    def update_from_headers(
+        self, endpoint: str, status_code: int, headers: Mapping[str, str]
+    ) -> None:
+        """Учесть заголовки X-RateLimit-* и Retry-After из ответа сервера"""
+        now: float = time.monotonic()
+        blocked_until: float = 0.0
+        remaining: Optional[str] = headers.get('X-RateLimit-Remaining')
+        reset: Optional[str] = headers.get('X-RateLimit-Reset')
+        if remaining is not None and reset is not None:
+            try:
+                if int(remaining) <= 0:
+                    # Rocket.Chat отдает момент сброса в миллисекундах от эпохи
+                    blocked_until = now + max(
+                        0.0, int(reset) / 1000 - time.time()
+                    )
+            except ValueError:
+                pass
+        if status_code == 429:
+            self.rate_limited += 1
+            RATE_LIMITED.labels(endpoint).inc()
+            retry_after: Optional[float] = parse_retry_after(
+                headers.get('Retry-After')
+            )
+            if retry_after is not None:
+                blocked_until = max(blocked_until, now + retry_after)
+            elif not blocked_until:
+                # Сервер не сказал, сколько ждать - пропускаем один период бюджета
+                bucket: TokenBucket = self.get_bucket(endpoint)
+                blocked_until = now + bucket.capacity / bucket.rate
+        if blocked_until:
+            with self._condition:
+                bucket = self.get_bucket(endpoint)
+                bucket.blocked_until = max(bucket.blocked_until, blocked_until)
+                bucket.tokens = min(bucket.tokens, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить статистику ограничителя"""
+        return {
+            'queue_depth': len(self),
+            'throttle_time': round(self.throttle_time, 3),
+            'rate_limited': self.rate_limited,
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Получить задержку из Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
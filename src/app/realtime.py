@@ -0,0 +1,189 @@
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    import websocket
+except ImportError:  # websocket-client не установлен - доступен только опрос
+    websocket = None
+
+# Коллекции и события Realtime API, на которые подписывается бот
+STREAM_ROOM_MESSAGES = 'stream-room-messages'
+STREAM_NOTIFY_USER = 'stream-notify-user'
+MY_MESSAGES_EVENT = '__my_messages__'
+
+# Тип комнаты личного чата
+DIRECT_ROOM_TYPE = 'd'
+
+
+class RealtimeError(Exception):
+    """Ошибка соединения с Realtime API"""
+
+
+def is_available() -> bool:
+    """Проверить, установлена ли библиотека websocket-client"""
+    return websocket is not None
+
+
+def get_websocket_url(base_url: str) -> str:
+    """Получить адрес WebSocket Realtime API по адресу REST API"""
+    parts = urlsplit(base_url)
+    scheme: str = 'wss' if parts.scheme == 'https' else 'ws'
+    return urlunsplit((scheme, parts.netloc, '/websocket', '', ''))
+
+
+class RealtimeClient:
+    """Клиент Realtime API Rocket.Chat (DDP поверх WebSocket)"""
+
+    def __init__(
+        self,
+        ws_url: str,
+        user_id: str,
+        get_auth_token: Callable[[], Optional[str]],
+        on_message: Callable[[str, Dict[str, Any]], None],
+        ping_interval: float = 30.0,
+    ):
+        self.ws_url: str = ws_url
+        self.user_id: str = user_id
+        self.get_auth_token = get_auth_token
+        self.on_message = on_message
+        self.ping_interval: float = ping_interval
+        self.ws: Optional[Any] = None
+        self._stopped: threading.Event = threading.Event()
+        self._next_id: int = 0
+
+    def get_next_id(self) -> str:
+        """Получить идентификатор для очередного DDP-запроса"""
+        self._next_id += 1
+        return str(self._next_id)
+
+    def send(self, data: Dict[str, Any]) -> None:
+        """Отправить DDP-сообщение"""
+        self.ws.send(json.dumps(data))
+
+    def recv(self) -> Dict[str, Any]:
+        """Получить DDP-сообщение, отвечая на ping сервера"""
+        while True:
+            raw: str = self.ws.recv()
+            if not raw:
+                raise RealtimeError('Сервер закрыл соединение')
+            data: Dict[str, Any] = json.loads(raw)
+            if data.get('msg') == 'ping':
+                self.send({'msg': 'pong'})
+                continue
+            return data
+
+    def call(self, method: str, params: list) -> Any:
+        """Вызвать DDP-метод и дождаться результата"""
+        call_id: str = self.get_next_id()
+        self.send(
+            {'msg': 'method', 'method': method, 'id': call_id, 'params': params}
+        )
+        while True:
+            data: Dict[str, Any] = self.recv()
+            if data.get('msg') == 'result' and data.get('id') == call_id:
+                if 'error' in data:
+                    raise RealtimeError(f'Ошибка метода {method}: {data["error"]}')
+                return data.get('result')
+            self.dispatch(data)
+
+    def subscribe(self, name: str, event: str) -> None:
+        """Подписаться на поток событий"""
+        sub_id: str = self.get_next_id()
+        self.send(
+            {'msg': 'sub', 'id': sub_id, 'name': name, 'params': [event, False]}
+        )
+        while True:
+            data: Dict[str, Any] = self.recv()
+            if data.get('msg') == 'ready' and sub_id in data.get('subs', []):
+                return
+            if data.get('msg') == 'nosub' and data.get('id') == sub_id:
+                raise RealtimeError(f'Подписка {name}/{event} отклонена')
+            self.dispatch(data)
+
+    def connect(self) -> None:
+        """Открыть соединение, войти по токену (resume) и подписаться на сообщения"""
+        if websocket is None:
+            raise RealtimeError('Библиотека websocket-client не установлена')
+        auth_token: Optional[str] = self.get_auth_token()
+        if auth_token is None:
+            raise RealtimeError('Нет токена авторизации для входа')
+        try:
+            self.ws = websocket.create_connection(
+                self.ws_url, timeout=self.ping_interval
+            )
+            self.send({'msg': 'connect', 'version': '1', 'support': ['1']})
+            data: Dict[str, Any] = self.recv()
+            if data.get('msg') != 'connected':
+                raise RealtimeError(f'Неожиданный ответ на connect: {data}')
+            self.call('login', [{'resume': auth_token}])
+            self.subscribe(STREAM_ROOM_MESSAGES, MY_MESSAGES_EVENT)
+            self.subscribe(STREAM_NOTIFY_USER, f'{self.user_id}/rooms-changed')
+        except (websocket.WebSocketException, OSError, ValueError) as ex:
+            self.close()
+            raise RealtimeError(f'Не удалось подключиться: {ex}') from ex
+        except RealtimeError:
+            self.close()
+            raise
+        logging.info(f'Подключено к Realtime API: {self.ws_url}')
+
+    def close(self) -> None:
+        """Закрыть соединение"""
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except (websocket.WebSocketException, OSError):
+                pass
+            self.ws = None
+
+    def stop(self) -> None:
+        """Остановить получение событий"""
+        self._stopped.set()
+        self.close()
+
+    def is_stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def dispatch(self, data: Dict[str, Any]) -> None:
+        """Передать сообщение из личного чата в обработчик бота"""
+        if data.get('msg') != 'changed':
+            return
+        fields: Dict[str, Any] = data.get('fields', {})
+        args: list = fields.get('args', [])
+        message: Optional[Dict[str, Any]] = None
+
+        if data.get('collection') == STREAM_ROOM_MESSAGES and args:
+            room_info: Dict[str, Any] = args[1] if len(args) > 1 else {}
+            if room_info.get('roomType', DIRECT_ROOM_TYPE) == DIRECT_ROOM_TYPE:
+                message = args[0]
+        elif data.get('collection') == STREAM_NOTIFY_USER and len(args) > 1:
+            room: Dict[str, Any] = args[1]
+            if room.get('t') == DIRECT_ROOM_TYPE:
+                message = room.get('lastMessage')
+
+        # Служебные сообщения (вход в комнату и т.п.) не обрабатываются
+        if message is None or message.get('t') or 'u' not in message:
+            return
+        self.on_message(message['rid'], message)
+
+    def listen(self) -> None:
+        """Передавать сообщения в обработчик до разрыва соединения"""
+        missed_pings: int = 0
+        try:
+            while not self.is_stopped():
+                try:
+                    self.dispatch(self.recv())
+                    missed_pings = 0
+                except websocket.WebSocketTimeoutException:
+                    # Сервер молчит дольше интервала ping - проверяем соединение
+                    missed_pings += 1
+                    if missed_pings > 1:
+                        raise RealtimeError('Сервер не отвечает на ping')
+                    self.send({'msg': 'ping'})
+        except (websocket.WebSocketException, OSError, ValueError) as ex:
+            if not self.is_stopped():
+                raise RealtimeError(f'Соединение разорвано: {ex}') from ex
+        finally:
+            self.close()
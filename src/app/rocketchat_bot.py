@@ -1,27 +1,92 @@
+import atexit
 import logging
+import random
 import requests
 import time
 from typing import Any, List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 import database
-from jira_client import Issue, JiraClient
+import metrics
+import profiler
+import realtime
+import tracing
+from cursor_store import CursorStore, format_ts
+from conversation import Conversation, ConversationStore
+from issue_batcher import IssueBatcher
+from issue_outbox import IssueOutbox
+from jira_client import IssueResult, jira_client
+from polling import AdaptivePollInterval, RoomSync
+from project_catalog import project_catalog
+from rate_limiter import RateLimiter
+from sharding import ShardCoordinator
+from realtime import RealtimeClient, RealtimeError
 
 CREATE_TASK = 'Создать задачу'
 START_OVER = 'Заново'
 VIEW_LOGS = 'Логи'
 BACK = 'Назад'
 ONLINE_STATUS = 'online'
+OFFLINE_STATUS = 'offline'
 WELCOME_MESSAGE = 'Привет, я помогу тебе создать задачу в Jira. Нажимай на кнопку "Создать задачу".'
 ENTER_TASK_NAME = 'Введите название будущей задачи:'
 PROJECT_NOT_FOUND = 'Проект с таким названием не найден.'
 ENTER_TASK_DESC = 'Введите описание будущей задачи:'
 USER_BANNED = 'Вы заблокированы администратором!'
-
-# Экземпляр класса JiraClient
-jira_client: JiraClient = JiraClient()
-
-# Экземпляр класса Issue
-issue: Issue = Issue()
+ISSUE_ACCEPTED = 'Задача принята. Пришлю ссылку, как только она появится в Jira.'
+ISSUE_NOT_SAVED = 'Не удалось сохранить задачу. Отправьте описание еще раз чуть позже.'
+ISSUE_FAILED = 'Ошибка создания задачи. Попробуйте позднее.'
+
+# Интервал опроса личных чатов, пока пользователи пишут, и наибольший в простое (секунды)
+POLL_INTERVAL = 0.1
+IDLE_POLL_INTERVAL = 2.0
+# Размер страницы при полном обходе списка личных чатов
+DM_PAGE_SIZE = 100
+# Полный обход идет от недавно измененных чатов (см. RoomSync)
+DM_SORT = '{"_updatedAt": -1}'
+# Ответы rooms.get, означающие, что сервер не поддерживает updatedSince; 401, 403 и
+# 429 после повторов - временные сбои, после них запрос изменений не отключается
+DELTA_UNSUPPORTED_STATUSES = (400, 404)
+# Границы задержки перед повторным подключением к Realtime API (секунды)
+REALTIME_RECONNECT_MIN_DELAY = 1.0
+REALTIME_RECONNECT_MAX_DELAY = 60.0
+# Размер страницы при догрузке истории комнаты
+HISTORY_PAGE_SIZE = 100
+# Таймаут запроса к REST API (секунды) и число повторов при 5xx и сетевых ошибках
+REQUEST_TIMEOUT = 10.0
+MAX_RETRIES = 3
+# Базовая и максимальная задержка между повторами (секунды)
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 10.0
+# Размер пула keep-alive соединений с сервером Rocket.Chat
+HTTP_POOL_SIZE = 10
+# Окно накопления задач для пакетного создания в Jira (секунды)
+ISSUE_BATCH_INTERVAL = 0.2
+
+# Пакетное создание задач: пользователи, закончившие диалог одновременно, попадают в один запрос
+issue_batcher: IssueBatcher = IssueBatcher(
+    jira_client, batch_interval=ISSUE_BATCH_INTERVAL
+)
+atexit.register(issue_batcher.stop)
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """Получить задержку перед повтором: экспоненциальный рост со случайным разбросом"""
+    return random.uniform(
+        0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+    )
+
+
+def is_connect_error(ex: Exception) -> bool:
+    """Проверить, что запрос не дошел до сервера: соединение не было установлено"""
+    if isinstance(ex, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(ex, requests.exceptions.ConnectionError) or not ex.args:
+        return False
+    # requests оборачивает ошибку urllib3 в MaxRetryError с причиной в reason
+    reason = getattr(ex.args[0], 'reason', ex.args[0])
+    return isinstance(reason, NewConnectionError)
 
 
 def catch_exceptions(func):
@@ -31,6 +96,8 @@ def catch_exceptions(func):
         try:
             return func(*args, **kwargs)
         except requests.exceptions.RequestException as ex:
+            metrics.ERRORS.labels(type(ex).__name__).inc()
+            tracing.record_exception(ex)
             logging.exception(f'Возникло исключение: {ex}')
 
     return wrapper
@@ -39,63 +106,240 @@ def catch_exceptions(func):
 class RocketChatBot:
     """Класс для работы с Rocket.Chat"""
 
-    # Текущая стадия создания задачи
-    creation_stage: int = 0
-
-    def __init__(self, base_url, username, password, bot_id):
+    def __init__(
+        self,
+        base_url,
+        username,
+        password,
+        bot_id,
+        realtime_enabled: bool = False,
+        websocket_url: Optional[str] = None,
+        conversations: Optional[ConversationStore] = None,
+        request_timeout: float = REQUEST_TIMEOUT,
+        max_retries: int = MAX_RETRIES,
+        rate_limits: Optional[Dict[str, Any]] = None,
+        shard: Optional[ShardCoordinator] = None,
+        outbox: Optional[IssueOutbox] = None,
+        poll_interval: float = POLL_INTERVAL,
+        idle_poll_interval: float = IDLE_POLL_INTERVAL,
+    ):
         self.base_url: str = base_url
         self.username: str = username
         self.password: str = password
         self.bot_id: str = bot_id
         self.auth_token: Optional[str] = None
+        self.request_timeout: float = request_timeout
+        self.max_retries: int = max_retries
+        # Общая сессия с пулом keep-alive соединений для всех запросов к REST API
+        self.session: requests.Session = requests.Session()
+        adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Все исходящие запросы проходят через бюджеты частоты и очередь по приоритетам
+        self.rate_limiter: RateLimiter = RateLimiter(rate_limits)
+        self.realtime_enabled: bool = realtime_enabled
+        self.websocket_url: str = websocket_url or realtime.get_websocket_url(
+            base_url
+        )
+        self.cursors: CursorStore = CursorStore()
+        # Опрос запрашивает только чаты, изменившиеся с прошлого раза
+        self.room_sync: RoomSync = RoomSync()
+        self.polling: AdaptivePollInterval = AdaptivePollInterval(
+            poll_interval, idle_poll_interval
+        )
+        # Состояние диалогов создания задачи по id комнаты
+        self.conversations: ConversationStore = (
+            conversations or ConversationStore()
+        )
+        metrics.ACTIVE_CONVERSATIONS.set_function(
+            lambda: len(self.conversations)
+        )
+        self._stopping: bool = False
+        self._realtime_client: Optional[RealtimeClient] = None
+        # Распределение комнат между несколькими процессами бота
+        self.shard: Optional[ShardCoordinator] = shard
+        if shard is not None:
+            shard.on_rebalance = self.on_rebalance
+        # Задачи создаются в Jira фоновым обработчиком, ответ с ссылкой приходит позже
+        self.outbox: IssueOutbox = outbox or IssueOutbox(jira_client, issue_batcher)
+        self.outbox.on_done = self.on_issue_created
+
+    def request(
+        self,
+        method: str,
+        endpoint: str,
+        relogin: bool = True,
+        idempotent: bool = True,
+        **kwargs,
+    ) -> requests.Response:
+        """Выполнить запрос к REST API с повторами при сбоях и повторным входом при 401"""
+        url: str = f'{self.base_url}{endpoint}'
+        histogram = metrics.ROCKETCHAT_REQUEST_SECONDS.labels(endpoint)
+        attempt: int = 0
+        with tracing.span(
+            'rocketchat.request', endpoint=endpoint, method=method
+        ) as request_span:
+            while True:
+                self.rate_limiter.acquire(endpoint)
+                start: float = time.perf_counter()
+                try:
+                    response = self.session.request(
+                        method, url, timeout=self.request_timeout, **kwargs
+                    )
+                except (
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                ) as ex:
+                    histogram.observe(time.perf_counter() - start)
+                    # Неидемпотентный запрос мог дойти до сервера до таймаута или 5xx,
+                    # его повторяем только при ошибке соединения и 429
+                    if attempt >= self.max_retries or not (
+                        idempotent or is_connect_error(ex)
+                    ):
+                        raise
+                else:
+                    histogram.observe(time.perf_counter() - start)
+                    request_span.set_attribute(
+                        'http.status_code', response.status_code
+                    )
+                    self.rate_limiter.update_from_headers(
+                        endpoint, response.status_code, response.headers
+                    )
+                    if response.status_code == 429 and attempt < self.max_retries:
+                        # Паузу до следующей попытки выдержит ограничитель частоты
+                        attempt += 1
+                        continue
+                    if response.status_code == 401 and relogin:
+                        # Токен истек - входим заново и повторяем запрос один раз
+                        relogin = False
+                        self.get_auth_token()
+                        continue
+                    if (
+                        response.status_code < 500
+                        or attempt >= self.max_retries
+                        or not idempotent
+                    ):
+                        request_span.set_attribute('attempts', attempt + 1)
+                        response.raise_for_status()
+                        return response
+                time.sleep(get_backoff_delay(attempt))
+                attempt += 1
 
     @catch_exceptions
     def get_auth_token(self) -> None:
         """Получить токен авторизации по логину и паролю бота-пользователя для работы от его лица"""
-        login_url: str = f'{self.base_url}login'
         data: Dict[str, str] = {
             'user': self.username,
             'password': self.password,
         }
-        response = requests.post(login_url, json=data)
-        response.raise_for_status()
+        response = self.request('POST', 'login', relogin=False, json=data)
         self.auth_token = response.json()['data']['authToken']
+        self.session.headers.update(
+            {'X-Auth-Token': self.auth_token, 'X-User-Id': self.bot_id}
+        )
 
     @catch_exceptions
     def set_status(self, status_name) -> None:
         """Задать статус бота"""
-        set_status_url = f'{self.base_url}users.setStatus'
-        headers: Dict[str, str] = {
-            'X-Auth-Token': self.auth_token,
-            'X-User-Id': self.bot_id,
-        }
         status_data: Dict[str, str] = {'status': status_name}
-        requests.post(set_status_url, headers=headers, json=status_data)
+        self.request('POST', 'users.setStatus', json=status_data)
 
     @catch_exceptions
     def send_message(self, data: dict) -> None:
         """Отправить сообщение в чат"""
-        send_msg_url = f'{self.base_url}chat.postMessage'
-        headers: Dict[str, str] = {
-            'X-Auth-Token': self.auth_token,
-            'X-User-Id': self.bot_id,
-        }
-
-        requests.post(send_msg_url, headers=headers, json=data)
+        # Повтор после таймаута мог бы отправить пользователю ответ дважды
+        self.request('POST', 'chat.postMessage', idempotent=False, json=data)
+
+    def get_dm_page_params(self, offset: int) -> Dict[str, Any]:
+        """Получить параметры запроса страницы списка личных чатов"""
+        return {'count': DM_PAGE_SIZE, 'offset': offset, 'sort': DM_SORT}
+
+    def is_last_dm_page(
+        self, data: Dict[str, Any], page: List[Dict[str, Any]], offset: int
+    ) -> bool:
+        """Проверить, что страница списка личных чатов последняя (offset - после нее)"""
+        return len(page) < DM_PAGE_SIZE or offset >= data.get('total', offset)
+
+    def get_updated_rooms(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Выбрать личные чаты из ответа rooms.get и сдвинуть отметку времени"""
+        rooms: List[Dict[str, Any]] = [
+            room for room in data['update'] if room.get('t') == 'd'
+        ]
+        self.room_sync.on_delta(rooms)
+        return rooms
+
+    def on_delta_unsupported(self, status_code: int) -> None:
+        logging.warning(
+            f'rooms.get с updatedSince недоступен (HTTP {status_code}), '
+            'список личных чатов будет запрашиваться целиком'
+        )
+        self.room_sync.disable_delta()
 
     @catch_exceptions
     def get_direct_messages(self) -> List[Dict[str, Any]]:
-        """Получить список сообщений из чата"""
-        dm_url: str = f'{self.base_url}im.list'
-        headers: Dict[str, str] = {
-            'X-Auth-Token': self.auth_token,
-            'X-User-Id': self.bot_id,
-        }
-        response = requests.get(dm_url, headers=headers)
-        response.raise_for_status()
-        dms: List[Dict[str, Any]] = response.json()['ims']
+        """Получить все личные чаты постранично"""
+        dms: List[Dict[str, Any]] = []
+        offset: int = 0
+        while True:
+            response = self.request(
+                'GET', 'im.list', params=self.get_dm_page_params(offset)
+            )
+            data: Dict[str, Any] = response.json()
+            page: List[Dict[str, Any]] = data['ims']
+            dms.extend(page)
+            offset += len(page)
+            if self.is_last_dm_page(data, page, offset):
+                break
+        self.room_sync.on_full_sync(dms)
         return dms
 
+    @catch_exceptions
+    def get_updated_direct_messages(self) -> List[Dict[str, Any]]:
+        """Получить личные чаты, изменившиеся с прошлого опроса"""
+        if self.room_sync.needs_full_sync():
+            return self.get_direct_messages()
+        try:
+            response = self.request(
+                'GET',
+                'rooms.get',
+                params={'updatedSince': self.room_sync.get_updated_since()},
+            )
+        except requests.exceptions.HTTPError as ex:
+            if (
+                ex.response is None
+                or ex.response.status_code not in DELTA_UNSUPPORTED_STATUSES
+            ):
+                raise
+            self.on_delta_unsupported(ex.response.status_code)
+            return self.get_direct_messages()
+        return self.get_updated_rooms(response.json())
+
+    @catch_exceptions
+    def get_room_history(
+        self, room_id: str, oldest: int
+    ) -> List[Dict[str, Any]]:
+        """Получить сообщения комнаты новее oldest (мс) в хронологическом порядке"""
+        messages: List[Dict[str, Any]] = []
+        offset: int = 0
+        while True:
+            params: Dict[str, Any] = {
+                'roomId': room_id,
+                'oldest': format_ts(oldest),
+                'count': HISTORY_PAGE_SIZE,
+                'offset': offset,
+            }
+            response = self.request('GET', 'im.history', params=params)
+            page: List[Dict[str, Any]] = response.json()['messages']
+            messages.extend(page)
+            if len(page) < HISTORY_PAGE_SIZE:
+                break
+            offset += len(page)
+        # API отдает сообщения от новых к старым
+        messages.reverse()
+        return messages
+
     def get_action_structure(
         self, text: str, url: Optional[str], message: str
     ) -> Dict[str, Any]:
@@ -174,10 +418,11 @@ class RocketChatBot:
 
     @catch_exceptions
     def go_to_next_stage(
-        self, creation_stage, room_id, message_text, user_id, user_name
+        self, conversation: Conversation, message_text, user_id, user_name
     ) -> None:
         """Логика переходов между этапами создания задачи"""
-        if creation_stage == 0:
+        room_id: str = conversation.room_id
+        if conversation.stage == 0:
             self.send_message(
                 self.get_data_for_stage_0(
                     room_id,
@@ -187,8 +432,8 @@ class RocketChatBot:
             )
 
         # Стадия 1 - ожидание ввода названия проекта от пользователя
-        elif creation_stage == 1:
-            projects: List[Any] = jira_client.get_projects()
+        elif conversation.stage == 1:
+            projects: List[Any] = project_catalog.get_projects()
 
             # Бот отправляет в чат список проектов в виде кнопок
             self.send_message(
@@ -198,144 +443,281 @@ class RocketChatBot:
                 )
             )
 
-            # Перейти на следующую стадию
-            self.creation_stage = 2
+            # Перейти на следующую стадию, проект будет выбран заново
+            conversation.project_name = None
+            conversation.stage = 2
 
         # Стадия 2 - ожидание ввода названия задачи от пользователя
-        elif creation_stage == 2:
-            projects: List[Any] = jira_client.get_projects()
-
-            if jira_client.get_project_name() is not None:
+        elif conversation.stage == 2:
+            if conversation.project_name is not None:
                 self.send_message(self.get_base_data(room_id, ENTER_TASK_NAME))
-                self.creation_stage = 3
+                conversation.stage = 3
 
             # Если проект с таким названием существует
-            elif any(message_text == project.name for project in projects):
+            elif project_catalog.find_by_name(message_text) is not None:
                 self.send_message(self.get_base_data(room_id, ENTER_TASK_NAME))
-                jira_client.set_project_name(message_text)
-                self.creation_stage = 3
+                conversation.project_name = message_text
+                conversation.stage = 3
             else:
                 self.send_message(
                     self.get_base_data(room_id, PROJECT_NOT_FOUND)
                 )
 
-        elif creation_stage == 3:
-            issue.set_issue_summary(message_text)
+        elif conversation.stage == 3:
+            conversation.summary = message_text
             self.send_message(self.get_base_data(room_id, ENTER_TASK_DESC))
-            self.creation_stage = 4
+            conversation.stage = 4
 
         # Стадия 4 - создание задачи исходя из полученных данных от пользователя
-        elif creation_stage == 4:
-            issue.set_issue_description(message_text)
-            projects: List[Any] = jira_client.get_projects()
+        elif conversation.stage == 4:
+            conversation.description = message_text
 
             # Ищем ключ проекта по его названию
-            project_key: Optional[str] = None
-            project_id: Optional[int] = None
-            for project in projects:
-                if jira_client.get_project_name() == project.name:
-                    project_key = project.key
-                    project_id = project.id
-                    break
+            project = project_catalog.find_by_name(conversation.project_name)
+            project_key: Optional[str] = project.key if project else None
+            project_id: Optional[int] = project.id if project else None
 
             # Получаем название задачи
-            issue_summary: str = (
-                f'(от {user_name}) {issue.get_issue_summary()}'
-            )
+            issue_summary: str = f'(от {user_name}) {conversation.summary}'
 
-            # Создаем новую задачу
-            if jira_client.create_new_issue(
+            # Задача сохраняется в outbox и создается в Jira в фоне, чат не ждет ответа Jira
+            if not self.outbox.add(
+                room_id,
+                user_id,
+                project_id,
                 project_key,
                 issue_summary,
-                issue.get_issue_description(),
+                conversation.description,
             ):
-                # Получаем ссылку на задачу
-                task_link: str = jira_client.get_issue_link(
-                    project_key, issue_summary
-                )
+                # Черновик остается на этой стадии - повторное описание попробует снова
+                self.send_message(self.get_base_data(room_id, ISSUE_NOT_SAVED))
+                return
+            self.send_message(self.get_base_data(room_id, ISSUE_ACCEPTED))
+
+            # Все заново
+            conversation.reset()
 
+    def on_issue_created(
+        self, record: database.IssueOutboxRecord, result: IssueResult
+    ) -> None:
+        """Сообщить пользователю результат создания задачи"""
+        metrics.ISSUES.labels('success' if result.success else 'failure').inc()
+        try:
+            if result.success:
+                # Запись в tasks_log уже сделана вместе с завершением задачи outbox
                 self.send_message(
                     self.get_base_data(
-                        room_id,
-                        f'[Задача]({task_link}) успешно создана!',
+                        record.room_id,
+                        f'[Задача]({result.url}) успешно создана!',
                     )
                 )
             else:
-                self.send_message(
-                    self.get_base_data(
-                        room_id,
-                        'Ошибка создания задачи. Попробуйте позднее.',
-                    )
-                )
+                self.send_message(self.get_base_data(record.room_id, ISSUE_FAILED))
+        except Exception as ex:
+            logging.exception(f'Ошибка при обработке созданной задачи: {ex}')
 
-            # Добавляем запись о создании задачи
-            database.insert_task_record(user_id, task_link, project_id)
+    @catch_exceptions
+    @metrics.timed(metrics.POLL_ITERATION_SECONDS)
+    def process_messages(self) -> int:
+        """Обработать новые сообщения из изменившихся личных чатов и вернуть их число"""
+        handled: int = 0
+        with profiler.profiled(), tracing.span('bot.poll') as poll_span:
+            # Чаты, изменившиеся с прошлого опроса
+            dms: List[Dict[str, Any]] = self.get_updated_direct_messages()
+            if dms is not None:
+                poll_span.set_attribute('rooms', len(dms))
+                for dm in dms:
+                    if 'lastMessage' in dm and self.handle_message(
+                        dm['_id'], dm['lastMessage']
+                    ):
+                        handled += 1
+        return handled
+
+    def apply_config(self, config_rc: Dict[str, Any]) -> None:
+        """Применить изменившиеся параметры запросов без перезапуска"""
+        self.request_timeout = config_rc['request_timeout']
+        self.max_retries = config_rc['max_retries']
+        self.rate_limiter.configure(config_rc['rate_limits'])
+        self.polling.configure(
+            config_rc['poll_interval'], config_rc['idle_poll_interval']
+        )
 
-            # Все заново
-            self.creation_stage = 0
+    def owns_room(self, room_id: str) -> bool:
+        """Проверить, что комнату обрабатывает этот процесс бота"""
+        return self.shard is None or self.shard.owns(room_id)
+
+    def is_last_worker(self) -> bool:
+        """Проверить, что других процессов бота не осталось (статус offline ставит последний)"""
+        return self.shard is None or self.shard.members == (self.shard.worker_id,)
+
+    def on_rebalance(self) -> None:
+        """Подготовиться к новому распределению комнат между воркерами"""
+        # Курсоры полученных комнат двигал их прежний владелец
+        self.cursors.load()
+        # Сообщения в полученных комнатах могут быть старше отметки времени опроса
+        self.room_sync.reset()
+        # Черновики переданных комнат теперь меняет другой воркер
+        self.conversations.retain(self.shard.is_assigned)
+
+    def handle_message(self, room_id: str, last_msg: Dict[str, Any]) -> bool:
+        """Обработать сообщение из личного чата ровно один раз; True - сообщение новое"""
+        if not self.owns_room(room_id) or not self.cursors.is_new(
+            room_id, last_msg
+        ):
+            return False
+        try:
+            with profiler.profiled(), tracing.span(
+                'bot.message', room_id=room_id
+            ):
+                self.process_user_message(room_id, last_msg)
+        finally:
+            # Курсор сдвигается и при ошибке, чтобы сообщение не обрабатывалось повторно
+            self.cursors.advance(room_id, last_msg)
+        return True
 
     @catch_exceptions
-    def process_messages(self) -> None:
-        """Обработать новое сообщение"""
-        # Список сообщений из чата
+    def process_user_message(
+        self, room_id: str, last_msg: Dict[str, Any]
+    ) -> None:
+        """Обработать сообщение пользователя в личном чате"""
+        user_id: str = last_msg['u']['_id']
+        if user_id == self.bot_id:
+            return
+
+        user_name: str = last_msg['u']['username']
+        user_exists: Optional[bool] = database.check_user_exists(user_id)
+        if user_exists:
+            if database.check_user_banned(user_id):
+                self.send_message(self.get_base_data(room_id, USER_BANNED))
+                return
+        elif user_exists is not None:
+            # Добавляем пользователя чата в БД, если он еще не добавлен;
+            # при недоступной БД (None) статус неизвестен, и добавлять нечего
+            database.insert_new_user(user_name, user_id)
+
+        message_text: str = last_msg['msg']
+        conversation: Conversation = self.conversations.get(room_id)
+        metrics.MESSAGES_PROCESSED.labels(conversation.stage).inc()
+
+        if message_text == BACK:
+            if conversation.stage > 0:
+                self.dec_creation_stage(conversation)
+        elif message_text == CREATE_TASK:
+            conversation.stage = 1
+        elif message_text == START_OVER:
+            conversation.reset()
+
+        # Перейти на новую стадию
+        try:
+            with tracing.span(
+                'bot.stage', room_id=room_id, stage=conversation.stage
+            ) as stage_span:
+                self.go_to_next_stage(
+                    conversation,
+                    message_text,
+                    user_id,
+                    user_name,
+                )
+                stage_span.set_attribute('next_stage', conversation.stage)
+        finally:
+            self.conversations.save(conversation)
+
+    @catch_exceptions
+    def replay_missed_messages(self) -> None:
+        """Обработать сообщения, пришедшие пока бот был недоступен"""
         dms: List[Dict[str, Any]] = self.get_direct_messages()
-        if dms is not None:
-            for dm in dms:
-                user_id: str = dm['lastMessage']['u']['_id']
-                room_id: str = dm['_id']
-                if 'lastMessage' in dm and user_id != self.bot_id:
-                    if database.check_user_exists(user_id):
-                        if database.check_user_banned(user_id):
-                            self.send_message(
-                                self.get_base_data(room_id, USER_BANNED)
-                            )
-                            break
-                    else:
-                        # Добавляем пользователя чата в БД, если он еще не добавлен
-                        database.insert_new_user(
-                            dm['lastMessage']['u']['username'],
-                            user_id,
-                        )
-                    last_msg: Dict[str, Any] = dm['lastMessage']
-                    message_text: str = last_msg['msg']
-
-                    if message_text == BACK:
-                        if self.creation_stage > 0:
-                            self.dec_creation_stage()
-                    elif message_text == CREATE_TASK:
-                        self.creation_stage = 1
-                    elif message_text == START_OVER:
-                        self.creation_stage = 0
-
-                    user_name: str = dm['lastMessage']['u']['username']
-
-                    # Перейти на новую стадию
-                    self.go_to_next_stage(
-                        self.creation_stage,
-                        room_id,
-                        message_text,
-                        user_id,
-                        user_name,
-                    )
+        if dms is None:
+            return
+        for dm in dms:
+            if 'lastMessage' not in dm:
+                continue
+            room_id: str = dm['_id']
+            cursor = self.cursors.get(room_id)
+            if cursor is not None and self.cursors.is_new(
+                room_id, dm['lastMessage']
+            ):
+                # Комната уже знакома - догружаем всю историю после курсора
+                messages = self.get_room_history(room_id, cursor[1])
+                for message in messages or []:
+                    if 'u' in message and not message.get('t'):
+                        self.handle_message(room_id, message)
+            else:
+                self.handle_message(room_id, dm['lastMessage'])
 
-    def dec_creation_stage(self) -> None:
+    def dec_creation_stage(self, conversation: Conversation) -> None:
         """Уменьшить индекс текущей стадии создания при нажатии кнопки Назад"""
-        if self.creation_stage == 1:
-            self.creation_stage = 0
-        elif self.creation_stage == 2:
-            self.creation_stage = 0
-        elif self.creation_stage == 3:
-            self.creation_stage = 1
-        elif self.creation_stage == 4:
-            self.creation_stage = 2
+        if conversation.stage == 1:
+            conversation.stage = 0
+        elif conversation.stage == 2:
+            conversation.stage = 0
+        elif conversation.stage == 3:
+            conversation.stage = 1
+        elif conversation.stage == 4:
+            conversation.stage = 2
 
     def run(self) -> None:
         """Основная функция, отвечающая за запуск бота"""
         self.get_auth_token()
         self.set_status(ONLINE_STATUS)
-        while True:
+        if self.shard is not None:
+            self.shard.start()
+        self.cursors.load()
+        self.outbox.start()
+        self.replay_missed_messages()
+        if self.realtime_enabled and realtime.is_available():
+            self.run_realtime()
+        else:
+            if self.realtime_enabled:
+                logging.warning(
+                    'websocket-client не установлен, бот работает в режиме опроса'
+                )
+            self.run_polling()
+
+    def run_polling(self, duration: Optional[float] = None) -> None:
+        """Опрашивать список личных чатов (бесконечно или duration секунд)"""
+        deadline: Optional[float] = (
+            None if duration is None else time.monotonic() + duration
+        )
+        while not self._stopping and (
+            deadline is None or time.monotonic() < deadline
+        ):
             try:
-                self.process_messages()
-                time.sleep(0.1)
+                handled: Optional[int] = self.process_messages()
+                # Пока пользователи пишут, опрос частый, в простое реже
+                time.sleep(self.polling.record(bool(handled)))
             except TimeoutError:
                 time.sleep(10)
+
+    def run_realtime(self) -> None:
+        """Получать сообщения через Realtime API, переключаясь на опрос при разрыве соединения"""
+        client: RealtimeClient = RealtimeClient(
+            self.websocket_url,
+            self.bot_id,
+            lambda: self.auth_token,
+            self.handle_message,
+        )
+        self._realtime_client = client
+        delay: float = REALTIME_RECONNECT_MIN_DELAY
+        while not self._stopping:
+            try:
+                client.connect()
+                delay = REALTIME_RECONNECT_MIN_DELAY
+                # Догоняем сообщения, пришедшие пока соединения не было
+                self.replay_missed_messages()
+                client.listen()
+            except RealtimeError as ex:
+                logging.warning(f'Realtime API недоступен: {ex}')
+            if self._stopping:
+                break
+
+            # Пока соединения нет, обрабатываем сообщения опросом
+            self.run_polling(delay)
+            delay = min(delay * 2, REALTIME_RECONNECT_MAX_DELAY)
+            if self.auth_token is None:
+                self.get_auth_token()
+
+    def stop(self) -> None:
+        """Остановить получение сообщений после завершения текущей обработки"""
+        self._stopping = True
+        if self._realtime_client is not None:
+            self._realtime_client.stop()
@@ -0,0 +1,314 @@
+"""Конфигурация приложения: JSON-файлы из src/data с переопределением из окружения.
+
+Файлы читаются и проверяются один раз при первом обращении, затем перечитываются
+фоновым потоком при изменении времени модификации. Переменная окружения
+PREFIX + ИМЯ_ПАРАМЕТРА (например, ROCKETCHAT_BOT_DB_PASSWORD) имеет приоритет над файлом.
+"""
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+APP_DIR: str = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR: str = os.path.dirname(APP_DIR)
+TEMPLATES_DIR: str = os.path.join(SRC_DIR, 'templates')
+STATIC_DIR: str = os.path.join(SRC_DIR, 'static')
+
+# Каталог с конфигурационными файлами можно вынести за пределы репозитория
+CONFIG_DIR_ENV = 'ROCKETCHAT_BOT_CONFIG_DIR'
+CONFIG_DIR: str = os.environ.get(CONFIG_DIR_ENV) or os.path.join(SRC_DIR, 'data')
+
+# Как часто проверять время модификации файлов (секунды)
+RELOAD_CHECK_INTERVAL = 2.0
+
+# Значения переменных окружения, которые считаются истиной
+TRUE_VALUES: Tuple[str, ...] = ('1', 'true', 'yes', 'on')
+
+# Отметка обязательного параметра
+REQUIRED: Any = object()
+
+
+class ConfigError(Exception):
+    """Конфигурационный файл отсутствует, поврежден или не прошел проверку"""
+
+
+class Option:
+    """Описание параметра конфигурации: допустимые типы, значение по умолчанию, варианты"""
+
+    def __init__(
+        self,
+        types: Any,
+        default: Any = REQUIRED,
+        choices: Optional[Tuple[Any, ...]] = None,
+    ):
+        self.types: Tuple[type, ...] = (
+            types if isinstance(types, tuple) else (types,)
+        )
+        self.default: Any = default
+        self.choices: Optional[Tuple[Any, ...]] = choices
+
+    def parse_env(self, raw: str) -> Any:
+        """Преобразовать строку из переменной окружения к типу параметра"""
+        if bool in self.types:
+            return raw.strip().lower() in TRUE_VALUES
+        if dict in self.types or list in self.types:
+            return json.loads(raw)
+        for option_type in (int, float):
+            if option_type in self.types:
+                try:
+                    return option_type(raw)
+                except ValueError:
+                    if str not in self.types:
+                        raise
+        return raw
+
+    def validate(self, name: str, value: Any) -> Any:
+        """Проверить значение и вернуть его с учетом значения по умолчанию"""
+        if value is None:
+            if self.default is REQUIRED:
+                raise ConfigError(f'Не задан обязательный параметр {name}')
+            return self.default
+        # bool - подкласс int, но как число его не принимаем
+        matches: bool = any(
+            isinstance(value, option_type)
+            and not (isinstance(value, bool) and option_type is not bool)
+            for option_type in self.types
+        )
+        if not matches and float in self.types and type(value) is int:
+            matches = True
+        if not matches:
+            expected: str = ', '.join(t.__name__ for t in self.types)
+            raise ConfigError(
+                f'Параметр {name} должен иметь тип {expected}, получено {value!r}'
+            )
+        if isinstance(value, str) and int in self.types and value.strip():
+            # Число, записанное строкой (например, порт "3306"): пустая строка
+            # означает значение по умолчанию, остальное должно быть числом
+            try:
+                value = int(value)
+            except ValueError:
+                raise ConfigError(
+                    f'Параметр {name} должен быть числом, получено {value!r}'
+                ) from None
+        if self.choices is not None and value not in self.choices:
+            raise ConfigError(
+                f'Параметр {name} должен быть одним из {self.choices}, получено {value!r}'
+            )
+        return value
+
+
+class ConfigSection:
+    """Параметры из одного конфигурационного файла"""
+
+    def __init__(
+        self, filename: str, env_prefix: str, options: Dict[str, Option]
+    ):
+        self.filename: str = filename
+        self.env_prefix: str = env_prefix
+        self.options: Dict[str, Option] = options
+        self._values: Optional[Dict[str, Any]] = None
+        self._mtime: Optional[float] = None
+        self._lock: threading.Lock = threading.Lock()
+        self._subscribers: List[Callable[['ConfigSection'], None]] = []
+
+    @property
+    def path(self) -> str:
+        return os.path.join(CONFIG_DIR, self.filename)
+
+    def read(self) -> Tuple[Dict[str, Any], float]:
+        """Прочитать файл, применить переменные окружения и проверить значения"""
+        try:
+            mtime: float = os.stat(self.path).st_mtime
+            with open(self.path) as config_file:
+                data: Any = json.load(config_file)
+        except FileNotFoundError as ex:
+            raise ConfigError(f'Не удалось найти конфигурационный файл: {ex}') from ex
+        except json.JSONDecodeError as ex:
+            raise ConfigError(
+                f'Ошибка декодирования JSON в файле {self.filename}: {ex}'
+            ) from ex
+        if not isinstance(data, dict):
+            raise ConfigError(f'Файл {self.filename} должен содержать JSON-объект')
+
+        values: Dict[str, Any] = {}
+        for name, option in self.options.items():
+            value: Any = data.get(name)
+            env_name: str = f'{self.env_prefix}{name.upper()}'
+            raw: Optional[str] = os.environ.get(env_name)
+            if raw is not None:
+                try:
+                    value = option.parse_env(raw)
+                except ValueError as ex:
+                    raise ConfigError(
+                        f'Некорректное значение переменной {env_name}: {ex}'
+                    ) from ex
+            values[name] = option.validate(f'{self.filename}:{name}', value)
+        for name in data.keys() - self.options.keys():
+            logging.warning(f'Неизвестный параметр {name} в файле {self.filename}')
+        return values, mtime
+
+    def load(self) -> Dict[str, Any]:
+        """Получить параметры, прочитав файл при первом обращении"""
+        if self._values is None:
+            with self._lock:
+                if self._values is None:
+                    self._values, self._mtime = self.read()
+        return self._values
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать файл, если он изменился; при ошибке оставить прежние параметры"""
+        if self._values is None:
+            return False
+        try:
+            current_mtime: float = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if current_mtime == self._mtime:
+            return False
+        with self._lock:
+            try:
+                values, mtime = self.read()
+            except ConfigError as ex:
+                # Исправленный файл будет прочитан при следующем изменении
+                self._mtime = current_mtime
+                logging.error(f'Конфигурация {self.filename} не применена: {ex}')
+                return False
+            changed: bool = values != self._values
+            self._values, self._mtime = values, mtime
+        if not changed:
+            return False
+        logging.info(f'Конфигурация {self.filename} перечитана')
+        for callback in self._subscribers:
+            try:
+                callback(self)
+            except Exception as ex:
+                logging.exception(
+                    f'Ошибка применения конфигурации {self.filename}: {ex}'
+                )
+        return True
+
+    def subscribe(self, callback: Callable[['ConfigSection'], None]) -> None:
+        """Вызывать callback после каждого успешного перечитывания файла"""
+        self._subscribers.append(callback)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self.load())
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_') or name not in self.__dict__.get('options', {}):
+            raise AttributeError(name)
+        return self.load()[name]
+
+
+class Settings:
+    """Все конфигурационные файлы приложения и фоновое отслеживание их изменений"""
+
+    def __init__(self, sections: Dict[str, ConfigSection]):
+        self.sections: Dict[str, ConfigSection] = sections
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __getattr__(self, name: str) -> ConfigSection:
+        if name.startswith('_') or name not in self.__dict__.get('sections', {}):
+            raise AttributeError(name)
+        return self.sections[name]
+
+    def load(self, *names: str) -> None:
+        """Прочитать и проверить указанные (или все) файлы, чтобы ошибка проявилась при запуске"""
+        for name in names or self.sections:
+            self.sections[name].load()
+
+    def reload_if_changed(self) -> None:
+        for section in self.sections.values():
+            section.reload_if_changed()
+
+    def start_watching(self, interval: float = RELOAD_CHECK_INTERVAL) -> None:
+        """Запустить фоновую проверку изменений файлов"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._watch, args=(interval,), name='settings-watcher', daemon=True
+        )
+        self._thread.start()
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop_event.wait(interval):
+            self.reload_if_changed()
+
+    def stop_watching(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+BOT_OPTIONS: Dict[str, Option] = {
+    'base_url': Option(str),
+    'username': Option(str),
+    'password': Option(str),
+    'bot_id': Option(str),
+    'request_timeout': Option(float, 10.0),
+    'max_retries': Option(int, 3),
+    'rate_limits': Option(dict, None),
+    'poll_interval': Option(float, 0.1),
+    'idle_poll_interval': Option(float, 2.0),
+    'runtime': Option(str, 'thread', choices=('thread', 'async')),
+    'max_concurrency': Option(int, 16),
+    'executor_workers': Option(int, 16),
+    'realtime': Option(bool, False),
+    'websocket_url': Option(str, None),
+    'conversation_idle_timeout': Option(float, 3600.0),
+    'conversation_max_size': Option(int, 10000),
+    'conversation_persist': Option(bool, False),
+    'sharding': Option(bool, False),
+    'worker_id': Option(str, None),
+    'shard_heartbeat_interval': Option(float, 5.0),
+    'shard_lease_timeout': Option(float, 15.0),
+    'tracing_exporter': Option(str, None, choices=('file', 'otlp')),
+    'tracing_file': Option(str, 'traces.jsonl'),
+    'tracing_endpoint': Option(str, None),
+    'tracing_sample_rate': Option(float, 1.0),
+}
+JIRA_OPTIONS: Dict[str, Option] = {
+    'url': Option(str),
+    'jira_token': Option(str),
+    'timeout': Option(float, 10.0),
+    'pool_size': Option(int, 10),
+    'idempotency_labels': Option(bool, True),
+}
+DB_OPTIONS: Dict[str, Option] = {
+    'drivername': Option(str),
+    'async_drivername': Option(str, None),
+    'username': Option(str, ''),
+    'password': Option(str, ''),
+    'host': Option(str, ''),
+    'port': Option((int, str), ''),
+    'database': Option(str),
+    'pool_size': Option(int, 5),
+    'max_overflow': Option(int, 10),
+    'pool_timeout': Option(float, 30.0),
+    'pool_recycle': Option(int, 3600),
+    'pool_pre_ping': Option(bool, True),
+}
+WEB_OPTIONS: Dict[str, Option] = {
+    'host': Option(str, '127.0.0.1'),
+    'port': Option(int, 8000),
+    'workers': Option(int, 1),
+    'drain_timeout': Option(float, 30.0),
+    'bot_metrics_port': Option(int, None),
+    'admin_token': Option(str, None),
+}
+
+# Общие для всех модулей процесса параметры
+settings: Settings = Settings(
+    {
+        'bot': ConfigSection('config_bot.json', 'ROCKETCHAT_BOT_', BOT_OPTIONS),
+        'jira': ConfigSection('config_jira.json', 'ROCKETCHAT_BOT_JIRA_', JIRA_OPTIONS),
+        'db': ConfigSection('config_mysql.json', 'ROCKETCHAT_BOT_DB_', DB_OPTIONS),
+        'web': ConfigSection(
+            'config_uvicorn.json', 'ROCKETCHAT_BOT_WEB_', WEB_OPTIONS
+        ),
+    }
+)
@@ -0,0 +1,177 @@
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import database
+
+# Как часто обновлять отметку о жизни воркера (секунды)
+HEARTBEAT_INTERVAL = 5.0
+# Через сколько секунд без отметки воркер считается упавшим
+LEASE_TIMEOUT = 15.0
+# Число виртуальных узлов на воркер в кольце
+RING_REPLICAS = 100
+
+
+def get_hash(key: str) -> int:
+    """Получить стабильный между процессами хэш строки"""
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+def get_default_worker_id() -> str:
+    """Получить id воркера, уникальный в пределах кластера"""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def utcnow() -> datetime:
+    # Отметки сравниваются между хостами, поэтому хранятся в UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class HashRing:
+    """Консистентное хэширование: при смене состава переезжает лишь доля комнат"""
+
+    def __init__(self, nodes: List[str], replicas: int = RING_REPLICAS):
+        self.nodes: Tuple[str, ...] = tuple(sorted(nodes))
+        points: List[Tuple[int, str]] = sorted(
+            (get_hash(f'{node}#{index}'), node)
+            for node in self.nodes
+            for index in range(replicas)
+        )
+        self._hashes: List[int] = [point for point, _ in points]
+        self._owners: List[str] = [node for _, node in points]
+
+    def get_node(self, key: str) -> Optional[str]:
+        """Получить воркер, которому принадлежит ключ"""
+        if not self._hashes:
+            return None
+        index: int = bisect.bisect(self._hashes, get_hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardCoordinator:
+    """Распределение комнат между воркерами бота через общую таблицу bot_workers"""
+
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        heartbeat_interval: float = HEARTBEAT_INTERVAL,
+        lease_timeout: float = LEASE_TIMEOUT,
+        on_rebalance: Optional[Callable[[], None]] = None,
+    ):
+        self.worker_id: str = worker_id or get_default_worker_id()
+        self.heartbeat_interval: float = heartbeat_interval
+        self.lease_timeout: float = lease_timeout
+        # Вызывается, когда новое распределение комнат вступает в силу
+        self.on_rebalance: Optional[Callable[[], None]] = on_rebalance
+        # До регистрации в кластере воркер не владеет ни одной комнатой
+        self.ring: HashRing = HashRing([])
+        self._previous_ring: Optional[HashRing] = None
+        self._settled: bool = False
+        self._last_heartbeat: float = 0.0
+        self.rebalances: int = 0
+        self._stop_event: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def members(self) -> Tuple[str, ...]:
+        return self.ring.nodes
+
+    def is_assigned(self, room_id: str) -> bool:
+        """Проверить, что комната закреплена за этим воркером в текущем кольце"""
+        return self.ring.get_node(room_id) == self.worker_id
+
+    def owns(self, room_id: str) -> bool:
+        """Проверить, что комнату обрабатывает этот воркер"""
+        if time.monotonic() - self._last_heartbeat > self.lease_timeout:
+            # Аренду не удалось продлить - комнаты могли уже забрать другие воркеры
+            return False
+        if not self.is_assigned(room_id):
+            return False
+        if self._settled:
+            return True
+        # Пока остальные воркеры не узнали о новом составе, берем только свои старые комнаты
+        previous: Optional[HashRing] = self._previous_ring
+        return previous is not None and previous.get_node(room_id) == self.worker_id
+
+    def heartbeat(self) -> bool:
+        """Продлить аренду воркера и перечитать состав; вернуть True при смене состава"""
+        started_at: float = time.monotonic()
+        now: datetime = utcnow()
+        if not database.heartbeat_worker(self.worker_id, now):
+            return False
+        deadline: datetime = now - timedelta(seconds=self.lease_timeout)
+        members: Optional[List[str]] = database.get_live_workers(deadline)
+        if members is None:
+            return False
+        self._last_heartbeat = started_at
+        if self.worker_id not in members:
+            members.append(self.worker_id)
+        if tuple(sorted(members)) == self.ring.nodes:
+            return False
+        logging.info(
+            f'Состав воркеров изменился: {", ".join(sorted(members))}'
+        )
+        self._previous_ring = self.ring
+        self._settled = False
+        self.ring = HashRing(members)
+        self.rebalances += 1
+        return True
+
+    def settle(self) -> None:
+        """Ввести в действие новое распределение комнат"""
+        if self.on_rebalance is not None:
+            self.on_rebalance()
+        self._settled = True
+        self._previous_ring = None
+
+    def start(self) -> None:
+        """Зарегистрировать воркер и запустить фоновое продление аренды"""
+        if self._thread is not None:
+            return
+        self.heartbeat()
+        if len(self.members) > 1:
+            # Даем остальным воркерам один интервал, чтобы отпустить наши комнаты
+            self._stop_event.wait(self.heartbeat_interval)
+        self.settle()
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='shard-heartbeat', daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.heartbeat_interval):
+            try:
+                if self.heartbeat():
+                    # Даем остальным воркерам один интервал, чтобы отпустить комнаты
+                    if self._stop_event.wait(self.heartbeat_interval):
+                        return
+                    self.settle()
+                database.delete_workers_before(
+                    utcnow() - timedelta(seconds=self.lease_timeout * 4)
+                )
+            except Exception as ex:
+                logging.exception(f'Ошибка продления аренды воркера: {ex}')
+
+    def stop(self) -> None:
+        """Остановить продление аренды и выйти из кластера, отдав комнаты остальным"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        database.delete_worker(self.worker_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить состояние воркера в кластере"""
+        return {
+            'worker_id': self.worker_id,
+            'members': list(self.members),
+            'settled': self._settled,
+            'rebalances': self.rebalances,
+        }
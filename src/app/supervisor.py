@@ -0,0 +1,179 @@
+"""Супервизор: веб-сервер с несколькими воркерами uvicorn и бот в отдельных процессах.
+
+Запуск из корня репозитория:
+    python src/app/supervisor.py
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from settings import APP_DIR, ConfigSection, settings
+
+# Переменная окружения веб-процессов: бот в них не запускается
+WEB_ONLY_ENV = 'ROCKETCHAT_BOT_WEB_ONLY'
+
+# Границы задержки перед перезапуском упавшего процесса (секунды)
+RESTART_MIN_DELAY = 1.0
+RESTART_MAX_DELAY = 60.0
+# Процесс, проработавший дольше, считается стабильным и задержка сбрасывается
+STABLE_UPTIME = 60.0
+# Сколько ждать корректного завершения процессов после сигнала (секунды)
+DRAIN_TIMEOUT = 30.0
+# Как часто проверять состояние процессов (секунды)
+CHECK_INTERVAL = 0.5
+
+
+class ChildProcess:
+    """Дочерний процесс с перезапуском при падении и растущей задержкой"""
+
+    def __init__(
+        self, name: str, args: List[str], env: Optional[Dict[str, str]] = None
+    ):
+        self.name: str = name
+        self.args: List[str] = args
+        self.env: Optional[Dict[str, str]] = env
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at: float = 0.0
+        self.restart_at: float = 0.0
+        self.restart_delay: float = RESTART_MIN_DELAY
+        self.restarts: int = 0
+
+    def start(self) -> None:
+        """Запустить процесс"""
+        env: Dict[str, str] = dict(os.environ, **(self.env or {}))
+        # Отдельная сессия: сигналы с терминала получает только супервизор и сам пересылает их
+        self.process = subprocess.Popen(
+            self.args, env=env, start_new_session=True
+        )
+        self.started_at = time.monotonic()
+        logging.info(f'Запущен процесс {self.name} (pid {self.process.pid})')
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def check(self) -> None:
+        """Перезапустить процесс, если он завершился, выдержав задержку"""
+        if self.is_running():
+            return
+        now: float = time.monotonic()
+        if self.process is not None:
+            uptime: float = now - self.started_at
+            logging.warning(
+                f'Процесс {self.name} завершился с кодом {self.process.returncode} '
+                f'через {uptime:.1f} с, перезапуск через {self.restart_delay:.1f} с'
+            )
+            if uptime >= STABLE_UPTIME:
+                self.restart_delay = RESTART_MIN_DELAY
+            self.restart_at = now + self.restart_delay
+            self.restart_delay = min(self.restart_delay * 2, RESTART_MAX_DELAY)
+            self.process = None
+        if now >= self.restart_at:
+            self.restarts += 1
+            self.start()
+
+    def send_signal(self, signum: int) -> None:
+        if self.is_running():
+            self.process.send_signal(signum)
+
+    def wait(self, timeout: float) -> bool:
+        """Дождаться завершения процесса; вернуть False, если не успел"""
+        if self.process is None:
+            return True
+        try:
+            self.process.wait(timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    def kill(self) -> None:
+        if self.is_running():
+            logging.warning(f'Процесс {self.name} не завершился вовремя')
+            self.process.kill()
+            self.process.wait()
+
+
+class Supervisor:
+    """Запускает дочерние процессы, перезапускает упавшие и пересылает им сигналы"""
+
+    def __init__(
+        self, children: List[ChildProcess], drain_timeout: float = DRAIN_TIMEOUT
+    ):
+        self.children: List[ChildProcess] = children
+        self.drain_timeout: float = drain_timeout
+        self._stopping: bool = False
+
+    def handle_signal(self, signum: int, frame: Any) -> None:
+        logging.info(f'Получен сигнал {signal.Signals(signum).name}, завершение')
+        self._stopping = True
+
+    def run(self) -> None:
+        """Работать до получения SIGTERM/SIGINT, затем корректно остановить процессы"""
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        for child in self.children:
+            child.start()
+        try:
+            while not self._stopping:
+                for child in self.children:
+                    child.check()
+                time.sleep(CHECK_INTERVAL)
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        """Переслать SIGTERM и дождаться завершения: бот дописывает очереди и ставит статус offline"""
+        for child in self.children:
+            child.send_signal(signal.SIGTERM)
+        deadline: float = time.monotonic() + self.drain_timeout
+        for child in self.children:
+            if not child.wait(max(0.0, deadline - time.monotonic())):
+                child.kill()
+
+
+def create_children(config_uvicorn: ConfigSection) -> List[ChildProcess]:
+    """Описать процессы веб-сервера и бота"""
+    web: ChildProcess = ChildProcess(
+        'web',
+        [
+            sys.executable,
+            '-m',
+            'uvicorn',
+            'main:app',
+            '--app-dir',
+            APP_DIR,
+            '--host',
+            config_uvicorn.host,
+            '--port',
+            str(config_uvicorn.port),
+            '--workers',
+            str(config_uvicorn.workers),
+            '--timeout-graceful-shutdown',
+            str(int(config_uvicorn.drain_timeout)),
+        ],
+        env={WEB_ONLY_ENV: '1'},
+    )
+    bot: ChildProcess = ChildProcess(
+        'bot', [sys.executable, os.path.join(APP_DIR, 'main.py'), 'bot']
+    )
+    return [web, bot]
+
+
+def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO, format='%(asctime)s supervisor %(message)s'
+    )
+    # Дочерние процессы проверяют конфигурацию сами, но падать в цикле перезапусков
+    # из-за ошибки в файле бессмысленно - проверяем заранее
+    settings.load()
+    supervisor: Supervisor = Supervisor(
+        create_children(settings.web), settings.web.drain_timeout
+    )
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,408 @@
+"""Трассировка обработки сообщений: спаны с атрибутами и экспорт в файл или коллектор.
+
+Файловый экспорт пишет по одному JSON-объекту на строку, экспорт в коллектор
+отправляет спаны в формате OTLP/HTTP JSON (OpenTelemetry Collector, Jaeger, Tempo).
+Пока экспорт не настроен, span() почти ничего не стоит.
+"""
+import asyncio
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+from sqlalchemy import event
+
+from settings import ConfigError
+
+SERVICE_NAME = 'rocketchat-jira-bot'
+# Максимум спанов в очереди на экспорт: при переполнении новые спаны отбрасываются
+MAX_QUEUE_SIZE = 10000
+# Размер пачки и интервал экспорта (секунды)
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL = 1.0
+# Таймаут отправки в коллектор (секунды)
+EXPORT_TIMEOUT = 5.0
+# Сколько символов SQL-запроса сохранять в атрибуте спана
+MAX_STATEMENT_LENGTH = 300
+
+FILE_EXPORTER = 'file'
+OTLP_EXPORTER = 'otlp'
+
+# Статусы спана в терминах OTLP
+STATUS_UNSET = 0
+STATUS_ERROR = 2
+
+# Текущий спан потока или задачи asyncio
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar(
+    'current_span', default=None
+)
+
+
+class Span:
+    """Отрезок работы с именем, атрибутами и ссылкой на родителя"""
+
+    __slots__ = (
+        'name',
+        'trace_id',
+        'span_id',
+        'parent_id',
+        'sampled',
+        'attributes',
+        'status',
+        'start_ns',
+        'end_ns',
+    )
+
+    def __init__(
+        self,
+        name: str,
+        parent: Optional['Span'],
+        sampled: bool,
+        attributes: Dict[str, Any],
+    ):
+        self.name: str = name
+        self.trace_id: str = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id: str = os.urandom(8).hex()
+        self.parent_id: Optional[str] = parent.span_id if parent else None
+        self.sampled: bool = sampled
+        self.attributes: Dict[str, Any] = attributes
+        self.status: int = STATUS_UNSET
+        self.start_ns: int = time.time_ns()
+        self.end_ns: int = 0
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, ex: BaseException) -> None:
+        self.status = STATUS_ERROR
+        self.attributes['error.type'] = type(ex).__name__
+        self.attributes['error.message'] = str(ex)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start_ns / 1e9,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': 'error' if self.status == STATUS_ERROR else 'ok',
+            'attributes': self.attributes,
+        }
+
+
+class NoopSpan:
+    """Заглушка, которую span() отдает при выключенной трассировке"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_exception(self, ex: BaseException) -> None:
+        pass
+
+
+NOOP_SPAN: NoopSpan = NoopSpan()
+
+
+class FileExporter:
+    """Дописывает спаны в JSONL-файл"""
+
+    def __init__(self, path: str):
+        self.path: str = path
+
+    def export(self, spans: List[Span]) -> None:
+        with open(self.path, 'a', encoding='utf-8') as trace_file:
+            for span in spans:
+                trace_file.write(
+                    json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+                    + '\n'
+                )
+
+
+def get_otlp_value(value: Any) -> Dict[str, Any]:
+    """Получить значение атрибута в формате OTLP JSON"""
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpExporter:
+    """Отправляет спаны в коллектор по OTLP/HTTP JSON"""
+
+    def __init__(self, endpoint: str):
+        self.url: str = (
+            endpoint
+            if endpoint.rstrip('/').endswith('/v1/traces')
+            else f'{endpoint.rstrip("/")}/v1/traces'
+        )
+        self.session: requests.Session = requests.Session()
+
+    def export(self, spans: List[Span]) -> None:
+        payload: Dict[str, Any] = {
+            'resourceSpans': [
+                {
+                    'resource': {
+                        'attributes': [
+                            {
+                                'key': 'service.name',
+                                'value': {'stringValue': SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    'scopeSpans': [
+                        {
+                            'scope': {'name': 'tracing'},
+                            'spans': [self.encode(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        response = self.session.post(
+            self.url, json=payload, timeout=EXPORT_TIMEOUT
+        )
+        response.raise_for_status()
+
+    @staticmethod
+    def encode(span: Span) -> Dict[str, Any]:
+        encoded: Dict[str, Any] = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            # SPAN_KIND_INTERNAL
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [
+                {'key': key, 'value': get_otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            'status': {'code': span.status},
+        }
+        if span.parent_id:
+            encoded['parentSpanId'] = span.parent_id
+        return encoded
+
+
+class Tracer:
+    """Создает спаны и экспортирует завершенные пачками из фонового потока"""
+
+    def __init__(self):
+        self.exporter: Optional[Any] = None
+        self.sample_rate: float = 1.0
+        self.exported: int = 0
+        self.dropped: int = 0
+        self._queue: 'queue.Queue[Span]' = queue.Queue(MAX_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event: threading.Event = threading.Event()
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def configure(self, exporter: Optional[Any], sample_rate: float = 1.0) -> None:
+        """Задать экспорт (None выключает трассировку) и долю сохраняемых трасс"""
+        self.flush()
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        if exporter is not None:
+            self.start()
+
+    def start_span(self, name: str, attributes: Dict[str, Any]) -> Span:
+        parent: Optional[Span] = _current_span.get()
+        # Решение о сохранении принимается для трассы целиком в корневом спане
+        sampled: bool = (
+            parent.sampled if parent else random.random() < self.sample_rate
+        )
+        return Span(name, parent, sampled, attributes)
+
+    def end_span(self, span: Span) -> None:
+        span.end_ns = time.time_ns()
+        if not span.sampled or self.exporter is None:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='trace-exporter', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(EXPORT_INTERVAL):
+            self.flush()
+
+    def flush(self) -> None:
+        """Экспортировать все накопленные спаны"""
+        with self._lock:
+            exporter: Optional[Any] = self.exporter
+            while not self._queue.empty():
+                batch: List[Span] = []
+                while len(batch) < EXPORT_BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if exporter is None:
+                    continue
+                try:
+                    exporter.export(batch)
+                    self.exported += len(batch)
+                except Exception as ex:
+                    self.dropped += len(batch)
+                    logging.error(f'Не удалось экспортировать спаны: {ex}')
+
+    def shutdown(self) -> None:
+        """Остановить фоновый экспорт, предварительно выгрузив очередь"""
+        self._stop_event.set()
+        thread: Optional[threading.Thread] = self._thread
+        if thread is not None:
+            thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'queued': self._queue.qsize(),
+            'exported': self.exported,
+            'dropped': self.dropped,
+        }
+
+
+tracer: Tracer = Tracer()
+atexit.register(tracer.shutdown)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Выполнить блок внутри спана; исключение отмечает спан ошибкой и пробрасывается"""
+    if not tracer.enabled:
+        yield NOOP_SPAN
+        return
+    current: Span = tracer.start_span(name, attributes)
+    token: contextvars.Token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as ex:
+        current.record_exception(ex)
+        raise
+    finally:
+        _current_span.reset(token)
+        tracer.end_span(current)
+
+
+def traced(name: str) -> Callable:
+    """Декоратор, оборачивающий каждый вызов функции в спан"""
+
+    def decorator(func: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def use_span(parent: Optional[Span]) -> Iterator[None]:
+    """Сделать спан текущим в другом потоке или задаче (контекст туда не переносится сам)"""
+    token: contextvars.Token = _current_span.set(parent)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def record_exception(ex: BaseException) -> None:
+    """Отметить ошибкой текущий спан (для исключений, которые дальше не пробрасываются)"""
+    current: Optional[Span] = _current_span.get()
+    if current is not None:
+        current.record_exception(ex)
+
+
+def instrument_engine(engine: Any) -> None:
+    """Создавать спан на каждый SQL-запрос движка SQLAlchemy"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not tracer.enabled:
+            return
+        db_span: Span = tracer.start_span(
+            'db.query',
+            {
+                'db.system': conn.dialect.name,
+                'db.statement': statement[:MAX_STATEMENT_LENGTH],
+            },
+        )
+        conn.info.setdefault('trace_spans', []).append(db_span)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans: List[Span] = conn.info.get('trace_spans') or []
+        if spans:
+            db_span: Span = spans.pop()
+            if cursor.rowcount is not None and cursor.rowcount >= 0:
+                db_span.set_attribute('db.rows', cursor.rowcount)
+            tracer.end_span(db_span)
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        spans: List[Span] = (conn.info.get('trace_spans') or []) if conn else []
+        if spans:
+            db_span: Span = spans.pop()
+            db_span.record_exception(exception_context.original_exception)
+            tracer.end_span(db_span)
+
+
+def configure(config_rc: Dict[str, Any]) -> None:
+    """Настроить трассировку по параметрам tracing_* из конфигурации бота"""
+    exporter_name: Optional[str] = config_rc.get('tracing_exporter')
+    exporter: Optional[Any] = None
+    if exporter_name == FILE_EXPORTER:
+        exporter = FileExporter(config_rc['tracing_file'])
+    elif exporter_name == OTLP_EXPORTER:
+        if not config_rc.get('tracing_endpoint'):
+            raise ConfigError('Для экспорта otlp нужно задать tracing_endpoint')
+        exporter = OtlpExporter(config_rc['tracing_endpoint'])
+    tracer.configure(exporter, config_rc.get('tracing_sample_rate', 1.0))
+    if exporter is not None:
+        logging.info(f'Трассировка включена: {exporter_name}')
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class UserProfile:
+    """Класс для представления закэшированных данных пользователя"""
+
+    __slots__ = ('exists', 'banned', 'is_admin')
+
+    def __init__(self, exists: bool, banned: bool, is_admin: bool):
+        self.exists: bool = exists
+        self.banned: bool = banned
+        self.is_admin: bool = is_admin
+
+
+class UserCache:
+    """LRU-кэш профилей пользователей Rocket.Chat с ограниченным временем жизни записей"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size: int = max_size
+        self.ttl: float = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+        self._items: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[UserProfile]:
+        """Получить профиль пользователя, если он есть в кэше и не устарел"""
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._items[user_id]
+                self.misses += 1
+                return None
+            self._items.move_to_end(user_id)
+            self.hits += 1
+            return item[1]
+
+    def put(self, user_id: str, profile: UserProfile) -> None:
+        """Сохранить профиль пользователя, вытеснив самую старую запись при переполнении"""
+        with self._lock:
+            self._items[user_id] = (time.monotonic() + self.ttl, profile)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id: str) -> None:
+        """Удалить профиль пользователя из кэша"""
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def clear(self) -> None:
+        """Очистить кэш"""
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить статистику попаданий и промахов"""
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
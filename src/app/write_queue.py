@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+# Задержка повтора записи после временной ошибки БД: начальная и максимальная (секунды)
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+
+class WriteBehindQueue:
+    """Очередь отложенной записи: накапливает вставки и сбрасывает их пачками в фоне"""
+
+    def __init__(
+        self,
+        flush_func: Callable[[List[Dict[str, Any]]], None],
+        flush_size: int = 100,
+        flush_interval: float = 1.0,
+        is_transient: Callable[[Exception], bool] = lambda ex: False,
+        on_drop: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        # flush_func(rows) записывает строки одной транзакцией или выбрасывает
+        # исключение. После временной ошибки (is_transient) строки возвращаются
+        # в очередь, иначе пишутся по одной, и строки, которые не удалось
+        # записать, отбрасываются с вызовом on_drop(строка)
+        self.flush_func = flush_func
+        self.flush_size: int = flush_size
+        self.flush_interval: float = flush_interval
+        self.is_transient: Callable[[Exception], bool] = is_transient
+        self.on_drop: Optional[Callable[[Dict[str, Any]], None]] = on_drop
+        self.flushes: int = 0
+        self.rows_written: int = 0
+        self.rows_dropped: int = 0
+        self.retries: int = 0
+        self._rows: List[Dict[str, Any]] = []
+        self._retry_delay: float = 0.0
+        self._retry_at: float = 0.0
+        self._condition: threading.Condition = threading.Condition()
+        self._flush_lock: threading.Lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping: bool = False
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        """Поставить строку в очередь на вставку"""
+        self.start()
+        with self._condition:
+            self._rows.append(row)
+            if len(self) >= self.flush_size:
+                self._condition.notify()
+
+    def start(self) -> None:
+        """Запустить фоновый поток записи, если он еще не запущен"""
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(
+                    target=self._run, name='write-behind', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._stopping:
+                    retry_wait: float = self._retry_at - time.monotonic()
+                    if retry_wait > 0:
+                        # После ошибки БД пачка ждет повтора, даже если очередь полна
+                        self._condition.wait(retry_wait)
+                        if not self._stopping:
+                            continue
+                    elif len(self) < self.flush_size:
+                        self._condition.wait(self.flush_interval)
+                stopping: bool = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def flush(self) -> bool:
+        """Записать все накопленные строки; False - часть строк отложена до повтора"""
+        with self._flush_lock:
+            with self._condition:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return True
+            try:
+                self.flush_func(rows)
+            except Exception as ex:
+                if self.is_transient(ex):
+                    self._retry_later(rows, ex)
+                    return False
+                logging.warning(
+                    f'Не удалось записать пачку из {len(rows)} строк, '
+                    f'строки будут записаны по одной: {ex}'
+                )
+                return self._flush_rows(rows)
+            self._on_written(len(rows))
+            return True
+
+    def _flush_rows(self, rows: List[Dict[str, Any]]) -> bool:
+        """Записать строки по одной, чтобы отбросить только те, что не проходят в БД"""
+        for index, row in enumerate(rows):
+            try:
+                self.flush_func([row])
+            except Exception as ex:
+                if self.is_transient(ex):
+                    self._retry_later(rows[index:], ex)
+                    return False
+                self._drop(row, ex)
+                continue
+            self._on_written(1)
+        return True
+
+    def _on_written(self, count: int) -> None:
+        self.flushes += 1
+        self.rows_written += count
+        self._retry_delay = 0.0
+        self._retry_at = 0.0
+
+    def _drop(self, row: Dict[str, Any], ex: Exception) -> None:
+        self.rows_dropped += 1
+        logging.error(f'Строка {row} отброшена: {ex}')
+        if self.on_drop is not None:
+            try:
+                self.on_drop(row)
+            except Exception:
+                logging.exception('Ошибка при обработке отброшенной строки')
+
+    def _retry_later(self, rows: List[Dict[str, Any]], ex: Exception) -> None:
+        """Вернуть строки в начало очереди и отложить запись с растущей задержкой"""
+        self.retries += 1
+        self._retry_delay = min(
+            MAX_RETRY_DELAY, max(RETRY_DELAY, self._retry_delay * 2)
+        )
+        self._retry_at = time.monotonic() + self._retry_delay
+        with self._condition:
+            self._rows[:0] = rows
+        logging.error(
+            f'Не удалось записать {len(rows)} строк, '
+            f'повтор через {self._retry_delay:g} с: {ex}'
+        )
+
+    def stop(self) -> None:
+        """Остановить фоновый поток, предварительно записав все накопленное"""
+        with self._condition:
+            thread: Optional[threading.Thread] = self._thread
+            self._stopping = True
+            self._condition.notify()
+        if thread is not None:
+            thread.join()
+            self._thread = None
+        if not self.flush():
+            # Повторять некому: процесс завершается
+            logging.error(f'При остановке не записано строк: {len(self)}')
+
+    def stats(self) -> Dict[str, Any]:
+        """Получить статистику очереди"""
+        return {
+            'pending': len(self),
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'rows_dropped': self.rows_dropped,
+            'retries': self.retries,
+        }
@@ -0,0 +1,225 @@
+"""Нагрузочный тест бота на локальных фейковых серверах Rocket.Chat и Jira.
+
+Запуск из корня репозитория:
+    python src/bench/benchmark.py --users 100 --rc-latency 5 --jira-latency 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+)
+
+import database  # noqa: E402
+import rocketchat_bot  # noqa: E402
+import tracing  # noqa: E402
+from conversation import ConversationStore  # noqa: E402
+from fake_servers import FakeJira, FakeRocketChat, SimulatedUser  # noqa: E402
+from jira_client import jira_client  # noqa: E402
+from project_catalog import project_catalog  # noqa: E402
+from rocketchat_bot import CREATE_TASK, POLL_INTERVAL, RocketChatBot  # noqa: E402
+
+BOT_ID = 'bench-bot'
+PROJECTS = [('AL', 'Alpha'), ('BT', 'Beta'), ('GM', 'Gamma')]
+
+
+def get_script(index: int) -> List[str]:
+    """Получить реплики пользователя для полного диалога создания задачи"""
+    return [
+        'Привет',
+        CREATE_TASK,
+        PROJECTS[index % len(PROJECTS)][1],
+        f'Задача {index}',
+        f'Описание задачи {index}',
+    ]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Получить перцентиль по методу ближайшего ранга"""
+    if not values:
+        return 0.0
+    ordered: List[float] = sorted(values)
+    rank: int = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def get_peak_rss_mb() -> float:
+    """Получить пиковый объем резидентной памяти процесса (МБ)"""
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает значение в килобайтах, macOS - в байтах
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_thread_bot(bot: RocketChatBot, rc: FakeRocketChat, timeout: float) -> None:
+    """Опрашивать чаты синхронным ботом, пока все пользователи не закончат диалог"""
+    bot.get_auth_token()
+    bot.set_status(rocketchat_bot.ONLINE_STATUS)
+    bot.cursors.load()
+    bot.outbox.start()
+    deadline: float = time.monotonic() + timeout
+    while not rc.finished.is_set() and time.monotonic() < deadline:
+        bot.process_messages()
+        time.sleep(POLL_INTERVAL)
+    bot.set_status(rocketchat_bot.OFFLINE_STATUS)
+
+
+def run_async_bot(bot: Any, rc: FakeRocketChat, timeout: float) -> None:
+    """Запустить асинхронного бота и остановить его, когда все пользователи закончат"""
+
+    async def main() -> None:
+        task: asyncio.Task = asyncio.create_task(bot.run_async())
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, rc.finished.wait, timeout)
+        bot.stop()
+        await task
+
+    asyncio.run(main())
+
+
+def wait_for_issues(jira: FakeJira, count: int, timeout: float) -> None:
+    """Дождаться, пока outbox создаст в Jira задачи всех пользователей"""
+    deadline: float = time.monotonic() + timeout
+    while len(jira.issues) < count and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Прогнать симулированных пользователей через диалог и собрать показатели"""
+    rc: FakeRocketChat = FakeRocketChat(BOT_ID, args.rc_latency / 1000)
+    jira: FakeJira = FakeJira(PROJECTS, args.jira_latency / 1000)
+    rc.start()
+    jira.start()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # SQLite вместо MySQL, схема создается с нуля
+        database.configure_engine(
+            {
+                'drivername': 'sqlite',
+                'username': '',
+                'password': '',
+                'host': '',
+                'port': '',
+                'database': os.path.join(tmp_dir, 'bench.db'),
+            }
+        )
+        database.init_db()
+        database.user_cache.clear()
+
+        # Бот подключается к фейковой Jira так же, как к настоящей
+        os.environ['ROCKETCHAT_BOT_JIRA_URL'] = jira.url
+        os.environ['ROCKETCHAT_BOT_JIRA_JIRA_TOKEN'] = 'bench-token'
+        jira_client.connect()
+        project_catalog.invalidate()
+        if args.trace:
+            tracing.tracer.configure(tracing.FileExporter(args.trace))
+
+        bot_kwargs: Dict[str, Any] = {
+            'conversations': ConversationStore(),
+            'request_timeout': 10.0,
+        }
+        if args.runtime == 'async':
+            from async_bot import AsyncRocketChatBot
+
+            bot = AsyncRocketChatBot(
+                rc.base_url,
+                'bench',
+                'bench',
+                BOT_ID,
+                max_concurrency=args.concurrency,
+                executor_workers=args.concurrency,
+                **bot_kwargs,
+            )
+        else:
+            bot = RocketChatBot(rc.base_url, 'bench', 'bench', BOT_ID, **bot_kwargs)
+
+        for index in range(args.users):
+            rc.add_user(SimulatedUser(index, get_script(index)))
+
+        start: float = time.perf_counter()
+        if args.runtime == 'async':
+            run_async_bot(bot, rc, args.timeout)
+        else:
+            run_thread_bot(bot, rc, args.timeout)
+        elapsed: float = time.perf_counter() - start
+        # Ответ "задача принята" приходит сразу, сама задача создается в фоне
+        wait_for_issues(jira, args.users, args.timeout)
+        issues_elapsed: float = time.perf_counter() - start
+        bot.outbox.stop()
+        rocketchat_bot.issue_batcher.stop()
+        database.write_queue.stop()
+        database.dispose_engine()
+        tracing.tracer.shutdown()
+
+    rc.stop()
+    jira.stop()
+
+    replies: int = len(rc.reply_latencies)
+    return {
+        'runtime': args.runtime,
+        'users': args.users,
+        'completed': rc.finished.is_set(),
+        'messages': replies,
+        'elapsed_sec': round(elapsed, 3),
+        'messages_per_sec': round(replies / elapsed, 2) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(rc.reply_latencies, 50) * 1000, 2),
+        'latency_p99_ms': round(percentile(rc.reply_latencies, 99) * 1000, 2),
+        'issues_created': len(jira.issues),
+        'issues_elapsed_sec': round(issues_elapsed, 3),
+        'rocketchat_calls': dict(rc.calls),
+        'jira_calls': dict(jira.calls),
+        'peak_rss_mb': round(get_peak_rss_mb(), 1),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='число пользователей')
+    parser.add_argument(
+        '--runtime', choices=('thread', 'async'), default='thread'
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=16, help='параллелизм async-бота'
+    )
+    parser.add_argument(
+        '--rc-latency', type=float, default=0.0, help='задержка Rocket.Chat (мс)'
+    )
+    parser.add_argument(
+        '--jira-latency', type=float, default=0.0, help='задержка Jira (мс)'
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=300.0, help='предельное время прогона (с)'
+    )
+    parser.add_argument(
+        '--trace', metavar='FILE', help='записать спаны обработки в JSONL-файл'
+    )
+    parser.add_argument('--json', action='store_true', help='вывести отчет в JSON')
+    return parser.parse_args()
+
+
+def main() -> None:
+    args: argparse.Namespace = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    report: Dict[str, Any] = run_benchmark(args)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for name, value in report.items():
+        if isinstance(value, dict):
+            print(f'{name}:')
+            for call, count in sorted(value.items()):
+                print(f'  {call}: {count}')
+        else:
+            print(f'{name}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,574 @@
+import base64
+import hashlib
+import json
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+# Строка из RFC 6455 для ответа на рукопожатие WebSocket
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# Коды операций кадров WebSocket
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def format_date(ts: int) -> str:
+    """Время в миллисекундах в формате дат REST API Rocket.Chat"""
+    moment: datetime = datetime.fromtimestamp(ts / 1000, tz=timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{ts % 1000:03d}Z'
+
+
+def parse_date(value: str) -> int:
+    moment: datetime = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return int(moment.timestamp() * 1000)
+
+
+class FakeServer:
+    """Локальный HTTP-сервер с обработчиками по методу и пути и счетчиком вызовов"""
+
+    def __init__(self, latency: float = 0.0):
+        # Искусственная задержка каждого ответа (секунды)
+        self.latency: float = latency
+        self.calls: Counter = Counter()
+        self._calls_lock: threading.Lock = threading.Lock()
+        self._routes: List[Tuple[str, str, Callable[..., Tuple[int, Any]]]] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def route(
+        self, method: str, prefix: str, handler: Callable[..., Tuple[int, Any]]
+    ) -> None:
+        """Зарегистрировать обработчик запросов, путь которых начинается с prefix"""
+        self._routes.append((method, prefix, handler))
+
+    def handle(
+        self, method: str, path: str, query: str, body: Optional[Any]
+    ) -> Tuple[int, Any]:
+        for route_method, prefix, handler in self._routes:
+            if route_method == method and path.startswith(prefix):
+                with self._calls_lock:
+                    self.calls[f'{method} {prefix}'] += 1
+                if self.latency:
+                    time.sleep(self.latency)
+                return handler(path[len(prefix):], query, body)
+        return 404, {'error': f'{method} {path} not found'}
+
+    def start(self) -> None:
+        """Запустить сервер на свободном порту в фоновом потоке"""
+        fake: FakeServer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_request(self) -> None:
+                length: int = int(self.headers.get('Content-Length') or 0)
+                raw: bytes = self.rfile.read(length) if length else b''
+                body: Optional[Any] = json.loads(raw) if raw else None
+                parts = urlsplit(self.path)
+                status, payload = fake.handle(
+                    self.command, parts.path, parts.query, body
+                )
+                data: bytes = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_request
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Остановить сервер"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class SimulatedUser:
+    """Пользователь чата, отвечающий боту следующей репликой сценария"""
+
+    def __init__(self, index: int, script: List[str]):
+        self.room_id: str = f'room-{index}'
+        self.user_id: str = f'user-{index}'
+        self.username: str = f'user{index}'
+        self.script: List[str] = script
+        self.step: int = 0
+        # Получен ответ бота на последнюю реплику сценария
+        self.done: bool = False
+        self.sent_at: float = 0.0
+        self.last_ts: int = 0
+
+    @property
+    def finished(self) -> bool:
+        """Все реплики сценария отправлены"""
+        return self.step >= len(self.script)
+
+
+class FakeRocketChat(FakeServer):
+    """Фейковый REST API Rocket.Chat с личными чатами симулированных пользователей"""
+
+    def __init__(self, bot_id: str, latency: float = 0.0):
+        super().__init__(latency)
+        self.bot_id: str = bot_id
+        self.users: Dict[str, SimulatedUser] = {}
+        self.rooms: Dict[str, Dict[str, Any]] = {}
+        # Задержки ответа бота на каждое сообщение пользователя (секунды)
+        self.reply_latencies: List[float] = []
+        self.messages_sent: int = 0
+        self.finished: threading.Event = threading.Event()
+        # Получатели каждого нового сообщения пользователя (например, FakeRealtime)
+        self.message_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._message_seq: int = 0
+        self.route('POST', '/api/v1/login', self.login)
+        self.route('POST', '/api/v1/users.setStatus', self.set_status)
+        self.route('GET', '/api/v1/im.list', self.im_list)
+        self.route('GET', '/api/v1/rooms.get', self.rooms_get)
+        self.route('GET', '/api/v1/im.history', self.im_history)
+        self.route('POST', '/api/v1/chat.postMessage', self.post_message)
+
+    @property
+    def base_url(self) -> str:
+        return f'{self.url}/api/v1/'
+
+    def add_user(self, user: SimulatedUser) -> None:
+        """Добавить пользователя и отправить первое сообщение сценария"""
+        with self._lock:
+            self.users[user.room_id] = user
+            self.rooms[user.room_id] = {
+                '_id': user.room_id,
+                't': 'd',
+                '_updatedAt': format_date(int(time.time() * 1000)),
+            }
+            self._send_next(user)
+
+    def _send_next(self, user: SimulatedUser) -> None:
+        """Опубликовать следующее сообщение пользователя как последнее в комнате"""
+        if user.finished:
+            user.done = True
+            if all(item.done for item in self.users.values()):
+                self.finished.set()
+            return
+        self._message_seq += 1
+        now: float = time.time()
+        user.last_ts = max(int(now * 1000), user.last_ts + 1)
+        message: Dict[str, Any] = {
+            '_id': f'msg-{self._message_seq}',
+            'rid': user.room_id,
+            'msg': user.script[user.step],
+            'ts': {'$date': user.last_ts},
+            'u': {'_id': user.user_id, 'username': user.username},
+        }
+        self.rooms[user.room_id]['_updatedAt'] = format_date(user.last_ts)
+        self.rooms[user.room_id]['lastMessage'] = message
+        user.sent_at = time.perf_counter()
+        user.step += 1
+        self.messages_sent += 1
+        for listener in self.message_listeners:
+            listener(dict(message))
+
+    def login(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        return 200, {'status': 'success', 'data': {'authToken': 'bench-token'}}
+
+    def set_status(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        return 200, {'success': True}
+
+    def im_list(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        params: Dict[str, List[str]] = parse_qs(query)
+        count: int = int(params.get('count', ['50'])[0])
+        offset: int = int(params.get('offset', ['0'])[0])
+        with self._lock:
+            ims: List[Dict[str, Any]] = sorted(
+                (dict(room) for room in self.rooms.values()),
+                key=lambda room: room['_updatedAt'],
+                reverse=True,
+            )
+        return 200, {
+            'ims': ims[offset:offset + count],
+            'offset': offset,
+            'count': len(ims[offset:offset + count]),
+            'total': len(ims),
+            'success': True,
+        }
+
+    def rooms_get(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        since: int = parse_date(parse_qs(query)['updatedSince'][0])
+        with self._lock:
+            rooms: List[Dict[str, Any]] = [
+                dict(room)
+                for room in self.rooms.values()
+                if parse_date(room['_updatedAt']) > since
+            ]
+        return 200, {'update': rooms, 'remove': [], 'success': True}
+
+    def im_history(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        return 200, {'messages': [], 'success': True}
+
+    def post_message(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        with self._lock:
+            # Бот адресует сообщения то через channel, то через roomId
+            room_id: Optional[str] = body.get('roomId') or body.get('channel')
+            user: Optional[SimulatedUser] = self.users.get(room_id)
+            # Ссылка на созданную задачу приходит уже после ответа на последнюю реплику
+            if user is not None and not user.done:
+                self.reply_latencies.append(time.perf_counter() - user.sent_at)
+                self._send_next(user)
+        return 200, {'success': True}
+
+
+class FakeJira(FakeServer):
+    """Фейковый REST API Jira с фиксированным набором проектов"""
+
+    def __init__(self, projects: List[Tuple[str, str]], latency: float = 0.0):
+        super().__init__(latency)
+        self.projects: List[Dict[str, str]] = [
+            {'id': str(10000 + index), 'key': key, 'name': name}
+            for index, (key, name) in enumerate(projects)
+        ]
+        self.issues: Dict[str, Dict[str, Any]] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self.route('GET', '/rest/api/2/serverInfo', self.server_info)
+        self.route('GET', '/rest/api/2/project', self.get_projects)
+        self.route('POST', '/rest/api/2/issue/bulk', self.create_issues)
+        self.route('POST', '/rest/api/2/issue', self.create_issue)
+        self.route('GET', '/rest/api/2/issue/', self.get_issue)
+        self.route('GET', '/rest/api/2/search', self.search)
+        self.route('GET', '/rest/api/2/field', self.get_fields)
+
+    def server_info(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        return 200, {
+            'baseUrl': self.url,
+            'version': '9.12.0',
+            'versionNumbers': [9, 12, 0],
+            'deploymentType': 'Server',
+        }
+
+    def get_projects(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        return 200, [
+            dict(project, self=f'{self.url}/rest/api/2/project/{project["id"]}')
+            for project in self.projects
+        ]
+
+    def create_issue(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        project_key: str = body['fields']['project']['key']
+        with self._lock:
+            issue_id: int = len(self.issues) + 1
+            key: str = f'{project_key}-{issue_id}'
+            self.issues[key] = {
+                'id': str(issue_id),
+                'key': key,
+                'self': f'{self.url}/rest/api/2/issue/{issue_id}',
+                'fields': body['fields'],
+            }
+        return 201, {'id': str(issue_id), 'key': key}
+
+    def create_issues(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        issues: List[Dict[str, Any]] = []
+        errors: List[Dict[str, Any]] = []
+        for index, issue_data in enumerate(body['issueUpdates']):
+            if not issue_data['fields']['summary']:
+                errors.append(
+                    {
+                        'failedElementNumber': index,
+                        'elementErrors': {
+                            'errors': {'summary': 'You must specify a summary'}
+                        },
+                    }
+                )
+                continue
+            status, issue = self.create_issue(path, query, issue_data)
+            issues.append(
+                dict(issue, self=f'{self.url}/rest/api/2/issue/{issue["id"]}')
+            )
+        return (400 if errors and not issues else 201), {
+            'issues': issues,
+            'errors': errors,
+        }
+
+    def get_issue(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        issue: Optional[Dict[str, Any]] = self.issues.get(path)
+        if issue is None:
+            return 404, {'errorMessages': ['Issue does not exist']}
+        return 200, issue
+
+    def get_fields(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        return 200, [{'id': 'labels', 'name': 'Labels'}]
+
+    def search(self, path: str, query: str, body: Any) -> Tuple[int, Any]:
+        issues: List[Dict[str, Any]] = list(self.issues.values())
+        # Поддерживается только поиск по метке: labels = "..."
+        jql: str = parse_qs(query).get('jql', [''])[0]
+        if jql.startswith('labels = '):
+            label: str = jql[len('labels = '):].strip('"')
+            issues = [
+                issue
+                for issue in issues
+                if label in issue['fields'].get('labels', [])
+            ]
+        return 200, {
+            'startAt': 0,
+            'maxResults': len(issues),
+            'total': len(issues),
+            'issues': issues,
+        }
+
+
+class RealtimeConnection(socketserver.StreamRequestHandler):
+    """Соединение с FakeRealtime: рукопожатие WebSocket и DDP-сообщения клиента"""
+
+    server: 'RealtimeTCPServer'
+
+    def setup(self) -> None:
+        super().setup()
+        self.fake: FakeRealtime = self.server.fake
+        self.logged_in: bool = False
+        # Имена потоков, на которые подписан клиент
+        self.subscriptions: List[str] = []
+        self._send_lock: threading.Lock = threading.Lock()
+
+    def handle(self) -> None:
+        headers: Dict[str, str] = {}
+        self.rfile.readline()
+        while True:
+            line: str = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if not self.fake.accepting:
+            self.fake.count('refused')
+            self.wfile.write(
+                b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n'
+            )
+            return
+        accept: str = base64.b64encode(
+            hashlib.sha1(
+                (headers['sec-websocket-key'] + WEBSOCKET_GUID).encode()
+            ).digest()
+        ).decode()
+        self.wfile.write(
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'.encode()
+        )
+        self.fake.add_connection(self)
+        try:
+            while True:
+                frame: Optional[Tuple[int, bytes]] = self.read_frame()
+                if frame is None:
+                    return
+                opcode, payload = frame
+                if opcode == OPCODE_CLOSE:
+                    self.write_frame(OPCODE_CLOSE, payload[:2])
+                    return
+                if opcode == OPCODE_PING:
+                    self.write_frame(OPCODE_PONG, payload)
+                elif opcode == OPCODE_TEXT:
+                    self.on_ddp(json.loads(payload))
+        except OSError:
+            return
+        finally:
+            self.fake.remove_connection(self)
+
+    def read_frame(self) -> Optional[Tuple[int, bytes]]:
+        """Прочитать кадр клиента (клиентские кадры всегда маскированы)"""
+        header: bytes = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        opcode: int = header[0] & 0x0F
+        length: int = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('>H', self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('>Q', self.rfile.read(8))[0]
+        mask: bytes = self.rfile.read(4) if header[1] & 0x80 else b'\0\0\0\0'
+        payload: bytes = bytes(
+            byte ^ mask[index % 4]
+            for index, byte in enumerate(self.rfile.read(length))
+        )
+        return opcode, payload
+
+    def write_frame(self, opcode: int, payload: bytes) -> None:
+        length: int = len(payload)
+        if length < 126:
+            header: bytes = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self.wfile.write(header + payload)
+
+    def send(self, data: Dict[str, Any]) -> None:
+        """Отправить DDP-сообщение клиенту"""
+        self.write_frame(OPCODE_TEXT, json.dumps(data).encode())
+
+    def on_ddp(self, data: Dict[str, Any]) -> None:
+        msg: Optional[str] = data.get('msg')
+        if msg == 'connect':
+            self.fake.count('connect')
+            self.send({'msg': 'connected', 'session': f'session-{id(self)}'})
+        elif msg == 'ping':
+            self.fake.count('ping')
+            self.send({'msg': 'pong'})
+        elif msg == 'pong':
+            self.fake.count('pong')
+        elif msg == 'method':
+            self.on_method(data)
+        elif msg == 'sub':
+            self.on_sub(data)
+
+    def on_method(self, data: Dict[str, Any]) -> None:
+        if data['method'] != 'login':
+            self.send(
+                {'msg': 'result', 'id': data['id'], 'error': {'error': 404}}
+            )
+            return
+        token: Optional[str] = data['params'][0].get('resume')
+        self.fake.count('login')
+        self.fake.resume_tokens.append(token)
+        if token != self.fake.auth_token:
+            self.send(
+                {
+                    'msg': 'result',
+                    'id': data['id'],
+                    'error': {'error': 403, 'reason': 'You are not logged in'},
+                }
+            )
+            return
+        self.logged_in = True
+        self.send(
+            {
+                'msg': 'result',
+                'id': data['id'],
+                'result': {'id': self.fake.bot_id, 'token': token},
+            }
+        )
+
+    def on_sub(self, data: Dict[str, Any]) -> None:
+        if not self.logged_in or data['name'] not in (
+            'stream-room-messages',
+            'stream-notify-user',
+        ):
+            self.send({'msg': 'nosub', 'id': data['id']})
+            return
+        self.fake.count(f'sub {data["name"]}')
+        self.subscriptions.append(data['name'])
+        self.send({'msg': 'ready', 'subs': [data['id']]})
+
+
+class RealtimeTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fake: 'FakeRealtime'):
+        self.fake: FakeRealtime = fake
+        super().__init__(('127.0.0.1', 0), RealtimeConnection)
+
+
+class FakeRealtime:
+    """Фейковый Realtime API Rocket.Chat: DDP поверх WebSocket на стандартной библиотеке"""
+
+    def __init__(self, bot_id: str, auth_token: str = 'bench-token'):
+        self.bot_id: str = bot_id
+        self.auth_token: str = auth_token
+        # False - отклонять новые соединения, как недоступный сервер
+        self.accepting: bool = True
+        self.calls: Counter = Counter()
+        self.resume_tokens: List[Optional[str]] = []
+        self.connections: List[RealtimeConnection] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._server: Optional[RealtimeTCPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'ws://{host}:{port}/websocket'
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.calls[name] += 1
+
+    def add_connection(self, connection: RealtimeConnection) -> None:
+        with self._lock:
+            self.connections.append(connection)
+            self.calls['connections'] += 1
+
+    def remove_connection(self, connection: RealtimeConnection) -> None:
+        with self._lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+
+    def publish(self, message: Dict[str, Any]) -> None:
+        """Разослать сообщение личного чата подписчикам stream-room-messages"""
+        event: Dict[str, Any] = {
+            'msg': 'changed',
+            'collection': 'stream-room-messages',
+            'id': 'id',
+            'fields': {
+                'eventName': '__my_messages__',
+                'args': [message, {'roomType': 'd'}],
+            },
+        }
+        for connection in list(self.connections):
+            if 'stream-room-messages' in connection.subscriptions:
+                try:
+                    connection.send(event)
+                    self.count('published')
+                except OSError:
+                    pass
+
+    def ping(self) -> None:
+        """Отправить DDP ping всем клиентам"""
+        for connection in list(self.connections):
+            try:
+                connection.send({'msg': 'ping'})
+            except OSError:
+                pass
+
+    def disconnect(self) -> None:
+        """Оборвать все соединения без закрывающего кадра"""
+        for connection in list(self.connections):
+            try:
+                connection.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self) -> None:
+        """Запустить сервер на свободном порту в фоновом потоке"""
+        self._server = RealtimeTCPServer(self)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """Остановить сервер"""
+        if self._server is not None:
+            self.disconnect()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,11 @@
+-- Исправление схемы tasks_log для существующих баз данных.
+-- Колонка project_id хранит id проекта Jira, но была объявлена как DATETIME,
+-- из-за чего вставка записей о созданных задачах завершалась ошибкой.
+-- Корректных значений в колонке быть не может, поэтому она пересоздается.
+ALTER TABLE tasks_log DROP COLUMN project_id;
+ALTER TABLE tasks_log ADD COLUMN project_id INT NOT NULL DEFAULT 0;
+ALTER TABLE tasks_log ALTER COLUMN project_id DROP DEFAULT;
+
+-- Индекс под выборку истории по проекту за период с сортировкой по времени
+CREATE INDEX ix_tasks_log_project_datetime
+    ON tasks_log (project_id, datetime_creating, id);
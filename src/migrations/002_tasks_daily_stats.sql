@@ -0,0 +1,17 @@
+-- Дневная сводка по tasks_log для статистики создания задач.
+-- Таблица создается и при запуске бота; здесь она дополнительно
+-- заполняется по уже накопленной истории.
+CREATE TABLE IF NOT EXISTS tasks_daily_stats (
+    day DATE NOT NULL,
+    project_id INT NOT NULL,
+    user INT NOT NULL,
+    tasks_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, project_id, user)
+);
+
+DELETE FROM tasks_daily_stats;
+
+INSERT INTO tasks_daily_stats (day, project_id, user, tasks_count)
+SELECT DATE(datetime_creating), project_id, user, COUNT(*)
+FROM tasks_log
+GROUP BY DATE(datetime_creating), project_id, user;
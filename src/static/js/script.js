@@ -1,3 +1,6 @@
+// Количество записей, запрашиваемых за один раз
+var PAGE_SIZE = 50;
+
 $(function () {
    moment.locale("ru"); // Если требуется локализация на русский язык
    // Инициализируем daterangepicker
@@ -26,63 +29,89 @@ $(function () {
    });
 });
 
+// Курсор следующей страницы истории и число уже выведенных строк
+var nextCursor = null;
+var rowsShown = 0;
+
 function sendData() {
-   // Обработка входных данных и отправка запроса
-   var datePicker = $("#date-range-picker").data("daterangepicker");
+   // Обработка входных данных и загрузка первой страницы
+   $("#log-table-body").empty();
+   rowsShown = 0;
+   nextCursor = null;
+   $("#load-more").hide();
+   if ($("#project-select").val() !== "") {
+      loadPage(null);
+   }
+}
+
+function exportLogs(format) {
+   // Скачать историю за выбранный период целиком
    var projectId = $("#project-select").val();
-   if (projectId !== "") {
-      var startDate = datePicker.startDate.format("YYYY-MM-DD");
-      var endDate = datePicker.endDate.format("YYYY-MM-DD");
-      // Отправляем запрос на сервер с выбранным проектом и периодом дат
-      $.ajax({
-         type: "GET",
-         url:
-            "/logs?project_id=" +
-            projectId +
-            "&startDate=" +
-            startDate +
-            "&endDate=" +
-            endDate,
-         success: function (data) {
-            fillTable(data);
-         },
-         error: function () {
-            $("#log-table-body").empty(); // Очищаем содержимое tbody при ошибке
-         },
+   if (projectId === "") {
+      return;
+   }
+   var datePicker = $("#date-range-picker").data("daterangepicker");
+   window.location.href =
+      "/logs/export?" +
+      $.param({
+         project_id: projectId,
+         startDate: datePicker.startDate.format("YYYY-MM-DD"),
+         endDate: datePicker.endDate.format("YYYY-MM-DD"),
+         format: format,
       });
-   } else {
-      // Очистить таблицу, если никакой проект не выбран
-      $("#log-table-body").empty();
+}
+
+function loadMore() {
+   // Загрузка следующей страницы по курсору
+   if (nextCursor !== null) {
+      loadPage(nextCursor);
+   }
+}
+
+function loadPage(after) {
+   var datePicker = $("#date-range-picker").data("daterangepicker");
+   var params = {
+      project_id: $("#project-select").val(),
+      startDate: datePicker.startDate.format("YYYY-MM-DD"),
+      endDate: datePicker.endDate.format("YYYY-MM-DD"),
+      limit: PAGE_SIZE,
+   };
+   if (after !== null) {
+      params.after = after;
    }
+   // Отправляем запрос на сервер с выбранным проектом и периодом дат
+   $.ajax({
+      type: "GET",
+      url: "/logs?" + $.param(params),
+      dataType: "json",
+      success: function (data) {
+         fillTable(data.items);
+         nextCursor = data.next;
+         $("#load-more").toggle(nextCursor !== null);
+      },
+      error: function () {
+         $("#log-table-body").empty(); // Очищаем содержимое tbody при ошибке
+         $("#load-more").hide();
+      },
+   });
 }
 
-function fillTable(data) {
-   var logs = JSON.parse(data);
+function fillTable(logs) {
    var tbody = $("#log-table-body");
-   // Очистить содержимое tbody перед добавлением новых записей
-   tbody.empty();
+   // Добавить записи страницы в конец таблицы
    for (var i = 0; i < logs.length; i++) {
       var log = logs[i];
-      var row =
-         "<tr>" +
-         "<td>" +
-         (i + 1) +
-         "</td>" +
-         "<td>" +
-         log.user_name +
-         "</td>" +
-         "<td>" +
-         log.user_id +
-         "</td>" +
-         "<td><a href='" +
-         log.task_link +
-         "'>" +
-         log.task +
-         "</a></td>" +
-         "<td>" +
-         log.datetime_creating +
-         "</td>" +
-         "</tr>";
+      rowsShown++;
+      var row = $("<tr>")
+         .append($("<td>").text(rowsShown))
+         .append($("<td>").text(log.user_name))
+         .append($("<td>").text(log.user_id))
+         .append(
+            $("<td>").append(
+               $("<a>").attr("href", log.task_link).text(log.task)
+            )
+         )
+         .append($("<td>").text(log.datetime_creating));
       tbody.append(row); // Добавить новую запись в tbody
    }
 }
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+import time
+from typing import Callable, Iterator
+
+import pytest
+
+ROOT_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(ROOT_DIR, 'src', 'app'),
+    os.path.join(ROOT_DIR, 'src', 'bench'),
+]
+
+import database  # noqa: E402
+import realtime  # noqa: E402
+from conversation import ConversationStore  # noqa: E402
+from fake_servers import FakeRealtime, FakeRocketChat  # noqa: E402
+from rocketchat_bot import RocketChatBot  # noqa: E402
+
+BOT_ID = 'test-bot'
+# Сколько ждать каждого шага проверки (секунды)
+STEP_TIMEOUT = 15.0
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = STEP_TIMEOUT) -> bool:
+    """Дождаться выполнения условия"""
+    deadline: float = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def db(tmp_path) -> Iterator[None]:
+    """База SQLite вместо MySQL, схема создается с нуля"""
+    database.configure_engine(
+        {
+            'drivername': 'sqlite',
+            'username': '',
+            'password': '',
+            'host': '',
+            'port': '',
+            'database': str(tmp_path / 'test.db'),
+        }
+    )
+    database.init_db()
+    database.user_cache.clear()
+    yield
+    database.write_queue.stop()
+    database.dispose_engine()
+
+
+@pytest.fixture
+def rc() -> Iterator[FakeRocketChat]:
+    server: FakeRocketChat = FakeRocketChat(BOT_ID)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def rt(rc: FakeRocketChat) -> Iterator[FakeRealtime]:
+    """Realtime API, получающий каждое новое сообщение пользователя из rc"""
+    if not realtime.is_available():
+        pytest.skip('websocket-client не установлен')
+    server: FakeRealtime = FakeRealtime(BOT_ID)
+    rc.message_listeners.append(server.publish)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def realtime_bot(db, rc: FakeRocketChat, rt: FakeRealtime) -> Iterator[RocketChatBot]:
+    """Бот, получающий сообщения через Realtime API, в фоновом потоке"""
+    bot: RocketChatBot = RocketChatBot(
+        rc.base_url,
+        'test',
+        'test',
+        BOT_ID,
+        realtime_enabled=True,
+        websocket_url=rt.url,
+        conversations=ConversationStore(),
+        request_timeout=5.0,
+    )
+    thread: threading.Thread = threading.Thread(
+        target=bot.run, name='bot', daemon=True
+    )
+    thread.start()
+    yield bot
+    bot.stop()
+    thread.join(STEP_TIMEOUT)
+    bot.outbox.stop()
@@ -0,0 +1,105 @@
+from typing import List
+
+import rocketchat_bot
+from conftest import wait_for
+from fake_servers import FakeRealtime, FakeRocketChat, SimulatedUser
+
+# Реплики пользователя: на каждое приветствие бот отвечает меню
+SCRIPT_LENGTH = 3
+
+POST_MESSAGE = 'POST /api/v1/chat.postMessage'
+
+
+def get_poll_calls(rc: FakeRocketChat) -> int:
+    """Число запросов списка чатов к REST API"""
+    return rc.calls['GET /api/v1/im.list'] + rc.calls['GET /api/v1/rooms.get']
+
+
+def is_subscribed(rt: FakeRealtime) -> bool:
+    """Бот подписан на оба потока событий"""
+    return any(
+        len(connection.subscriptions) == 2 for connection in list(rt.connections)
+    )
+
+
+def add_user(rc: FakeRocketChat, script_length: int = SCRIPT_LENGTH) -> SimulatedUser:
+    user: SimulatedUser = SimulatedUser(len(rc.users), ['Привет'] * script_length)
+    rc.add_user(user)
+    return user
+
+
+def test_messages_arrive_over_websocket(realtime_bot, rc, rt):
+    assert wait_for(lambda: is_subscribed(rt))
+    assert rt.calls['connect'] == 1
+    assert rt.resume_tokens == [rt.auth_token]
+
+    poll_calls: int = get_poll_calls(rc)
+    user: SimulatedUser = add_user(rc)
+    assert wait_for(lambda: user.done)
+    assert rt.calls['published'] >= SCRIPT_LENGTH
+    assert get_poll_calls(rc) == poll_calls
+
+    pongs: int = rt.calls['pong']
+    rt.ping()
+    assert wait_for(lambda: rt.calls['pong'] > pongs)
+
+
+def test_reconnect_resumes_session(realtime_bot, rc, rt):
+    assert wait_for(lambda: is_subscribed(rt))
+
+    rt.disconnect()
+    user: SimulatedUser = add_user(rc)
+    assert wait_for(lambda: rt.calls['connections'] >= 2 and is_subscribed(rt))
+    # Повторный вход - тем же токеном, без нового логина по паролю
+    assert rt.resume_tokens == [rt.auth_token, rt.auth_token]
+    assert rc.calls['POST /api/v1/login'] == 1
+    assert wait_for(lambda: user.done)
+
+
+def test_falls_back_to_polling_while_server_is_down(
+    realtime_bot, rc, rt, monkeypatch
+):
+    monkeypatch.setattr(rocketchat_bot, 'REALTIME_RECONNECT_MAX_DELAY', 2.0)
+    assert wait_for(lambda: is_subscribed(rt))
+
+    rt.accepting = False
+    rt.disconnect()
+    poll_calls: int = get_poll_calls(rc)
+    user: SimulatedUser = add_user(rc)
+    assert wait_for(lambda: user.done and rt.calls['refused'] >= 1)
+    assert get_poll_calls(rc) > poll_calls
+
+    connections: int = rt.calls['connections']
+    rt.accepting = True
+    assert wait_for(
+        lambda: rt.calls['connections'] > connections and is_subscribed(rt)
+    )
+    published: int = rt.calls['published']
+    user = add_user(rc)
+    assert wait_for(lambda: user.done)
+    assert rt.calls['published'] > published
+
+
+def test_duplicate_deliveries_are_handled_once(realtime_bot, rc, rt):
+    assert wait_for(lambda: is_subscribed(rt))
+    user: SimulatedUser = add_user(rc, script_length=1)
+    assert wait_for(lambda: user.done)
+    replies: int = rc.calls[POST_MESSAGE]
+
+    # То же сообщение еще раз через WebSocket и в догрузке после переподключения
+    last_message = rc.rooms[user.room_id]['lastMessage']
+    rt.publish(dict(last_message))
+    rt.disconnect()
+    assert wait_for(lambda: rt.calls['connections'] >= 2 and is_subscribed(rt))
+    assert wait_for(lambda: rc.calls['GET /api/v1/im.list'] >= 2)
+
+    # Новое сообщение обрабатывается после дубликатов - значит, они уже отброшены
+    user = add_user(rc, script_length=1)
+    assert wait_for(lambda: user.done)
+    assert rc.calls[POST_MESSAGE] == replies + 1
+    cursors: List[str] = [
+        realtime_bot.cursors.get(room_id)[0] for room_id in sorted(rc.users)
+    ]
+    assert cursors == [
+        rc.rooms[room_id]['lastMessage']['_id'] for room_id in sorted(rc.users)
+    ]